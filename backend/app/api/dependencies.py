@@ -5,42 +5,70 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from typing import Optional
+from typing import Optional, Tuple
+from uuid import UUID
 
 from app.db.database import get_db
 from app.models.user import User
 from app.core.security import decode_access_token
+from app.services.principals import principal_cache
+from app.services.sessions import session_registry
 
 security = HTTPBearer()
+# For endpoints that also serve anonymous callers
+optional_security = HTTPBearer(auto_error=False)
 
 
-async def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: AsyncSession = Depends(get_db)
-) -> User:
+def token_principal(token: str) -> Tuple[UUID, Optional[UUID]]:
     """
-    Get current authenticated user from JWT token
+    Resolve a JWT access token to (user id, session id) without a query
+
+    Raises 401 for invalid tokens and revoked sessions. Tokens issued before
+    server-side sessions existed have no session id and cannot be revoked.
     """
-    token = credentials.credentials
+    principal = principal_cache.principal_for(token)
+    if principal is None:
+        # Decode token
+        payload = decode_access_token(token)
+        if not payload or not payload.get("user_id"):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Could not validate credentials",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        session_id = payload.get("sid")
+        principal = (UUID(payload["user_id"]), UUID(session_id) if session_id else None)
+        principal_cache.remember_token(token, principal, payload.get("exp"))
 
-    # Decode token
-    payload = decode_access_token(token)
-    if not payload:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Could not validate credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+    user_id, session_id = principal
+    if session_id:
+        if session_registry.is_revoked(session_id):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Session has been revoked",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        session_registry.touch(session_id)
+
+    return principal
 
-    user_id: str = payload.get("user_id")
-    if not user_id:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Could not validate credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+
+async def authenticate_token(token: str, db: AsyncSession) -> User:
+    """
+    Resolve a JWT access token to its user
+
+    Shared by the HTTP bearer dependency and the WebSocket endpoint. Recently
+    seen tokens and users are served from the principal cache without
+    touching the database; on a cache hit the user is a detached snapshot.
+    """
+    user_id, _ = token_principal(token)
+
+    user = principal_cache.user(user_id)
+    if user is not None:
+        return user
 
     # Get user from database
+    generation = principal_cache.generation
     result = await db.execute(
         select(User).where(User.id == user_id)
     )
@@ -53,9 +81,20 @@ async def get_current_user(
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    principal_cache.remember_user(user, generation)
     return user
 
 
+async def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: AsyncSession = Depends(get_db)
+) -> User:
+    """
+    Get current authenticated user from JWT token
+    """
+    return await authenticate_token(credentials.credentials, db)
+
+
 async def get_current_admin_user(
     current_user: User = Depends(get_current_user)
 ) -> User:
@@ -71,7 +110,7 @@ async def get_current_admin_user(
 
 
 async def get_optional_user(
-    credentials: Optional[HTTPAuthorizationCredentials] = Depends(security),
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security),
     db: AsyncSession = Depends(get_db)
 ) -> Optional[User]:
     """
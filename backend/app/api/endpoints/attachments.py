@@ -0,0 +1,503 @@
+"""
+Attachment endpoints (streaming and resumable upload, ranged download)
+"""
+import re
+from typing import Optional, Tuple
+from urllib.parse import quote
+from uuid import UUID, uuid4
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import delete, select, update
+from datetime import datetime, timedelta, timezone
+
+from app.db.database import get_db
+from app.models.user import User
+from app.models.message import Message
+from app.models.group import GroupMember
+from app.models.attachment import Attachment, AttachmentBlob
+from app.models.attachment_upload import AttachmentUpload
+from app.schemas.attachment import (
+    AttachmentResponse,
+    AttachmentListResponse,
+    AttachmentUploadCreate,
+    AttachmentUploadComplete,
+    AttachmentUploadResponse
+)
+from app.api.dependencies import get_current_user
+from app.core.config import settings
+from app.services import attachment_store
+from app.services.attachment_store import AttachmentTooLarge, StagedBlob
+
+router = APIRouter()
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+async def _get_message(db: AsyncSession, message_id: UUID, user: User) -> Message:
+    """
+    Load a message the user took part in (sender, recipient or group member)
+    """
+    message = await db.get(Message, message_id)
+    if message and user.id in (message.sender_id, message.recipient_id):
+        return message
+
+    if message and message.group_id:
+        result = await db.execute(
+            select(GroupMember.id).where(
+                GroupMember.group_id == message.group_id,
+                GroupMember.user_id == user.id
+            )
+        )
+        if result.scalar_one_or_none():
+            return message
+
+    raise HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND,
+        detail="Message not found"
+    )
+
+
+def _require_sender(message: Message, user: User) -> None:
+    if message.sender_id != user.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only the sender can attach files"
+        )
+
+
+async def _get_upload(db: AsyncSession, upload_id: UUID, user: User) -> AttachmentUpload:
+    """
+    Load one of the user's unexpired resumable uploads
+    """
+    upload = await db.get(AttachmentUpload, upload_id)
+    if not upload or upload.uploader_id != user.id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Upload not found"
+        )
+    if upload.expires_at <= datetime.now(timezone.utc):
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail="Upload has expired"
+        )
+    return upload
+
+
+def _upload_expiry() -> datetime:
+    return datetime.now(timezone.utc) + timedelta(hours=settings.ATTACHMENT_UPLOAD_EXPIRY_HOURS)
+
+
+def _progress(upload: AttachmentUpload, response: Response) -> AttachmentUploadResponse:
+    response.headers["Upload-Offset"] = str(upload.received)
+    return AttachmentUploadResponse.model_validate(upload)
+
+
+async def _save_attachment(db: AsyncSession, blob: StagedBlob, **metadata) -> Attachment:
+    """
+    Store a staged blob and commit an attachment referencing it
+
+    The staged file is deleted only after the commit, so a failed commit
+    leaves it for the caller (or the restored upload row) to deal with.
+    """
+    file_path = await attachment_store.store(db, blob)
+    attachment = Attachment(
+        blob_digest=blob.digest,
+        file_path=file_path,
+        file_size=blob.size,
+        **metadata
+    )
+    db.add(attachment)
+    await db.commit()
+    await attachment_store.discard_staged(blob)
+    return attachment
+
+
+def _parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Resolve a single-range `Range` header to inclusive (start, end)
+
+    Returns None when the whole body should be sent (no header, an invalid
+    one such as last < first, or a form we do not serve partially, like
+    multiple ranges). Only a range starting at or past the end of the file
+    is unsatisfiable (416), as RFC 9110 has it.
+    """
+    if not header:
+        return None
+    match = RANGE_PATTERN.match(header.strip())
+    if not match:
+        return None
+
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        if last and int(last) < start:
+            return None  # invalid, so ignored
+        end = min(int(last), size - 1) if last else size - 1
+    elif last:
+        # Suffix range: the final N bytes; a zero-length suffix is unsatisfiable
+        start = max(size - int(last), 0) if int(last) else size
+        end = size - 1
+    else:
+        return None
+
+    if start >= size:
+        raise HTTPException(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, end
+
+
+@router.post("", response_model=AttachmentResponse, status_code=status.HTTP_201_CREATED)
+async def upload_attachment(
+    request: Request,
+    message_id: UUID,
+    filename: str = Query(..., min_length=1, max_length=255),
+    mime_type: Optional[str] = Query(None, max_length=100),
+    encryption_method: str = Query("AES-256-GCM", max_length=50),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Attach an encrypted file to a message you sent
+
+    The request body is the raw ciphertext (application/octet-stream). It is
+    streamed to storage as it arrives; content that is already stored (the
+    same file forwarded again) is kept only once.
+    """
+    message = await _get_message(db, message_id, current_user)
+    _require_sender(message, current_user)
+
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > settings.MAX_FILE_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="File too large"
+        )
+
+    # Don't hold a pooled connection while the client uploads
+    await db.commit()
+
+    try:
+        blob = await attachment_store.receive(request.stream(), settings.MAX_FILE_SIZE)
+    except AttachmentTooLarge:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="File too large"
+        )
+
+    try:
+        return await _save_attachment(
+            db, blob,
+            message_id=message.id,
+            filename=filename,
+            mime_type=mime_type,
+            encryption_method=encryption_method
+        )
+    except Exception:
+        if blob.file_path:
+            await attachment_store.delete_file(blob.file_path)
+        raise
+
+
+@router.post("/uploads", response_model=AttachmentUploadResponse, status_code=status.HTTP_201_CREATED)
+async def create_upload(
+    upload_data: AttachmentUploadCreate,
+    response: Response,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Start a resumable upload for a message you sent
+
+    Send the ciphertext with PATCH /uploads/{id} in as many chunks as
+    needed, then POST /uploads/{id}/complete with its SHA-256.
+    """
+    message = await _get_message(db, upload_data.message_id, current_user)
+    _require_sender(message, current_user)
+
+    if upload_data.size > settings.MAX_FILE_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="File too large"
+        )
+
+    upload_id = uuid4()
+    upload = AttachmentUpload(
+        id=upload_id,
+        message_id=message.id,
+        uploader_id=current_user.id,
+        filename=upload_data.filename,
+        mime_type=upload_data.mime_type,
+        encryption_method=upload_data.encryption_method,
+        file_path=attachment_store.upload_path(upload_id),
+        total_size=upload_data.size,
+        received=0,
+        expires_at=_upload_expiry()
+    )
+    db.add(upload)
+    await db.commit()
+
+    return _progress(upload, response)
+
+
+@router.api_route("/uploads/{upload_id}", methods=["GET", "HEAD"], response_model=AttachmentUploadResponse)
+async def get_upload(
+    upload_id: UUID,
+    response: Response,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Current offset of an upload, to resume after an interruption
+
+    Also returned in the `Upload-Offset` header, so HEAD is enough.
+    """
+    upload = await _get_upload(db, upload_id, current_user)
+    return _progress(upload, response)
+
+
+@router.patch("/uploads/{upload_id}", response_model=AttachmentUploadResponse)
+async def append_upload(
+    upload_id: UUID,
+    request: Request,
+    response: Response,
+    upload_offset: int = Header(..., ge=0),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Append a chunk of ciphertext
+
+    `Upload-Offset` must equal the upload's current offset. If the
+    connection drops midway, the bytes that arrived are kept; ask for the
+    offset and continue from there.
+    """
+    upload = await _get_upload(db, upload_id, current_user)
+    offset = upload.received
+    if upload_offset != offset:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Upload-Offset does not match the current offset",
+            headers={"Upload-Offset": str(offset)}
+        )
+
+    remaining = upload.total_size - offset
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > remaining:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="Chunk exceeds the declared upload size"
+        )
+
+    # Keep an active upload alive, and don't hold a pooled connection
+    # while the chunk arrives
+    upload.expires_at = _upload_expiry()
+    await db.commit()
+
+    try:
+        received = await attachment_store.append(request.stream(), upload.file_path, offset, remaining)
+    except AttachmentTooLarge:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="Chunk exceeds the declared upload size"
+        )
+    except FileNotFoundError:
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail="Upload has expired"
+        )
+
+    # Only advance from the offset this chunk was written at; a concurrent
+    # PATCH that got there first wins
+    result = await db.execute(
+        update(AttachmentUpload)
+        .where(AttachmentUpload.id == upload.id, AttachmentUpload.received == offset)
+        .values(received=offset + received)
+        .returning(AttachmentUpload.received)
+        .execution_options(synchronize_session=False)
+    )
+    if result.scalar_one_or_none() is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Upload was modified concurrently"
+        )
+    await db.commit()
+
+    upload.received = offset + received
+    return _progress(upload, response)
+
+
+@router.post(
+    "/uploads/{upload_id}/complete",
+    response_model=AttachmentResponse,
+    status_code=status.HTTP_201_CREATED
+)
+async def complete_upload(
+    upload_id: UUID,
+    completion: AttachmentUploadComplete,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Verify a fully received upload and turn it into an attachment
+
+    On a checksum mismatch the upload is discarded and must be restarted.
+    """
+    upload = await _get_upload(db, upload_id, current_user)
+    if upload.received != upload.total_size:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Upload is incomplete",
+            headers={"Upload-Offset": str(upload.received)}
+        )
+
+    # Hashing a large file takes a while; release the connection meanwhile
+    await db.commit()
+
+    digest = await attachment_store.sha256_file(upload.file_path)
+    if digest != completion.sha256:
+        await db.execute(delete(AttachmentUpload).where(AttachmentUpload.id == upload.id))
+        await db.commit()
+        await attachment_store.delete_file(upload.file_path)
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Checksum mismatch; the upload was discarded"
+        )
+
+    # Claim the upload; only one completion (or the sweeper) can win
+    claimed = await db.execute(
+        delete(AttachmentUpload)
+        .where(AttachmentUpload.id == upload.id)
+        .returning(AttachmentUpload.id)
+        .execution_options(synchronize_session=False)
+    )
+    if claimed.scalar_one_or_none() is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Upload not found"
+        )
+
+    blob = await attachment_store.staged_upload(upload.file_path, upload.total_size, digest)
+    attachment = await _save_attachment(
+        db, blob,
+        message_id=upload.message_id,
+        filename=upload.filename,
+        mime_type=upload.mime_type,
+        encryption_method=upload.encryption_method
+    )
+
+    if blob.data is not None:
+        await attachment_store.delete_file(upload.file_path)
+
+    return attachment
+
+
+@router.delete("/uploads/{upload_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def cancel_upload(
+    upload_id: UUID,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Abandon an upload and delete what was received
+    """
+    upload = await _get_upload(db, upload_id, current_user)
+    await db.delete(upload)
+    await db.commit()
+    await attachment_store.delete_file(upload.file_path)
+
+
+@router.get("", response_model=AttachmentListResponse)
+async def list_attachments(
+    message_id: UUID,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    List the attachments of a message
+    """
+    await _get_message(db, message_id, current_user)
+
+    result = await db.execute(
+        select(Attachment)
+        .where(Attachment.message_id == message_id)
+        .order_by(Attachment.created_at)
+    )
+    return AttachmentListResponse(
+        attachments=[AttachmentResponse.model_validate(a) for a in result.scalars().all()]
+    )
+
+
+@router.get("/{attachment_id}")
+async def download_attachment(
+    attachment_id: UUID,
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Download an attachment's ciphertext
+
+    Supports single `Range` requests. With ATTACHMENTS_ACCEL_REDIRECT_PREFIX
+    set, files on disk are handed to nginx (X-Accel-Redirect), which sends
+    them with sendfile and handles ranges itself.
+    """
+    attachment = await db.get(Attachment, attachment_id)
+    if not attachment:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Attachment not found"
+        )
+    await _get_message(db, attachment.message_id, current_user)
+
+    if attachment.expires_at and attachment.expires_at <= datetime.now(timezone.utc):
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail="Attachment has expired"
+        )
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f"attachment; filename*=UTF-8''{quote(attachment.filename)}",
+        "Cache-Control": "private, max-age=86400",
+    }
+
+    if attachment.file_path and settings.ATTACHMENTS_ACCEL_REDIRECT_PREFIX:
+        headers["X-Accel-Redirect"] = settings.ATTACHMENTS_ACCEL_REDIRECT_PREFIX + attachment.file_path
+        return Response(status_code=status.HTTP_200_OK, headers=headers, media_type="application/octet-stream")
+
+    size = attachment.file_size
+    byte_range = _parse_range(request.headers.get("range"), size)
+    start, end = byte_range or (0, size - 1)
+    length = end - start + 1 if size else 0
+    status_code = status.HTTP_206_PARTIAL_CONTENT if byte_range else status.HTTP_200_OK
+    headers["Content-Length"] = str(length)
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    if attachment.file_path is None:
+        data = attachment.encrypted_data
+        if data is None and attachment.blob_digest:
+            blob = await db.get(AttachmentBlob, attachment.blob_digest)
+            data = blob.data if blob else None
+        data = data or b""
+        return Response(
+            content=data[start:end + 1],
+            status_code=status_code,
+            headers=headers,
+            media_type="application/octet-stream"
+        )
+
+    # Release the pooled connection for the duration of the transfer
+    await db.commit()
+
+    return StreamingResponse(
+        attachment_store.read_file(attachment.file_path, start, length),
+        status_code=status_code,
+        headers=headers,
+        media_type="application/octet-stream"
+    )
@@ -1,7 +1,8 @@
 """
 Authentication endpoints
 """
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.security import HTTPAuthorizationCredentials
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from datetime import datetime
@@ -9,15 +10,44 @@ from datetime import datetime
 from app.db.database import get_db
 from app.models.user import User
 from app.schemas.user import UserCreate, UserLogin, TokenResponse, UserResponse
-from app.core.security import verify_password, get_password_hash, create_access_token, generate_fingerprint
+from app.core.security import (
+    PasswordHasherBusy,
+    verify_password_async,
+    get_password_hash_async,
+    generate_fingerprint
+)
 from app.core.config import settings
-from app.api.dependencies import get_current_user
+from app.api.dependencies import get_current_user, security, token_principal
+from app.services.handles import invalidate as invalidate_handle
+from app.services.principals import invalidate_user
+from app.services.sessions import session_registry
 
 router = APIRouter()
 
+# Seconds clients are asked to wait when the hashing pool is saturated
+BUSY_RETRY_AFTER_SECONDS = 1
+
+
+def _open_session(request: Request, db: AsyncSession, user: User) -> str:
+    return session_registry.create(
+        db,
+        user,
+        ip_address=request.client.host if request.client else None,
+        user_agent=request.headers.get("user-agent")
+    )
+
+
+def _hashing_busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Server busy, please retry",
+        headers={"Retry-After": str(BUSY_RETRY_AFTER_SECONDS)}
+    )
+
 
 @router.post("/register", response_model=TokenResponse, status_code=status.HTTP_201_CREATED)
 async def register(
+    request: Request,
     user_data: UserCreate,
     db: AsyncSession = Depends(get_db)
 ):
@@ -58,12 +88,17 @@ async def register(
             detail="Maximum user limit reached"
         )
 
+    try:
+        password_hash = await get_password_hash_async(user_data.password)
+    except PasswordHasherBusy:
+        raise _hashing_busy()
+
     # Create new user
     new_user = User(
         username=user_data.username,
         domain=settings.DOMAIN,
         email=user_data.email,
-        password_hash=get_password_hash(user_data.password),
+        password_hash=password_hash,
         public_key=user_data.public_key,
         public_key_fingerprint=user_data.public_key_fingerprint,
         is_local=True,
@@ -71,12 +106,13 @@ async def register(
     )
 
     db.add(new_user)
+    await db.flush()
+
+    # Open a session; its access token is valid once this commits
+    access_token = _open_session(request, db, new_user)
     await db.commit()
     await db.refresh(new_user)
 
-    # Create access token
-    access_token = create_access_token(data={"user_id": str(new_user.id)})
-
     return TokenResponse(
         access_token=access_token,
         user_id=new_user.id,
@@ -87,6 +123,7 @@ async def register(
 
 @router.post("/login", response_model=TokenResponse)
 async def login(
+    request: Request,
     credentials: UserLogin,
     db: AsyncSession = Depends(get_db)
 ):
@@ -110,18 +147,23 @@ async def login(
         )
 
     # Verify password
-    if not verify_password(credentials.password, user.password_hash):
+    try:
+        password_ok = await verify_password_async(credentials.password, user.password_hash)
+    except PasswordHasherBusy:
+        raise _hashing_busy()
+
+    if not password_ok:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password"
         )
 
-    # Update last seen
+    # Update last seen and open a session
     user.last_seen = datetime.utcnow()
+    access_token = _open_session(request, db, user)
     await db.commit()
-
-    # Create access token
-    access_token = create_access_token(data={"user_id": str(user.id)})
+    await invalidate_user(user.id)
+    await invalidate_handle(user.full_handle)
 
     return TokenResponse(
         access_token=access_token,
@@ -133,11 +175,19 @@ async def login(
 
 @router.post("/logout")
 async def logout(
-    current_user: User = Depends(get_current_user)
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """
-    Logout user (client should discard token)
+    Logout user: revoke the session behind this token on every worker
     """
+    _, session_id = token_principal(credentials.credentials)
+    if session_id:
+        revoked = await session_registry.revoke(db, [session_id])
+        await db.commit()
+        await session_registry.announce_revoked(revoked)
+
     return {"message": "Logged out successfully"}
 
 
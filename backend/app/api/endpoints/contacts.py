@@ -1,11 +1,12 @@
 """
 Contacts endpoints
 """
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, List, Optional, Union
 from uuid import UUID
 from datetime import datetime
 
@@ -13,6 +14,12 @@ from app.db.database import get_db
 from app.models.user import User
 from app.models.contact import Contact
 from app.api.dependencies import get_current_user
+from app.core.config import settings
+from app.services.contacts import contact_rows, current_version, next_versions, remove_contact, removed_since
+from app.services.directory import find_remote_users, find_user
+from app.services.handles import normalize_handle
+from app.services.message_store import split_handle
+from app.services.events import append_events, new_event, publish_events
 
 router = APIRouter()
 
@@ -28,47 +35,104 @@ class ContactResponse(BaseModel):
     nickname: Optional[str]
     public_key_fingerprint: str
     avatar_url: Optional[str]
-    last_message_at: Optional[datetime]
     added_at: datetime
 
     class Config:
         from_attributes = True
 
 
-@router.get("", response_model=List[ContactResponse])
+class ContactImport(BaseModel):
+    contacts: List[ContactCreate]
+
+
+class ContactImportResult(BaseModel):
+    """Outcome for one handle: added, exists, not_found or invalid"""
+    contact_handle: str
+    status: str
+    contact: Optional[ContactResponse] = None
+
+
+class ContactImportResponse(BaseModel):
+    """Per-handle results in request order, and the list's version after the import"""
+    version: int
+    results: List[ContactImportResult]
+
+
+class ContactDelta(BaseModel):
+    """Changes to a contact list after the version a client has"""
+    version: int
+    reset: bool = False  # the client's version was unknown; this is the whole list
+    contacts: List[ContactResponse]  # added or changed
+    removed: List[UUID]  # contact ids
+
+
+def _contact_response(contact: Contact, contact_user: User) -> ContactResponse:
+    return ContactResponse(
+        id=contact.id,
+        contact_handle=contact_user.full_handle,
+        nickname=contact.nickname,
+        public_key_fingerprint=contact_user.public_key_fingerprint,
+        avatar_url=contact_user.avatar_url,
+        added_at=contact.added_at
+    )
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+@router.get("", response_model=Union[List[ContactResponse], ContactDelta])
 async def get_contacts(
+    request: Request,
+    response: Response,
+    since: Optional[int] = Query(None, ge=0, description="Contacts version the client already has"),
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
     """
     Get user's contacts
+
+    Without `since`, the whole list. Its ETag is the list's version in
+    quotes; send it back in If-None-Match to get 304 while nothing changed.
+
+    With `since`, a version from an earlier response, only the contacts
+    added or changed after it and the ids of those removed. If the server
+    does not know that version, the whole list comes back with reset set.
     """
-    # Get all contacts for current user
-    result = await db.execute(
-        select(Contact).where(Contact.user_id == current_user.id)
-    )
-    contacts = result.scalars().all()
+    # Read the version before the rows: a change committed in between is
+    # sent again next time rather than missed
+    version = await current_version(db, current_user.id)
 
-    # Get contact user details
-    contact_responses = []
-    for contact in contacts:
-        result = await db.execute(
-            select(User).where(User.id == contact.contact_id)
+    if since is not None:
+        if since > version:
+            rows = await contact_rows(db, current_user.id)
+            return ContactDelta(
+                version=version,
+                reset=True,
+                contacts=[_contact_response(contact, user) for contact, user in rows],
+                removed=[]
+            )
+        rows = await contact_rows(db, current_user.id, since=since)
+        return ContactDelta(
+            version=version,
+            contacts=[_contact_response(contact, user) for contact, user in rows],
+            removed=await removed_since(db, current_user.id, since)
         )
-        contact_user = result.scalar_one_or_none()
-
-        if contact_user:
-            contact_responses.append(ContactResponse(
-                id=contact.id,
-                contact_handle=contact_user.full_handle,
-                nickname=contact.nickname,
-                public_key_fingerprint=contact_user.public_key_fingerprint,
-                avatar_url=contact_user.avatar_url,
-                last_message_at=contact.last_message_at,
-                added_at=contact.added_at
-            ))
 
-    return contact_responses
+    etag = f'"{version}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    response.headers.update(headers)
+    rows = await contact_rows(db, current_user.id)
+    return [_contact_response(contact, user) for contact, user in rows]
 
 
 @router.post("", response_model=ContactResponse, status_code=status.HTTP_201_CREATED)
@@ -80,22 +144,15 @@ async def add_contact(
     """
     Add a new contact
     """
-    if '@' not in contact_data.contact_handle:
+    handle = normalize_handle(contact_data.contact_handle)
+    if handle is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid handle format"
         )
 
-    username, domain = contact_data.contact_handle.split('@', 1)
-
-    # Find contact user
-    result = await db.execute(
-        select(User).where(
-            User.username == username,
-            User.domain == domain
-        )
-    )
-    contact_user = result.scalar_one_or_none()
+    # Find contact user (fetched from their node if on another domain)
+    contact_user = await find_user(db, handle)
 
     if not contact_user:
         raise HTTPException(
@@ -119,25 +176,129 @@ async def add_contact(
         )
 
     # Create contact
+    versions = await next_versions(db, [current_user.id])
     new_contact = Contact(
         user_id=current_user.id,
         contact_id=contact_user.id,
-        nickname=contact_data.nickname
+        nickname=contact_data.nickname,
+        version=versions[current_user.id]
     )
 
     db.add(new_contact)
+    await db.flush()
+    events = await append_events(db, [
+        new_event(current_user.id, "contact", payload={
+            "action": "added",
+            "contact_id": new_contact.id,
+            "contact_handle": contact_user.full_handle
+        })
+    ])
     await db.commit()
     await db.refresh(new_contact)
+    await publish_events(events)
 
-    return ContactResponse(
-        id=new_contact.id,
-        contact_handle=contact_user.full_handle,
-        nickname=new_contact.nickname,
-        public_key_fingerprint=contact_user.public_key_fingerprint,
-        avatar_url=contact_user.avatar_url,
-        last_message_at=new_contact.last_message_at,
-        added_at=new_contact.added_at
-    )
+    return _contact_response(new_contact, contact_user)
+
+
+@router.post("/import", response_model=ContactImportResponse)
+async def import_contacts(
+    contact_data: ContactImport,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Add many contacts at once
+
+    Handles on this node are looked up with one query; handles on other
+    nodes are fetched from their nodes concurrently (bounded by the
+    directory's concurrency limit). New contacts are stored with one
+    INSERT ... ON CONFLICT DO NOTHING, so handles already in the list are
+    reported as existing. Repeated handles are handled once. The list's
+    version only moves if something was added.
+    """
+    if len(contact_data.contacts) > settings.MAX_CONTACT_IMPORT:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {settings.MAX_CONTACT_IMPORT} contacts per import"
+        )
+
+    handles: Dict[str, None] = {}  # distinct, in request order
+    nicknames: Dict[str, Optional[str]] = {}  # the valid ones
+    for item in contact_data.contacts:
+        normalized = normalize_handle(item.contact_handle)
+        handle = normalized or item.contact_handle.strip()
+        if handle in handles:
+            continue
+        handles[handle] = None
+        if normalized is not None:
+            nicknames[handle] = item.nickname
+
+    users = {}
+    local = [handle for handle in nicknames if split_handle(handle)[1] == settings.DOMAIN]
+    if local:
+        result = await db.execute(
+            select(User).where(tuple_(User.username, User.domain).in_([split_handle(h) for h in local]))
+        )
+        users.update((user.full_handle, user) for user in result.scalars())
+    users.update(await find_remote_users(db, nicknames.keys() - set(local)))
+
+    found = [handle for handle in nicknames if handle in users]
+    added: Dict[UUID, Contact] = {}
+    if found:
+        result = await db.execute(
+            insert(Contact)
+            .values([
+                {
+                    "user_id": current_user.id,
+                    "contact_id": users[handle].id,
+                    "nickname": nicknames[handle],
+                }
+                for handle in found
+            ])
+            .on_conflict_do_nothing(index_elements=[Contact.user_id, Contact.contact_id])
+            .returning(Contact)
+        )
+        added = {contact.contact_id: contact for contact in result.scalars()}
+
+    # Only a list that actually changed gets a new version; otherwise every
+    # device's cached copy (ETag) would be invalidated for nothing
+    if added:
+        version = (await next_versions(db, [current_user.id]))[current_user.id]
+        await db.execute(
+            update(Contact)
+            .where(Contact.id.in_([contact.id for contact in added.values()]))
+            .values(version=version)
+        )
+
+    results = []
+    events = []
+    for handle in handles:
+        user = users.get(handle)
+        if handle not in nicknames:
+            results.append(ContactImportResult(contact_handle=handle, status="invalid"))
+        elif user is None:
+            results.append(ContactImportResult(contact_handle=handle, status="not_found"))
+        elif user.id in added:
+            contact = added.pop(user.id)
+            results.append(ContactImportResult(
+                contact_handle=handle,
+                status="added",
+                contact=_contact_response(contact, user)
+            ))
+            events.append(new_event(current_user.id, "contact", payload={
+                "action": "added",
+                "contact_id": contact.id,
+                "contact_handle": user.full_handle
+            }))
+        else:
+            results.append(ContactImportResult(contact_handle=handle, status="exists"))
+
+    events = await append_events(db, events)
+    version = await current_version(db, current_user.id)
+    await db.commit()
+    await publish_events(events)
+
+    return ContactImportResponse(version=version, results=results)
 
 
 @router.delete("/{contact_id}")
@@ -163,7 +324,14 @@ async def delete_contact(
             detail="Contact not found"
         )
 
-    await db.delete(contact)
+    await remove_contact(db, contact)
+    events = await append_events(db, [
+        new_event(current_user.id, "contact", payload={
+            "action": "removed",
+            "contact_id": contact.id
+        })
+    ])
     await db.commit()
+    await publish_events(events)
 
     return {"message": "Contact removed"}
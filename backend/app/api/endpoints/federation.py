@@ -0,0 +1,225 @@
+"""
+Federation endpoints, called by other nodes
+"""
+import base64
+import binascii
+import json
+import time
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from pydantic import ValidationError
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.database import get_db
+from app.models.message import Message
+from app.schemas.federation import FederatedMessage, FederationAck, FederationAckResponse
+from app.core.config import settings
+from app.core.node_identity import ORIGIN_HEADER, SIGNATURE_HEADER, TIMESTAMP_HEADER, signed_bytes
+from app.services.directory import HOST_PATTERN, NOT_FOUND, remote_directory
+from app.services.events import publish_events
+from app.services.handles import normalize_handle
+from app.services.message_store import (
+    build_remote_message_row,
+    message_response,
+    persist_messages,
+    resolve_recipients,
+    split_handle
+)
+from app.services.peer_keys import REFETCH_INTERVAL, PeerKeyUnavailable, peer_keys
+
+router = APIRouter()
+
+# Requests being handled per origin node, in this worker
+_in_flight: Dict[str, int] = {}
+
+
+async def _read_body(request: Request) -> bytes:
+    limit = settings.FEDERATION_INGEST_MAX_BYTES
+    declared = request.headers.get("content-length", "")
+    if declared.isdigit() and int(declared) > limit:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Batch too large")
+
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > limit:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Batch too large")
+    return bytes(body)
+
+
+async def _authenticate(request: Request, origin: str, body: bytes) -> None:
+    """
+    Check the origin node's signature over the request
+    """
+    timestamp = request.headers.get(TIMESTAMP_HEADER, "")
+    try:
+        signature = base64.b64decode(request.headers.get(SIGNATURE_HEADER, ""), validate=True)
+        skew = abs(time.time() - int(timestamp))
+    except (binascii.Error, ValueError):
+        skew = None
+    if skew is None or skew > settings.FEDERATION_SIGNATURE_MAX_SKEW_SECONDS:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Missing or expired signature")
+
+    try:
+        verified = await peer_keys.verify(origin, signature, signed_bytes(origin, timestamp, body))
+    except PeerKeyUnavailable:
+        # Not the peer's fault: it should retry, not drop the messages
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Could not fetch the origin node's key",
+            headers={"Retry-After": str(REFETCH_INTERVAL)}
+        )
+    if not verified:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid signature")
+
+
+def _parse_batch(origin: str, body: bytes) -> list:
+    try:
+        batch = json.loads(body)
+        items = batch["messages"]
+        valid = batch["origin"] == origin and isinstance(items, list)
+    except (ValueError, KeyError, TypeError):
+        valid = False
+    if not valid:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Malformed batch")
+    if len(items) > settings.FEDERATION_INGEST_MAX_MESSAGES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {settings.FEDERATION_INGEST_MAX_MESSAGES} messages per batch"
+        )
+    return items
+
+
+def _domain(handle: str) -> Optional[str]:
+    try:
+        return split_handle(handle)[1]
+    except ValueError:
+        return None
+
+
+@router.post("/messages", response_model=FederationAckResponse)
+async def receive_messages(
+    request: Request,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Accept a batch of messages from another node
+
+    The batch must be signed by the origin node (see app.core.node_identity),
+    and may only carry messages from that node's users to users of this one.
+    Accepted messages are stored with one multi-row insert; a message whose
+    origin id was stored before is acknowledged as a duplicate, so peers can
+    safely resend after a lost response. Each message gets an ack:
+    accepted, duplicate, rejected, or retry when it may succeed later.
+
+    Each origin node gets at most FEDERATION_INGEST_CONCURRENCY_PER_PEER
+    requests handled at once per worker; more are answered with 429.
+    """
+    if not settings.FEDERATION_ENABLED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Federation is disabled")
+
+    origin = request.headers.get(ORIGIN_HEADER, "")
+    if not HOST_PATTERN.match(origin) or origin == settings.DOMAIN:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Missing or invalid origin")
+
+    if _in_flight.get(origin, 0) >= settings.FEDERATION_INGEST_CONCURRENCY_PER_PEER:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many concurrent requests from this node",
+            headers={"Retry-After": "1"}
+        )
+    _in_flight[origin] = _in_flight.get(origin, 0) + 1
+    try:
+        body = await _read_body(request)
+        await _authenticate(request, origin, body)
+        return await _ingest(db, origin, _parse_batch(origin, body))
+    finally:
+        _in_flight[origin] -= 1
+        if not _in_flight[origin]:
+            del _in_flight[origin]
+
+
+async def _ingest(db: AsyncSession, origin: str, items: list) -> FederationAckResponse:
+    # Acks by message id, in request order; None until decided
+    acks: Dict[str, Optional[FederationAck]] = {}
+    candidates: List[FederatedMessage] = []
+
+    for raw in items:
+        try:
+            item = FederatedMessage.model_validate(raw)
+        except ValidationError:
+            if isinstance(raw, dict) and isinstance(raw.get("id"), str):
+                acks.setdefault(raw["id"], FederationAck(id=raw["id"], status="rejected", error="Malformed message"))
+            continue
+
+        key = str(item.id)
+        if key in acks:
+            continue  # repeated within the batch
+        sender_handle = normalize_handle(item.sender_handle)
+        recipient_handle = normalize_handle(item.recipient_handle)
+        if sender_handle is None or recipient_handle is None:
+            acks[key] = FederationAck(id=key, status="rejected", error="Malformed message")
+            continue
+        item = item.model_copy(update={"sender_handle": sender_handle, "recipient_handle": recipient_handle})
+        if _domain(item.sender_handle) != origin:
+            acks[key] = FederationAck(id=key, status="rejected", error="Sender is not on the origin node")
+        elif _domain(item.recipient_handle) != settings.DOMAIN:
+            acks[key] = FederationAck(id=key, status="rejected", error="Recipient is not on this node")
+        else:
+            acks[key] = None
+            candidates.append(item)
+
+    recipients = await resolve_recipients(db, {item.recipient_handle for item in candidates})
+    senders = await remote_directory.resolve_many(db, {item.sender_handle for item in candidates})
+
+    rows: List[Tuple[FederatedMessage, dict]] = []
+    for item in candidates:
+        key = str(item.id)
+        sender = senders.get(item.sender_handle)
+        recipient_id = recipients.get(item.recipient_handle)
+        if recipient_id is None:
+            acks[key] = FederationAck(id=key, status="rejected", error="Recipient not found")
+            continue
+        if sender is None:
+            if remote_directory.missing.get(item.sender_handle) is NOT_FOUND:
+                acks[key] = FederationAck(id=key, status="rejected", error="Sender not found")
+            else:
+                acks[key] = FederationAck(id=key, status="retry", error="Sender could not be looked up")
+            continue
+        try:
+            row = build_remote_message_row(sender, recipient_id, item, origin)
+        except ValueError as e:
+            acks[key] = FederationAck(id=key, status="rejected", error=str(e))
+            continue
+        if row["message_size"] > settings.MAX_MESSAGE_SIZE:
+            acks[key] = FederationAck(id=key, status="rejected", error="Message too large")
+            continue
+        rows.append((item, row))
+
+    if rows:
+        # One batch per origin at a time, so a resend racing the original
+        # cannot get past the duplicate check
+        await db.execute(select(func.pg_advisory_xact_lock(func.hashtext(origin))))
+        stored = set((await db.execute(
+            select(Message.origin_message_id).where(
+                Message.origin_node == origin,
+                Message.origin_message_id.in_([item.id for item, _ in rows])
+            )
+        )).scalars())
+
+        fresh = []
+        for item, row in rows:
+            if item.id in stored:
+                acks[str(item.id)] = FederationAck(id=str(item.id), status="duplicate")
+            else:
+                fresh.append(row)
+
+        new_messages, events = await persist_messages(db, fresh)
+        await db.commit()
+        for message in new_messages:
+            acks[str(message.origin_message_id)] = FederationAck(id=str(message.origin_message_id), status="accepted")
+        await publish_events(events, {message.id: message_response(message) for message in new_messages})
+
+    return FederationAckResponse(results=list(acks.values()))
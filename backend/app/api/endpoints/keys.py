@@ -1,16 +1,19 @@
 """
 Public key discovery endpoints
 """
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
 from pydantic import BaseModel
 from typing import Optional
 
 from app.db.database import get_db
 from app.models.user import User
+from app.api.dependencies import get_optional_user
+from app.api.wire import NegotiatedRoute, negotiated
+from app.services.directory import find_user
+from app.services.handles import is_local_handle, normalize_handle
 
-router = APIRouter()
+router = APIRouter(route_class=NegotiatedRoute)
 
 
 class PublicKeyResponse(BaseModel):
@@ -22,30 +25,34 @@ class PublicKeyResponse(BaseModel):
 
 @router.get("/{handle}", response_model=PublicKeyResponse)
 async def get_public_key(
+    request: Request,
     handle: str,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    current_user: Optional[User] = Depends(get_optional_user)
 ):
     """
     Get public key for a user handle
 
-    This is a public endpoint used for key discovery and encryption
+    This is a public endpoint used for key discovery and encryption; other
+    nodes use it to look up our users. Handles on other domains are fetched
+    from their node and stored here, so only signed-in users may ask for them.
     """
-    if '@' not in handle:
+    handle = normalize_handle(handle)
+    if handle is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid handle format. Use username@domain"
         )
 
-    username, domain = handle.split('@', 1)
-
-    # Find user
-    result = await db.execute(
-        select(User).where(
-            User.username == username,
-            User.domain == domain
+    if current_user is None and not is_local_handle(handle):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Sign in to look up users on other nodes",
+            headers={"WWW-Authenticate": "Bearer"}
         )
-    )
-    user = result.scalar_one_or_none()
+
+    # Users on other domains are fetched from their node
+    user = await find_user(db, handle)
 
     if not user:
         raise HTTPException(
@@ -53,9 +60,9 @@ async def get_public_key(
             detail="User not found"
         )
 
-    return PublicKeyResponse(
+    return negotiated(request, PublicKeyResponse(
         full_handle=user.full_handle,
         public_key=user.public_key,
         public_key_fingerprint=user.public_key_fingerprint,
         verified=False  # In production, this would check if key is verified
-    )
+    ))
@@ -1,24 +1,57 @@
 """
 Message endpoints
 """
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, Request, status, Query
+from pydantic import TypeAdapter, ValidationError
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, or_, and_
-from datetime import datetime
+from sqlalchemy import DateTime, func, literal, select, update, tuple_, or_
+from datetime import datetime, timezone
 from typing import Optional
+from uuid import UUID
 
 from app.db.database import get_db
 from app.models.user import User
-from app.models.message import Message
-from app.schemas.message import MessageCreate, MessageResponse, MessageListResponse
+from app.models.message import Message, conversation_key
+from app.models.group import GroupMember
+from app.models.conversation_summary import ConversationSummary
+from app.schemas.message import (
+    MessageCreate,
+    MessageResponse,
+    MessageListResponse,
+    MessageBatchCreate,
+    MessageBatchItemResult,
+    MessageBatchResponse,
+    ReadUpToRequest,
+    ReadReceiptResponse,
+    InboxEntry,
+    InboxResponse
+)
 from app.api.dependencies import get_current_user
+from app.api.wire import NegotiatedRoute, negotiated
 from app.core.config import settings
-
-router = APIRouter()
+from app.core.cursor import encode_cursor, decode_cursor
+from app.services import inbox
+from app.services.events import append_events, new_event, publish_events
+from app.services.delivery import delivery_worker
+from app.services.directory import find_remote_users
+from app.services.handles import normalize_handle
+from app.services.group_commit import message_batcher
+from app.services.message_store import (
+    build_message_row,
+    persist_messages,
+    message_response,
+    resolve_recipients
+)
+
+router = APIRouter(route_class=NegotiatedRoute)
+
+# Parses `before` as the datetime query parameter it used to be
+_timestamp = TypeAdapter(datetime)
 
 
 @router.post("", response_model=MessageResponse, status_code=status.HTTP_201_CREATED)
 async def send_message(
+    request: Request,
     message_data: MessageCreate,
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
@@ -34,132 +67,239 @@ async def send_message(
         )
 
     recipient_id = None
-    recipient_handle = None
-    origin_node = settings.DOMAIN
 
     # Handle 1-on-1 message
     if message_data.recipient_handle:
-        recipient_handle = message_data.recipient_handle
-        username, domain = recipient_handle.split('@', 1)
+        # Stored and routed in canonical form, like every other handle
+        message_data.recipient_handle = normalize_handle(message_data.recipient_handle)
+        if message_data.recipient_handle is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid handle format"
+            )
 
-        # Find or create recipient user
-        result = await db.execute(
-            select(User).where(
-                User.username == username,
-                User.domain == domain
+        recipients = await resolve_recipients(db, [message_data.recipient_handle])
+        recipient_id = recipients.get(message_data.recipient_handle)
+
+        if not recipient_id:
+            remote = await find_remote_users(db, [message_data.recipient_handle])
+            recipient = remote.get(message_data.recipient_handle)
+            recipient_id = recipient.id if recipient else None
+
+        if not recipient_id:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Recipient not found"
             )
+
+    # Create message (local recipients are marked delivered in the same commit)
+    row = build_message_row(current_user, message_data, recipient_id)
+    if message_batcher.running:
+        # Release this request's connection; the batcher commits on its own
+        await db.commit()
+        new_message, events = await message_batcher.submit(row)
+    else:
+        [new_message], events = await persist_messages(db, [row])
+        await db.commit()
+    delivery_worker.notify([new_message])
+
+    response = message_response(new_message)
+    await publish_events(events, {new_message.id: response})
+
+    return negotiated(request, response, status.HTTP_201_CREATED)
+
+
+@router.post("/batch", response_model=MessageBatchResponse)
+async def send_message_batch(
+    request: Request,
+    batch: MessageBatchCreate,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Send several messages in one request
+
+    All recipient handles are resolved with one query and all accepted
+    messages are stored with one multi-row insert in a single transaction.
+    Each item gets its own result, so an unknown recipient or an oversized
+    message only fails that item.
+    """
+    if len(batch.messages) > settings.MAX_BATCH_MESSAGES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {settings.MAX_BATCH_MESSAGES} messages per batch"
         )
-        recipient = result.scalar_one_or_none()
-
-        if not recipient:
-            # If recipient doesn't exist and is on another node, we'll create a stub entry
-            # In a real implementation, we'd query the federation API first
-            if domain != settings.DOMAIN:
-                # For federated users, we need to fetch their public key from their node
-                # This is a placeholder - actual federation logic would go here
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="Recipient not found. Federation lookup not yet implemented."
-                )
-            else:
-                raise HTTPException(
+
+    invalid = set()
+    for index, item in enumerate(batch.messages):
+        if item.recipient_handle:
+            item.recipient_handle = normalize_handle(item.recipient_handle)
+            if item.recipient_handle is None:
+                invalid.add(index)
+    handles = {item.recipient_handle for item in batch.messages if item.recipient_handle}
+    recipients = await resolve_recipients(db, handles)
+    remote = await find_remote_users(db, handles - recipients.keys())
+    recipients.update({handle: user.id for handle, user in remote.items()})
+
+    results: list[Optional[MessageBatchItemResult]] = [None] * len(batch.messages)
+    accepted = []  # (index, row)
+
+    for index, item in enumerate(batch.messages):
+        if len(item.encrypted_content) > settings.MAX_MESSAGE_SIZE:
+            results[index] = MessageBatchItemResult(
+                index=index,
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                error="Message too large"
+            )
+            continue
+
+        recipient_id = None
+        if index in invalid:
+            results[index] = MessageBatchItemResult(
+                index=index,
+                status_code=status.HTTP_400_BAD_REQUEST,
+                error="Invalid handle format"
+            )
+            continue
+        if item.recipient_handle:
+            recipient_id = recipients.get(item.recipient_handle)
+            if not recipient_id:
+                results[index] = MessageBatchItemResult(
+                    index=index,
                     status_code=status.HTTP_404_NOT_FOUND,
-                    detail="Recipient not found"
+                    error="Recipient not found"
                 )
+                continue
 
-        recipient_id = recipient.id
-
-    # Create message
-    new_message = Message(
-        sender_id=current_user.id,
-        recipient_id=recipient_id,
-        group_id=message_data.group_id,
-        encrypted_content=message_data.encrypted_content,
-        content_type=message_data.content_type,
-        sender_handle=current_user.full_handle,
-        recipient_handle=recipient_handle,
-        message_size=len(message_data.encrypted_content),
-        origin_node=origin_node,
-        status="pending"
-    )
+        accepted.append((index, build_message_row(current_user, item, recipient_id)))
 
-    db.add(new_message)
+    new_messages, events = await persist_messages(db, [row for _, row in accepted])
     await db.commit()
-    await db.refresh(new_message)
-
-    # TODO: If message is for a federated user, add to message queue
-    # TODO: Send WebSocket notification if recipient is online
-
-    # Mark as delivered for local users
-    if recipient_id and recipient_handle and '@' in recipient_handle:
-        _, domain = recipient_handle.split('@', 1)
-        if domain == settings.DOMAIN:
-            new_message.status = "delivered"
-            new_message.delivered_at = datetime.utcnow()
-            await db.commit()
-
-    return MessageResponse(
-        id=new_message.id,
-        sender_handle=new_message.sender_handle,
-        recipient_handle=new_message.recipient_handle,
-        group_id=new_message.group_id,
-        encrypted_content=new_message.encrypted_content,
-        encrypted_key=message_data.encrypted_key,
-        iv=message_data.iv,
-        content_type=new_message.content_type,
-        created_at=new_message.created_at,
-        delivered_at=new_message.delivered_at,
-        read_at=new_message.read_at,
-        status=new_message.status
+    delivery_worker.notify(new_messages)
+
+    responses = {}
+    for (index, _), new_message in zip(accepted, new_messages):
+        response = responses[new_message.id] = message_response(new_message)
+        results[index] = MessageBatchItemResult(
+            index=index,
+            status_code=status.HTTP_201_CREATED,
+            message=response
+        )
+    await publish_events(events, responses)
+
+    return negotiated(request, MessageBatchResponse(results=results))
+
+
+@router.get("/inbox", response_model=InboxResponse)
+async def get_inbox(
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+    limit: int = Query(50, le=100),
+    cursor: Optional[str] = None
+):
+    """
+    List the current user's conversations, most recent first
+
+    Each entry carries the last message metadata and the unread count,
+    read from conversation_summaries with one indexed query.
+    """
+    query = select(ConversationSummary).where(ConversationSummary.user_id == current_user.id)
+
+    if cursor:
+        position = decode_cursor(cursor)
+        if not position:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
+            )
+        query = query.where(
+            tuple_(ConversationSummary.last_message_at, ConversationSummary.id) < position
+        )
+
+    query = query.order_by(
+        ConversationSummary.last_message_at.desc(),
+        ConversationSummary.id.desc()
+    ).limit(limit + 1)
+
+    result = await db.execute(query)
+    summaries = result.scalars().all()
+
+    has_more = len(summaries) > limit
+    if has_more:
+        summaries = summaries[:limit]
+
+    next_cursor = (
+        encode_cursor(summaries[-1].last_message_at, summaries[-1].id) if has_more else None
     )
 
+    return negotiated(request, InboxResponse(
+        conversations=[InboxEntry.model_validate(summary) for summary in summaries],
+        has_more=has_more,
+        next_cursor=next_cursor
+    ))
+
 
 @router.get("/conversation/{handle}", response_model=MessageListResponse)
 async def get_conversation(
+    request: Request,
     handle: str,
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
     limit: int = Query(50, le=100),
-    before: Optional[datetime] = None
+    cursor: Optional[str] = None,
+    before: Optional[str] = None
 ):
     """
-    Get conversation with a specific user
+    Get conversation with a specific user, newest first
+
+    Pages are keyed on (created_at, id) within the conversation, so each page
+    is a single range scan of idx_conversation_messages and messages sharing
+    a timestamp are neither skipped nor repeated. Pass `next_cursor` from the
+    previous page as `cursor`. Older clients pass it back as `before`, which
+    takes either a cursor or, as it used to, a timestamp.
     """
-    if '@' not in handle:
+    handle = normalize_handle(handle)
+    if handle is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid handle format"
         )
 
-    username, domain = handle.split('@', 1)
-
-    # Find the other user
-    result = await db.execute(
-        select(User).where(
-            User.username == username,
-            User.domain == domain
-        )
-    )
-    other_user = result.scalar_one_or_none()
+    recipients = await resolve_recipients(db, [handle])
+    other_user_id = recipients.get(handle)
 
-    if not other_user:
+    if not other_user_id:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found"
         )
 
-    # Build query for messages between current user and other user
     query = select(Message).where(
-        or_(
-            and_(Message.sender_id == current_user.id, Message.recipient_id == other_user.id),
-            and_(Message.sender_id == other_user.id, Message.recipient_id == current_user.id)
-        )
+        Message.conversation_id == conversation_key(current_user.id, other_user_id)
     )
 
-    if before:
-        query = query.where(Message.created_at < before)
+    if cursor:
+        position = decode_cursor(cursor)
+        if not position:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
+            )
+        query = query.where(tuple_(Message.created_at, Message.id) < position)
+    elif before:
+        try:
+            query = query.where(Message.created_at < _timestamp.validate_python(before))
+        except ValidationError:
+            position = decode_cursor(before)
+            if not position:
+                raise HTTPException(
+                    status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail="before must be a timestamp or a cursor"
+                )
+            query = query.where(tuple_(Message.created_at, Message.id) < position)
 
-    query = query.order_by(Message.created_at.desc()).limit(limit + 1)
+    query = query.order_by(Message.created_at.desc(), Message.id.desc()).limit(limit + 1)
 
     result = await db.execute(query)
     messages = result.scalars().all()
@@ -168,29 +308,171 @@ async def get_conversation(
     if has_more:
         messages = messages[:limit]
 
-    next_cursor = messages[-1].created_at if messages else None
-
-    return MessageListResponse(
-        messages=[
-            MessageResponse(
-                id=msg.id,
-                sender_handle=msg.sender_handle,
-                recipient_handle=msg.recipient_handle,
-                group_id=msg.group_id,
-                encrypted_content=msg.encrypted_content,
-                encrypted_key=None,  # Not stored in DB for 1-on-1 messages
-                iv="",  # Not stored separately
-                content_type=msg.content_type,
-                created_at=msg.created_at,
-                delivered_at=msg.delivered_at,
-                read_at=msg.read_at,
-                status=msg.status
-            )
-            for msg in messages
-        ],
+    # Set on every non-empty page, as the timestamp it replaced was
+    next_cursor = encode_cursor(messages[-1].created_at, messages[-1].id) if messages else None
+
+    return negotiated(request, MessageListResponse(
+        messages=[message_response(msg) for msg in messages],
         has_more=has_more,
         next_cursor=next_cursor
+    ))
+
+
+@router.put("/conversation/{handle}/read", response_model=ReadReceiptResponse)
+async def mark_conversation_read(
+    request: Request,
+    handle: str,
+    read: ReadUpToRequest,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Mark every message from a user at or before a watermark as read
+
+    The watermark is either a message id or a timestamp. All matching
+    messages are updated with one set-based UPDATE, and the sender gets a
+    single receipt event covering all of them.
+    """
+    handle = normalize_handle(handle)
+    if handle is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid handle format"
+        )
+
+    recipients = await resolve_recipients(db, [handle])
+    other_user_id = recipients.get(handle)
+
+    if not other_user_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
+        )
+
+    if read.up_to_message_id:
+        # Resolve the watermark inside the UPDATE itself, ordered like the
+        # conversation pages so same-timestamp messages after it stay unread
+        watermark_at = select(Message.created_at).where(
+            Message.id == read.up_to_message_id,
+            Message.conversation_id == conversation_key(current_user.id, other_user_id)
+        ).scalar_subquery()
+        before_watermark = (
+            tuple_(Message.created_at, Message.id) <= tuple_(watermark_at, read.up_to_message_id)
+        )
+    else:
+        before_watermark = Message.created_at <= read.up_to
+
+    read_at = datetime.utcnow()
+    conversation_id = conversation_key(current_user.id, other_user_id)
+    result = await db.execute(
+        update(Message)
+        .where(
+            Message.recipient_id == current_user.id,
+            Message.sender_id == other_user_id,
+            Message.read_at.is_(None),
+            before_watermark
+        )
+        .values(read_at=read_at, status="read")
+        .execution_options(synchronize_session=False)
+    )
+    updated = result.rowcount
+    await inbox.mark_read(db, current_user.id, conversation_id, updated)
+
+    events = []
+    if updated:
+        # One receipt for the sender, one for the reader's other devices
+        receipt = {
+            "status": "read",
+            "reader_handle": current_user.full_handle,
+            "conversation_id": conversation_id,
+            "up_to_message_id": read.up_to_message_id,
+            "up_to": read.up_to,
+            "read_at": read_at,
+            "count": updated
+        }
+        events = await append_events(db, [
+            new_event(other_user_id, "receipt", payload=receipt),
+            new_event(current_user.id, "receipt", payload=receipt),
+        ])
+    await db.commit()
+    await publish_events(events)
+
+    return negotiated(request, ReadReceiptResponse(updated=updated, read_at=read_at))
+
+
+@router.put("/group/{group_id}/read", response_model=ReadReceiptResponse)
+async def mark_group_read(
+    request: Request,
+    group_id: UUID,
+    read: ReadUpToRequest,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Advance the current user's read watermark in a group
+
+    Group messages are not marked individually; the member's last_read_at
+    moves forward (never back). `updated` is 1 when the watermark moved,
+    and then the reader's other devices get one receipt event.
+    """
+    if read.up_to_message_id:
+        watermark = select(Message.created_at).where(
+            Message.id == read.up_to_message_id,
+            Message.group_id == group_id
+        ).scalar_subquery()
+    else:
+        # A watermark in the future would mark messages read before they arrive
+        watermark = func.least(literal(read.up_to, DateTime(timezone=True)), func.now())
+
+    result = await db.execute(
+        update(GroupMember)
+        .where(
+            GroupMember.group_id == group_id,
+            GroupMember.user_id == current_user.id,
+            or_(GroupMember.last_read_at.is_(None), GroupMember.last_read_at < watermark),
+            watermark.is_not(None) if read.up_to_message_id else True
+        )
+        .values(last_read_at=watermark)
+        .returning(GroupMember.last_read_at)
+        .execution_options(synchronize_session=False)
     )
+    read_at = result.scalar_one_or_none()
+
+    events = []
+    if read_at is not None:
+        events = await append_events(db, [
+            new_event(current_user.id, "receipt", payload={
+                "status": "read",
+                "reader_handle": current_user.full_handle,
+                "group_id": group_id,
+                "up_to_message_id": read.up_to_message_id,
+                "up_to": read.up_to,
+                "read_at": read_at
+            })
+        ])
+    await db.commit()
+    await publish_events(events)
+
+    if read_at is None:
+        # Either not a member, or the watermark is not ahead of the current one
+        result = await db.execute(
+            select(GroupMember.last_read_at).where(
+                GroupMember.group_id == group_id,
+                GroupMember.user_id == current_user.id
+            )
+        )
+        membership = result.one_or_none()
+        if not membership:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Group not found"
+            )
+        return negotiated(request, ReadReceiptResponse(
+            updated=0,
+            read_at=membership.last_read_at or datetime.now(timezone.utc)
+        ))
+
+    return negotiated(request, ReadReceiptResponse(updated=1, read_at=read_at))
 
 
 @router.put("/{message_id}/read")
@@ -222,9 +504,26 @@ async def mark_message_read(
         )
 
     # Mark as read
-    message.read_at = datetime.utcnow()
+    events = []
+    read_at = datetime.utcnow()
+    if message.read_at is None:
+        await inbox.mark_read(db, current_user.id, message.conversation_id, 1)
+        receipt = {
+            "status": "read",
+            "reader_handle": current_user.full_handle,
+            "conversation_id": message.conversation_id,
+            "up_to_message_id": message.id,
+            "read_at": read_at,
+            "count": 1
+        }
+        notify = [current_user.id] + ([message.sender_id] if message.sender_id else [])
+        events = await append_events(db, [
+            new_event(user_id, "receipt", payload=receipt) for user_id in notify
+        ])
+    message.read_at = read_at
     message.status = "read"
 
     await db.commit()
+    await publish_events(events)
 
     return {"message": "Message marked as read"}
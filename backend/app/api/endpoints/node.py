@@ -10,6 +10,7 @@ from app.db.database import get_db
 from app.models.user import User
 from app.models.federated_node import FederatedNode
 from app.core.config import settings
+from app.core.node_identity import public_key_pem
 
 router = APIRouter()
 
@@ -28,6 +29,7 @@ class WellKnownResponse(BaseModel):
     version: str
     domain: str
     federation_api: str
+    public_key: str
     capabilities: list[str]
     max_message_size: int
     statistics: dict
@@ -84,6 +86,7 @@ async def well_known_mychat(
         version="1.0",
         domain=settings.DOMAIN,
         federation_api=f"https://{settings.DOMAIN}/api/federation",
+        public_key=public_key_pem(),
         capabilities=[
             "text_messages",
             "image_sharing",
@@ -0,0 +1,101 @@
+"""
+Sync endpoints (catch-up for reconnecting clients)
+"""
+import asyncio
+
+from fastapi import APIRouter, Depends, Query, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+
+from app.db.database import get_db
+from app.models.user import User
+from app.models.message import Message
+from app.models.user_event import UserEvent
+from app.schemas.sync import SyncResponse
+from app.api.dependencies import get_current_user
+from app.api.wire import NegotiatedRoute, negotiated
+from app.core.config import settings
+from app.services.events import sync_event
+from app.services.fanout import fanout
+from app.services.message_store import message_response
+
+router = APIRouter(route_class=NegotiatedRoute)
+
+
+async def _events_after(db: AsyncSession, user_id, since: int, limit: int) -> SyncResponse:
+    """
+    Read one page of a user's events with a single range scan of its primary key
+    """
+    result = await db.execute(
+        select(UserEvent, Message)
+        .outerjoin(Message, Message.id == UserEvent.message_id)
+        .where(UserEvent.user_id == user_id, UserEvent.seq > since)
+        .order_by(UserEvent.seq)
+        .limit(limit + 1)
+    )
+    rows = result.all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    events = [
+        sync_event(
+            event.seq,
+            event.event_type,
+            event.created_at,
+            event.payload,
+            message_response(message) if message else None
+        )
+        for event, message in rows
+    ]
+
+    return SyncResponse(
+        events=events,
+        last_seq=events[-1].seq if events else since,
+        has_more=has_more
+    )
+
+
+async def _wait_for_events(db: AsyncSession, user_id, since: int, limit: int, timeout: int) -> SyncResponse:
+    """
+    Like _events_after, but wait up to `timeout` seconds for a first event
+    """
+    timeout = min(timeout, settings.SYNC_LONG_POLL_MAX_SECONDS)
+    if not timeout:
+        return await _events_after(db, user_id, since, limit)
+
+    # Subscribe before the first read so an event committed in between still wakes us
+    async with fanout.waiter(user_id) as woken:
+        response = await _events_after(db, user_id, since, limit)
+        if response.events:
+            return response
+
+        # Return the pooled connection while idle
+        await db.commit()
+        try:
+            await asyncio.wait_for(woken.wait(), timeout)
+        except asyncio.TimeoutError:
+            return response
+
+    return await _events_after(db, user_id, since, limit)
+
+
+@router.get("", response_model=SyncResponse)
+async def sync(
+    request: Request,
+    since: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=500),
+    timeout: int = Query(0, ge=0),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Return everything that happened to the user after sequence number `since`
+
+    Covers new messages, read receipts and contact changes. With `timeout`
+    (seconds, capped by SYNC_LONG_POLL_MAX_SECONDS) the request waits for the
+    next event when there is nothing new yet, without holding a database
+    connection while it waits.
+    """
+    return negotiated(request, await _wait_for_events(db, current_user.id, since, limit, timeout))
+
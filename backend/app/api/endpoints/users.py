@@ -3,12 +3,15 @@ User endpoints
 """
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
 
 from app.db.database import get_db
 from app.models.user import User
 from app.schemas.user import UserResponse, UserUpdate, UserPublicInfo
 from app.api.dependencies import get_current_user
+from app.services.contacts import touch_contacts_of
+from app.services.directory import find_user
+from app.services.handles import invalidate as invalidate_handle, normalize_handle
+from app.services.principals import invalidate_user
 
 router = APIRouter()
 
@@ -32,15 +35,22 @@ async def update_my_profile(
     """
     Update current user's profile
     """
-    if updates.avatar_url is not None:
-        current_user.avatar_url = updates.avatar_url
+    # current_user may be a cached snapshot; change the row itself
+    user = await db.get(User, current_user.id)
+
+    if updates.avatar_url is not None and updates.avatar_url != user.avatar_url:
+        user.avatar_url = updates.avatar_url
+        # Shown in the contact lists of everyone who added this user
+        await touch_contacts_of(db, user.id)
     if updates.status_message is not None:
-        current_user.status_message = updates.status_message
+        user.status_message = updates.status_message
 
     await db.commit()
-    await db.refresh(current_user)
+    await db.refresh(user)
+    await invalidate_user(user.id)
+    await invalidate_handle(user.full_handle)
 
-    return current_user
+    return user
 
 
 @router.get("/{handle}", response_model=UserPublicInfo)
@@ -54,22 +64,15 @@ async def get_user_by_handle(
 
     This is used for finding users and getting their public keys
     """
-    if '@' not in handle:
+    handle = normalize_handle(handle)
+    if handle is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid handle format. Use username@domain"
         )
 
-    username, domain = handle.split('@', 1)
-
-    # Query for user
-    result = await db.execute(
-        select(User).where(
-            User.username == username,
-            User.domain == domain
-        )
-    )
-    user = result.scalar_one_or_none()
+    # Users on other domains are fetched from their node
+    user = await find_user(db, handle)
 
     if not user:
         raise HTTPException(
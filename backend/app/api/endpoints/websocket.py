@@ -0,0 +1,80 @@
+"""
+WebSocket endpoint for real-time message delivery
+"""
+import asyncio
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query, WebSocket, WebSocketDisconnect, status
+
+from app.db.database import async_session_maker
+from app.api.dependencies import authenticate_token
+from app.core.config import settings
+from app.services.fanout import fanout
+
+router = APIRouter()
+
+
+def _bearer_token(websocket: WebSocket, token: Optional[str]) -> Optional[str]:
+    """
+    Take the JWT from the `token` query parameter or an Authorization header
+
+    Browsers cannot set headers on WebSocket handshakes, so the query
+    parameter is the normal path; native clients may use the header.
+    """
+    if token:
+        return token
+    authorization = websocket.headers.get("authorization", "")
+    scheme, _, credentials = authorization.partition(" ")
+    if scheme.lower() == "bearer" and credentials:
+        return credentials
+    return None
+
+
+@router.websocket("")
+async def websocket_endpoint(
+    websocket: WebSocket,
+    token: Optional[str] = Query(None)
+):
+    """
+    Real-time event stream for the authenticated user
+
+    Authentication happens once, during the handshake, with the same JWT
+    used for the REST API. After that the connection performs no database
+    work: events are pushed by the send path through the fan-out backplane,
+    whichever worker accepted the message.
+    """
+    access_token = _bearer_token(websocket, token)
+    if not access_token:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    # Use a short-lived session so the connection is not held for the
+    # lifetime of the socket
+    try:
+        async with async_session_maker() as db:
+            user = await authenticate_token(access_token, db)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+    await fanout.connect(user.id, websocket)
+
+    try:
+        while True:
+            try:
+                data = await asyncio.wait_for(
+                    websocket.receive_text(),
+                    timeout=settings.WS_HEARTBEAT_INTERVAL
+                )
+            except asyncio.TimeoutError:
+                # Idle: keep intermediaries from dropping the connection
+                await websocket.send_json({"type": "ping"})
+                continue
+
+            if data == "ping":
+                await websocket.send_json({"type": "pong"})
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        await fanout.disconnect(user.id, websocket)
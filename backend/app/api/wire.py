@@ -0,0 +1,123 @@
+"""
+Content negotiation between JSON and MessagePack
+
+Routers created with `route_class=NegotiatedRoute` accept MessagePack
+request bodies, and endpoints that return `negotiated(request, model)` reply
+in whichever format the client's Accept header prefers. In MessagePack the
+ciphertext, wrapped key and IV travel as raw bytes instead of base64.
+"""
+from typing import Any, Callable
+
+import msgpack
+from fastapi import Request, Response
+from fastapi.routing import APIRoute
+from pydantic import BaseModel
+
+from app.core.envelope import b64decode, b64encode
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+MSGPACK_TYPES = {MSGPACK, "application/x-msgpack"}
+
+# Fields carried as base64 strings in JSON and as bin values in MessagePack
+BINARY_FIELDS = {"encrypted_content", "encrypted_key", "iv"}
+
+
+def _media_type(header: str) -> str:
+    return header.split(";", 1)[0].strip().lower()
+
+
+def wants_msgpack(request: Request) -> bool:
+    """
+    Whether the Accept header ranks MessagePack above JSON
+    """
+    best_json = best_msgpack = 0.0
+    for media_range in request.headers.get("accept", "").split(","):
+        media_type, _, params = media_range.partition(";")
+        media_type = media_type.strip().lower()
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if media_type in MSGPACK_TYPES:
+            best_msgpack = max(best_msgpack, quality)
+        elif media_type in (JSON, "application/*", "*/*"):
+            best_json = max(best_json, quality)
+    return best_msgpack > best_json
+
+
+def _to_binary(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {
+            key: _decode_field(item) if key in BINARY_FIELDS else _to_binary(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [_to_binary(item) for item in value]
+    return value
+
+
+def _decode_field(value: Any) -> Any:
+    if not isinstance(value, str):
+        return value
+    try:
+        return b64decode(value)
+    except ValueError:
+        return value  # legacy content that was never base64; sent as str
+
+
+def _from_binary(value: Any) -> Any:
+    if isinstance(value, bytes):
+        return b64encode(value)
+    if isinstance(value, dict):
+        return {key: _from_binary(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_from_binary(item) for item in value]
+    return value
+
+
+def negotiated(request: Request, content: BaseModel, status_code: int = 200) -> Response:
+    """
+    Serialize a response model as MessagePack or JSON, per the Accept header
+
+    The JSON path serializes straight from the model with pydantic-core,
+    skipping FastAPI's response_model re-validation and json.dumps.
+    """
+    if wants_msgpack(request):
+        body = msgpack.packb(_to_binary(content.model_dump(mode="json")))
+        return Response(body, status_code=status_code, media_type=MSGPACK)
+    return Response(content.model_dump_json(), status_code=status_code, media_type=JSON)
+
+
+class MsgpackRequest(Request):
+    """Request whose MessagePack body is presented to FastAPI as JSON"""
+
+    async def json(self) -> Any:
+        # A body that fails to unpack becomes FastAPI's 400 "error parsing the body"
+        if not hasattr(self, "_json"):
+            self._json = _from_binary(msgpack.unpackb(await self.body()))
+        return self._json
+
+
+class NegotiatedRoute(APIRoute):
+    """Route that also accepts application/msgpack request bodies"""
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def negotiated_handler(request: Request) -> Response:
+            content_type = request.headers.get("content-type")
+            if content_type and _media_type(content_type) in MSGPACK_TYPES:
+                # Relabel the body so FastAPI parses it through json()
+                headers = [
+                    (name, JSON.encode() if name == b"content-type" else value)
+                    for name, value in request.scope["headers"]
+                ]
+                request = MsgpackRequest({**request.scope, "headers": headers}, request.receive)
+            return await handler(request)
+
+        return negotiated_handler
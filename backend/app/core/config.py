@@ -1,8 +1,9 @@
 """
 Application configuration management
 """
+from pydantic import model_validator
 from pydantic_settings import BaseSettings
-from typing import List
+from typing import List, Optional
 import secrets
 
 
@@ -26,18 +27,99 @@ class Settings(BaseSettings):
     REDIS_PORT: int = 6379
     REDIS_DB: int = 0
 
+    # Real-time fan-out backplane: "local" (single worker) or "redis" (N workers)
+    FANOUT_BACKEND: str = "local"
+
     # Admin
     ADMIN_EMAIL: str = "admin@example.com"
 
     # Session
     SESSION_TIMEOUT_HOURS: int = 168  # 7 days
+    SESSION_REVOCATION_REFRESH_SECONDS: int = 30  # fallback if a control message is missed
+    SESSION_ACTIVITY_FLUSH_SECONDS: int = 60
+
+    # Argon2 hashing pool (per worker): threads, and operations admitted at
+    # once (running + queued) before login/register answer 503
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_MAX_PENDING: int = 32
+
+    # Authenticated-principal cache (per worker)
+    AUTH_CACHE_TTL_SECONDS: int = 60
+    AUTH_CACHE_MAX_ENTRIES: int = 10000
+
+    # Clients allowed to scrape /metrics (addresses or CIDR networks)
+    METRICS_ALLOWED_NETWORKS: List[str] = ["127.0.0.1/32", "::1/128"]
+
+    # Handle -> (user id, key fingerprint) cache (per worker)
+    HANDLE_CACHE_TTL_SECONDS: int = 300
+    HANDLE_CACHE_MAX_ENTRIES: int = 10000
 
     # Limits
     MAX_MESSAGE_SIZE: int = 10485760  # 10MB
     MAX_FILE_SIZE: int = 52428800  # 50MB
+    MAX_BATCH_MESSAGES: int = 100  # per POST /messages/batch
+    MAX_CONTACT_IMPORT: int = 1000  # handles per POST /contacts/import
+
+    # Group commit: store concurrent single sends with one insert and commit
+    MESSAGE_GROUP_COMMIT: bool = False
+    MESSAGE_GROUP_COMMIT_MAX_BATCH: int = 100  # flush as soon as this many are waiting
+    MESSAGE_GROUP_COMMIT_INTERVAL_MS: int = 5  # otherwise flush after this long
+
+    # Attachments: files up to ATTACHMENT_INLINE_MAX_BYTES are stored in the
+    # database, larger ones under ATTACHMENTS_DIR. With a prefix set,
+    # downloads are handed to nginx via X-Accel-Redirect (see scripts/setup.sh)
+    ATTACHMENTS_DIR: str = "data/attachments"
+    ATTACHMENT_INLINE_MAX_BYTES: int = 65536
+    ATTACHMENTS_ACCEL_REDIRECT_PREFIX: str = ""
+    # Resumable uploads idle this long are discarded by the sweeper
+    ATTACHMENT_UPLOAD_EXPIRY_HOURS: int = 24
+    ATTACHMENT_UPLOAD_SWEEP_MINUTES: int = 15
+    # Expired attachments and unreferenced blobs are collected in batches
+    ATTACHMENT_GC_INTERVAL_MINUTES: int = 10
+    ATTACHMENT_GC_BATCH_SIZE: int = 500
 
     # Federation
     FEDERATION_ENABLED: bool = True
+    FEDERATION_HTTP_TIMEOUT_SECONDS: float = 10.0
+    FEDERATION_HTTP_MAX_CONNECTIONS: int = 100  # pooled, per worker
+    # Peers resolving to private, loopback or link-local addresses are
+    # refused, since any caller can name a host; allow for local test setups
+    FEDERATION_ALLOW_PRIVATE_PEERS: bool = False
+    # Outbound delivery: rows claimed per pass, idle poll interval, requests
+    # in flight per target node, and retry backoff (doubling from BASE up to MAX)
+    FEDERATION_DELIVERY_BATCH_SIZE: int = 100
+    FEDERATION_DELIVERY_POLL_SECONDS: float = 5.0
+    FEDERATION_DELIVERY_CONCURRENCY_PER_NODE: int = 4
+    FEDERATION_DELIVERY_MAX_BATCH_MESSAGES: int = 50  # per request to one node
+    FEDERATION_DELIVERY_MAX_BATCH_BYTES: int = 1048576
+    FEDERATION_RETRY_BASE_SECONDS: int = 10
+    FEDERATION_RETRY_MAX_SECONDS: int = 3600
+    # Remote user lookups: how long answers are trusted, found and not found
+    FEDERATION_DIRECTORY_TTL_SECONDS: int = 3600
+    FEDERATION_DIRECTORY_NEGATIVE_TTL_SECONDS: int = 60
+    FEDERATION_DIRECTORY_MAX_ENTRIES: int = 10000
+    FEDERATION_DIRECTORY_CONCURRENCY: int = 16  # lookups in flight per worker
+    # Peer health probing; a node failing THRESHOLD probes in a row is offline
+    FEDERATION_PROBE_INTERVAL_SECONDS: int = 60
+    FEDERATION_PROBE_TIMEOUT_SECONDS: float = 5.0
+    FEDERATION_PROBE_CONCURRENCY: int = 10
+    FEDERATION_NODE_FAILURE_THRESHOLD: int = 3
+    # This node's Ed25519 signing key (created on first start) and inbound
+    # batches: size bounds, accepted clock skew of a signature, requests
+    # accepted at once from one peer (per worker), peer key cache lifetime.
+    # Unset, FEDERATION_INGEST_MAX_BYTES is the larger of MAX_MESSAGE_SIZE
+    # and FEDERATION_DELIVERY_MAX_BATCH_BYTES plus FEDERATION_MESSAGE_OVERHEAD_BYTES
+    # (keys, iv, handles and JSON around the content), so any message
+    # accepted locally also fits into a batch on its own. The key lives
+    # outside the source tree so it is never committed with it.
+    NODE_KEY_PATH: str = "~/.mychat/node_key.pem"
+    FEDERATION_INGEST_MAX_MESSAGES: int = 200
+    FEDERATION_INGEST_MAX_BYTES: Optional[int] = None
+    FEDERATION_MESSAGE_OVERHEAD_BYTES: int = 65536
+    FEDERATION_SIGNATURE_MAX_SKEW_SECONDS: int = 300
+    FEDERATION_INGEST_CONCURRENCY_PER_PEER: int = 2
+    FEDERATION_PEER_KEY_TTL_SECONDS: int = 300
+    FEDERATION_PEER_KEY_FETCHES_PER_MINUTE: int = 60  # per worker, all peers
 
     # Registration
     REGISTRATION_OPEN: bool = True
@@ -51,6 +133,18 @@ class Settings(BaseSettings):
     # WebSocket
     WS_HEARTBEAT_INTERVAL: int = 30  # seconds
 
+    # Sync
+    SYNC_LONG_POLL_MAX_SECONDS: int = 30
+
+    @model_validator(mode="after")
+    def derive_ingest_limit(self) -> "Settings":
+        if self.FEDERATION_INGEST_MAX_BYTES is None:
+            self.FEDERATION_INGEST_MAX_BYTES = (
+                max(self.MAX_MESSAGE_SIZE, self.FEDERATION_DELIVERY_MAX_BATCH_BYTES)
+                + self.FEDERATION_MESSAGE_OVERHEAD_BYTES
+            )
+        return self
+
     @property
     def DATABASE_URL(self) -> str:
         """Construct database URL"""
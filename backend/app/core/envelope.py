@@ -0,0 +1,127 @@
+"""
+Compact binary storage format for encrypted messages
+
+Clients exchange ciphertext, wrapped keys and IVs as base64 strings. The
+server stores them decoded, in a single bytea value:
+
+    version       1 byte   (ENVELOPE_VERSION)
+    algorithm     1 byte   (id from ALGORITHMS, 0 = unspecified)
+    iv length     1 byte, followed by the IV
+    key count     1 byte, followed by each wrapped key as
+                  2-byte big-endian length + key bytes
+    ciphertext    the remaining bytes
+"""
+import base64
+import binascii
+import struct
+from typing import List, NamedTuple, Optional
+
+ENVELOPE_VERSION = 1
+
+# Stable ids for the algorithm names clients send; never renumber
+ALGORITHMS = {
+    1: "AES-256-GCM+RSA-4096-OAEP",
+}
+ALGORITHM_IDS = {name: algorithm_id for algorithm_id, name in ALGORITHMS.items()}
+
+# Header of an envelope with no algorithm, IV or keys, as used by the
+# migration that converts legacy base64 rows
+BARE_HEADER = bytes((ENVELOPE_VERSION, 0, 0, 0))
+
+
+class Envelope(NamedTuple):
+    """Decoded envelope contents"""
+    algorithm: Optional[str]
+    iv: bytes
+    keys: List[bytes]
+    ciphertext: bytes
+
+
+def pack_envelope(envelope: Envelope) -> bytes:
+    """
+    Serialize an envelope
+
+    Raises ValueError if the algorithm is unknown or a field is too long
+    for the format.
+    """
+    algorithm_id = ALGORITHM_IDS[envelope.algorithm] if envelope.algorithm else 0
+    if len(envelope.iv) > 0xFF or len(envelope.keys) > 0xFF:
+        raise ValueError("IV or key list too long for envelope")
+
+    parts = [bytes((ENVELOPE_VERSION, algorithm_id, len(envelope.iv))), envelope.iv, bytes((len(envelope.keys),))]
+    for key in envelope.keys:
+        if len(key) > 0xFFFF:
+            raise ValueError("Wrapped key too long for envelope")
+        parts.append(struct.pack(">H", len(key)))
+        parts.append(key)
+    parts.append(envelope.ciphertext)
+    return b"".join(parts)
+
+
+def unpack_envelope(data: bytes) -> Envelope:
+    """
+    Parse an envelope produced by pack_envelope
+    """
+    data = memoryview(data)
+    if data[0] != ENVELOPE_VERSION:
+        raise ValueError(f"Unsupported envelope version {data[0]}")
+
+    algorithm = ALGORITHMS.get(data[1])
+    iv_end = 3 + data[2]
+    iv = bytes(data[3:iv_end])
+
+    offset = iv_end + 1
+    keys = []
+    for _ in range(data[iv_end]):
+        (length,) = struct.unpack_from(">H", data, offset)
+        offset += 2
+        keys.append(bytes(data[offset:offset + length]))
+        offset += length
+
+    return Envelope(algorithm, iv, keys, bytes(data[offset:]))
+
+
+def b64decode(value: str) -> bytes:
+    """
+    Decode a base64 field from the API, accepting canonical encodings only
+
+    Raises ValueError otherwise.
+    """
+    raw = base64.b64decode(value, validate=True)
+    # Only accept canonical encodings, so reads return exactly what was sent
+    if base64.b64encode(raw).decode() != value:
+        raise ValueError("Non-canonical base64")
+    return raw
+
+
+def encode_message(
+    encrypted_content: str,
+    encrypted_key: Optional[str],
+    iv: str,
+    algorithm: Optional[str]
+) -> Optional[bytes]:
+    """
+    Build the stored envelope for a message as submitted by a client
+
+    Returns None when the fields cannot be represented losslessly (not
+    base64, unknown algorithm); such messages keep the legacy text column.
+    """
+    if algorithm and algorithm not in ALGORITHM_IDS:
+        return None
+    try:
+        envelope = Envelope(
+            algorithm=algorithm,
+            iv=b64decode(iv),
+            keys=[b64decode(encrypted_key)] if encrypted_key is not None else [],
+            ciphertext=b64decode(encrypted_content)
+        )
+        return pack_envelope(envelope)
+    except (binascii.Error, ValueError):
+        return None
+
+
+def b64encode(data: bytes) -> str:
+    """
+    Base64-encode envelope fields for the API
+    """
+    return base64.b64encode(data).decode()
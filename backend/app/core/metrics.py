@@ -0,0 +1,87 @@
+"""
+Prometheus metrics
+
+prometheus-client is an optional dependency. Without it every metric below
+is a no-op and the /metrics endpoint is not mounted. Each worker process
+keeps its own registry. The endpoint only answers clients in
+METRICS_ALLOWED_NETWORKS.
+"""
+from ipaddress import ip_address, ip_network
+from typing import Optional, Tuple
+
+from app.core.config import settings
+
+
+class _NoopMetric:
+    """Stand-in accepting the calls made on Counter, Gauge and Histogram"""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def labels(self, *args, **kwargs) -> "_NoopMetric":
+        return self
+
+    def inc(self, amount: float = 1) -> None:
+        pass
+
+    def dec(self, amount: float = 1) -> None:
+        pass
+
+    def set(self, value: float) -> None:
+        pass
+
+    def observe(self, amount: float) -> None:
+        pass
+
+
+try:
+    from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+    METRICS_ENABLED = True
+except ImportError:  # pragma: no cover - depends on the installation
+    METRICS_ENABLED = False
+    Counter = Gauge = Histogram = _NoopMetric
+
+
+_allowed_networks = [ip_network(network, strict=False) for network in settings.METRICS_ALLOWED_NETWORKS]
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """
+    Current values in the Prometheus text format, with its content type
+    """
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def scrape_allowed(host: Optional[str]) -> bool:
+    """
+    Whether a client address may read /metrics
+    """
+    try:
+        address = ip_address(host or "")
+    except ValueError:
+        return False
+    return any(address in network for network in _allowed_networks)
+
+
+# Password hashing (app.core.security)
+PASSWORD_HASH_QUEUE_DEPTH = Gauge(
+    "mychat_password_hash_queue_depth",
+    "Password hash/verify operations admitted and not yet finished"
+)
+PASSWORD_HASH_SECONDS = Histogram(
+    "mychat_password_hash_seconds",
+    "Time spent computing an Argon2 hash or verification",
+    ["operation"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+PASSWORD_HASH_WAIT_SECONDS = Histogram(
+    "mychat_password_hash_wait_seconds",
+    "Time an admitted operation waited for a hashing thread",
+    ["operation"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+PASSWORD_HASH_REJECTED = Counter(
+    "mychat_password_hash_rejected_total",
+    "Operations refused because the hashing queue was full",
+    ["operation"]
+)
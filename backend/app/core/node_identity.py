@@ -0,0 +1,110 @@
+"""
+Signing identity of this node
+
+Batches sent to other nodes are signed with an Ed25519 key kept at
+NODE_KEY_PATH, created on first start. The public half is published in the
+well-known document, where peers fetch it to verify what we send. The
+private half never belongs in the repository; a key that was ever pushed
+must be replaced.
+
+A signature covers the origin domain, a Unix timestamp and the exact
+request body:
+
+    origin + "\\n" + timestamp + "\\n" + body
+
+and travels base64-encoded in the X-MyChat-Signature header, next to
+X-MyChat-Origin and X-MyChat-Timestamp.
+"""
+import base64
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Optional
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
+
+from app.core.config import settings
+
+ORIGIN_HEADER = "X-MyChat-Origin"
+TIMESTAMP_HEADER = "X-MyChat-Timestamp"
+SIGNATURE_HEADER = "X-MyChat-Signature"
+
+_private_key: Optional[Ed25519PrivateKey] = None
+
+
+def signed_bytes(origin: str, timestamp: str, body: bytes) -> bytes:
+    """
+    The bytes a request signature covers
+    """
+    return f"{origin}\n{timestamp}\n".encode() + body
+
+
+def _load_or_create(path: Path) -> Ed25519PrivateKey:
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        pem = Ed25519PrivateKey.generate().private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption()
+        )
+        # Write aside and link into place, so workers starting together
+        # all end up with whichever key got there first
+        part = path.with_name(f".{path.name}.{uuid.uuid4().hex}")
+        fd = os.open(part, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as file:
+            file.write(pem)
+            file.flush()
+            os.fsync(file.fileno())
+        try:
+            os.link(part, path)
+        except FileExistsError:
+            pass
+        finally:
+            part.unlink()
+
+    key = serialization.load_pem_private_key(path.read_bytes(), password=None)
+    if not isinstance(key, Ed25519PrivateKey):
+        raise ValueError(f"{path} does not hold an Ed25519 private key")
+    return key
+
+
+def private_key() -> Ed25519PrivateKey:
+    global _private_key
+    if _private_key is None:
+        _private_key = _load_or_create(Path(settings.NODE_KEY_PATH).expanduser())
+    return _private_key
+
+
+def public_key_pem() -> str:
+    """
+    This node's public key as published in the well-known document
+    """
+    return private_key().public_key().public_bytes(
+        serialization.Encoding.PEM,
+        serialization.PublicFormat.SubjectPublicKeyInfo
+    ).decode()
+
+
+def load_public_key(pem: str) -> Ed25519PublicKey:
+    """
+    Parse a peer's published key; raises ValueError if it is not Ed25519
+    """
+    key = serialization.load_pem_public_key(pem.encode())
+    if not isinstance(key, Ed25519PublicKey):
+        raise ValueError("Not an Ed25519 public key")
+    return key
+
+
+def signature_headers(body: bytes) -> Dict[str, str]:
+    """
+    Headers authenticating a request body as sent by this node
+    """
+    timestamp = str(int(time.time()))
+    signature = private_key().sign(signed_bytes(settings.DOMAIN, timestamp, body))
+    return {
+        ORIGIN_HEADER: settings.DOMAIN,
+        TIMESTAMP_HEADER: timestamp,
+        SIGNATURE_HEADER: base64.b64encode(signature).decode(),
+    }
@@ -0,0 +1,18 @@
+"""
+Periodic background jobs
+
+Services add their jobs to this scheduler while the app starts; the
+lifespan starts it after that and shuts it down on exit. Every worker
+process runs its own scheduler, so jobs that must run once per node have
+to coordinate through the database.
+"""
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+scheduler = AsyncIOScheduler(
+    timezone="UTC",
+    job_defaults={
+        "coalesce": True,  # run a late job once, not once per missed interval
+        "max_instances": 1,
+        "misfire_grace_time": 30,
+    }
+)
@@ -1,15 +1,34 @@
 """
 Security utilities - password hashing, JWT tokens, etc.
 """
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+from typing import Callable, Optional, Dict, Any, TypeVar
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from app.core.config import settings
+from app.core.metrics import (
+    PASSWORD_HASH_QUEUE_DEPTH,
+    PASSWORD_HASH_REJECTED,
+    PASSWORD_HASH_SECONDS,
+    PASSWORD_HASH_WAIT_SECONDS,
+)
 
 # Password hashing context using Argon2
 pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
 
+# Argon2 runs in these threads (argon2-cffi releases the GIL), never on the
+# event loop; at most PASSWORD_HASH_MAX_PENDING operations may be admitted
+_hash_executor = ThreadPoolExecutor(
+    max_workers=settings.PASSWORD_HASH_WORKERS,
+    thread_name_prefix="argon2"
+)
+_hash_pending = 0
+
+T = TypeVar("T")
+
 # JWT settings
 ALGORITHM = "HS256"
 
@@ -28,6 +47,60 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+class PasswordHasherBusy(Exception):
+    """The password hashing queue is full; retry later"""
+
+
+async def _in_hash_pool(operation: str, func: Callable[..., T], *args) -> T:
+    global _hash_pending
+    if _hash_pending >= settings.PASSWORD_HASH_MAX_PENDING:
+        PASSWORD_HASH_REJECTED.labels(operation).inc()
+        raise PasswordHasherBusy()
+
+    admitted_at = time.perf_counter()
+
+    def timed() -> T:
+        started_at = time.perf_counter()
+        PASSWORD_HASH_WAIT_SECONDS.labels(operation).observe(started_at - admitted_at)
+        try:
+            return func(*args)
+        finally:
+            PASSWORD_HASH_SECONDS.labels(operation).observe(time.perf_counter() - started_at)
+
+    _hash_pending += 1
+    PASSWORD_HASH_QUEUE_DEPTH.inc()
+    # The slot is freed when the work is done, not when the caller stops
+    # waiting: a cancelled request does not stop a hash already running
+    loop = asyncio.get_running_loop()
+    job = _hash_executor.submit(timed)
+    job.add_done_callback(lambda _: loop.call_soon_threadsafe(_release_hash_slot))
+    return await asyncio.wrap_future(job)
+
+
+def _release_hash_slot() -> None:
+    global _hash_pending
+    _hash_pending -= 1
+    PASSWORD_HASH_QUEUE_DEPTH.dec()
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """
+    verify_password() on the hashing pool
+
+    Raises PasswordHasherBusy when the pool's queue is full.
+    """
+    return await _in_hash_pool("verify", verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """
+    get_password_hash() on the hashing pool
+
+    Raises PasswordHasherBusy when the pool's queue is full.
+    """
+    return await _in_hash_pool("hash", get_password_hash, password)
+
+
 def create_access_token(data: Dict[str, Any], expires_delta: Optional[timedelta] = None) -> str:
     """
     Create a JWT access token
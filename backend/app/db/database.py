@@ -1,9 +1,14 @@
 """
 Database connection and session management
 """
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import declarative_base
 from app.core.config import settings
+from app.db.migrations import run_migrations
+
+# Advisory lock key serializing schema setup across workers
+INIT_DB_LOCK_KEY = 0x6D7963686174  # "mychat"
 
 # Create async engine
 engine = create_async_engine(
@@ -45,10 +50,20 @@ async def get_db() -> AsyncSession:
 
 async def init_db():
     """
-    Initialize database - create all tables
+    Initialize database - create all tables and apply schema upgrades
+
+    Several workers may start at once; a session-level advisory lock makes
+    them run this one after another.
     """
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    async with engine.connect() as conn:
+        await conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": INIT_DB_LOCK_KEY})
+        try:
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.commit()
+            await run_migrations(conn)
+        finally:
+            await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": INIT_DB_LOCK_KEY})
+            await conn.commit()
 
 
 async def close_db():
@@ -0,0 +1,228 @@
+"""
+Incremental schema upgrades for existing databases
+
+init_db() creates missing tables with create_all(), which never alters a
+table that already exists. Column additions, backfills and new indexes on
+existing tables are listed here and applied once, in order. The applied
+version is tracked under the `schema_version` key in system_config.
+
+Every step must be idempotent: each one commits on its own, so an upgrade
+interrupted half-way is simply resumed on the next start.
+"""
+from typing import Awaitable, Callable, List, Tuple, Union
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.dialects.postgresql import ARRAY, UUID
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.core.envelope import BARE_HEADER
+
+# Rows updated per transaction by backfill steps
+BACKFILL_BATCH_SIZE = 5000
+
+SCHEMA_VERSION_KEY = "schema_version"
+
+Step = Union[str, Callable[[AsyncConnection], Awaitable[None]]]
+
+
+async def _backfill_conversation_ids(conn: AsyncConnection) -> None:
+    """
+    Fill messages.conversation_id for rows written before the column existed
+    """
+    while True:
+        result = await conn.execute(text("""
+            UPDATE messages
+            SET conversation_id = COALESCE(
+                group_id,
+                md5(LEAST(sender_id, recipient_id)::text || ':' ||
+                    GREATEST(sender_id, recipient_id)::text)::uuid
+            )
+            WHERE id IN (
+                SELECT id FROM messages
+                WHERE conversation_id IS NULL
+                  AND (group_id IS NOT NULL OR (sender_id IS NOT NULL AND recipient_id IS NOT NULL))
+                LIMIT :batch
+            )
+        """), {"batch": BACKFILL_BATCH_SIZE})
+        await conn.commit()
+        if result.rowcount == 0:
+            break
+
+
+async def _backfill_message_envelopes(conn: AsyncConnection) -> None:
+    """
+    Move base64 encrypted_content of legacy rows into binary envelopes
+
+    Walks the table in primary key order so rows that cannot be converted
+    (not canonical base64) are visited once and left as they are.
+    """
+    convert = text("""
+        UPDATE messages
+        SET envelope = :header || decode(encrypted_content, 'base64'),
+            encrypted_content = NULL
+        WHERE id = ANY(:ids)
+          AND encrypted_content ~ '^[A-Za-z0-9+/]*={0,2}$'
+          AND length(encrypted_content) % 4 = 0
+          AND replace(encode(decode(encrypted_content, 'base64'), 'base64'), E'\\n', '') = encrypted_content
+    """).bindparams(bindparam("ids", type_=ARRAY(UUID(as_uuid=True))))
+
+    after = None
+    while True:
+        result = await conn.execute(text("""
+            SELECT id FROM messages
+            WHERE envelope IS NULL AND encrypted_content IS NOT NULL
+              AND (CAST(:after AS uuid) IS NULL OR id > :after)
+            ORDER BY id
+            LIMIT :batch
+        """), {"after": after, "batch": BACKFILL_BATCH_SIZE})
+        ids = list(result.scalars().all())
+        if not ids:
+            break
+        await conn.execute(convert, {"header": BARE_HEADER, "ids": ids})
+        await conn.commit()
+        after = ids[-1]
+
+
+BACKFILL_CONVERSATION_SUMMARIES = """
+    INSERT INTO conversation_summaries (
+        id, user_id, conversation_id, peer_id, peer_handle,
+        last_message_id, last_message_at, last_sender_handle, last_content_type,
+        unread_count, updated_at
+    )
+    SELECT
+        gen_random_uuid(), s.user_id, s.conversation_id, s.peer_id, s.peer_handle,
+        s.id, s.created_at, s.sender_handle, s.content_type,
+        (SELECT count(*) FROM messages u
+         WHERE u.conversation_id = s.conversation_id
+           AND u.recipient_id = s.user_id
+           AND u.read_at IS NULL),
+        now()
+    FROM (
+        SELECT DISTINCT ON (p.user_id, m.conversation_id)
+            p.user_id, m.conversation_id, p.peer_id, p.peer_handle,
+            m.id, m.created_at, m.sender_handle, m.content_type
+        FROM messages m
+        CROSS JOIN LATERAL (VALUES
+            (m.sender_id, m.recipient_id, m.recipient_handle),
+            (m.recipient_id, m.sender_id, m.sender_handle)
+        ) AS p(user_id, peer_id, peer_handle)
+        WHERE m.group_id IS NULL
+          AND m.conversation_id IS NOT NULL
+          AND p.user_id IS NOT NULL
+        ORDER BY p.user_id, m.conversation_id, m.created_at DESC, m.id DESC
+    ) s
+    ON CONFLICT (user_id, conversation_id) DO NOTHING
+"""
+
+
+# Keeps attachment_blobs.ref_count equal to the number of attachments
+# pointing at each blob, including rows removed by ON DELETE CASCADE
+ATTACHMENT_BLOB_REFS_FUNCTION = """
+    CREATE OR REPLACE FUNCTION attachment_blob_refs() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.blob_digest IS NOT NULL THEN
+            UPDATE attachment_blobs
+            SET ref_count = ref_count - 1,
+                unreferenced_at = CASE WHEN ref_count = 1 THEN now() ELSE unreferenced_at END
+            WHERE digest = OLD.blob_digest;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.blob_digest IS NOT NULL THEN
+            UPDATE attachment_blobs
+            SET ref_count = ref_count + 1, unreferenced_at = NULL
+            WHERE digest = NEW.blob_digest;
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+"""
+
+
+# (version, description, steps)
+MIGRATIONS: List[Tuple[int, str, List[Step]]] = [
+    (1, "messages.conversation_id with keyset index", [
+        "ALTER TABLE messages ADD COLUMN IF NOT EXISTS conversation_id UUID",
+        _backfill_conversation_ids,
+        "CREATE INDEX IF NOT EXISTS idx_conversation_messages "
+        "ON messages (conversation_id, created_at, id)",
+    ]),
+    (2, "conversation_summaries from existing messages", [
+        BACKFILL_CONVERSATION_SUMMARIES,
+    ]),
+    (3, "users.event_seq for the sync event stream", [
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS event_seq BIGINT NOT NULL DEFAULT 0",
+    ]),
+    (4, "binary message envelopes", [
+        "ALTER TABLE messages ADD COLUMN IF NOT EXISTS envelope BYTEA",
+        "ALTER TABLE messages ALTER COLUMN encrypted_content DROP NOT NULL",
+        _backfill_message_envelopes,
+    ]),
+    (5, "sessions.revoked_at for session revocation", [
+        "ALTER TABLE sessions ADD COLUMN IF NOT EXISTS revoked_at TIMESTAMPTZ",
+        "CREATE INDEX IF NOT EXISTS idx_revoked_sessions "
+        "ON sessions (revoked_at) WHERE revoked_at IS NOT NULL",
+    ]),
+    (6, "content-addressed attachment blobs with reference counts", [
+        "ALTER TABLE attachments ADD COLUMN IF NOT EXISTS blob_digest VARCHAR(64) "
+        "REFERENCES attachment_blobs (digest)",
+        "CREATE INDEX IF NOT EXISTS idx_attachment_blob ON attachments (blob_digest)",
+        "CREATE INDEX IF NOT EXISTS idx_attachment_expiry "
+        "ON attachments (expires_at) WHERE expires_at IS NOT NULL",
+        ATTACHMENT_BLOB_REFS_FUNCTION,
+        "DROP TRIGGER IF EXISTS attachment_blob_refs ON attachments",
+        "CREATE TRIGGER attachment_blob_refs "
+        "AFTER INSERT OR DELETE OR UPDATE OF blob_digest ON attachments "
+        "FOR EACH ROW EXECUTE FUNCTION attachment_blob_refs()",
+    ]),
+    (7, "federated node health probing", [
+        "ALTER TABLE federated_nodes ADD COLUMN IF NOT EXISTS consecutive_failures INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE federated_nodes ADD COLUMN IF NOT EXISTS next_probe_at TIMESTAMPTZ DEFAULT now()",
+        "CREATE INDEX IF NOT EXISTS idx_node_next_probe ON federated_nodes (next_probe_at)",
+    ]),
+    (8, "origin ids of messages received from other nodes", [
+        "ALTER TABLE messages ADD COLUMN IF NOT EXISTS origin_message_id UUID",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_origin_message "
+        "ON messages (origin_node, origin_message_id) WHERE origin_message_id IS NOT NULL",
+    ]),
+    (9, "contact list versions for delta sync", [
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS contacts_version BIGINT NOT NULL DEFAULT 0",
+        "ALTER TABLE contacts ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0",
+        "CREATE INDEX IF NOT EXISTS idx_contact_versions ON contacts (user_id, version)",
+    ]),
+]
+
+
+async def _current_version(conn: AsyncConnection) -> int:
+    result = await conn.execute(
+        text("SELECT value FROM system_config WHERE key = :key"),
+        {"key": SCHEMA_VERSION_KEY}
+    )
+    value = result.scalar_one_or_none()
+    return int(value) if value else 0
+
+
+async def _set_version(conn: AsyncConnection, version: int) -> None:
+    await conn.execute(text("""
+        INSERT INTO system_config (key, value, description)
+        VALUES (:key, :value, 'Applied schema migration version')
+        ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, updated_at = now()
+    """), {"key": SCHEMA_VERSION_KEY, "value": str(version)})
+
+
+async def run_migrations(conn: AsyncConnection) -> None:
+    """
+    Apply pending migrations on a connection that holds the init lock
+    """
+    current = await _current_version(conn)
+    await conn.commit()
+
+    for version, _description, steps in MIGRATIONS:
+        if version <= current:
+            continue
+        for step in steps:
+            if callable(step):
+                await step(conn)
+            else:
+                await conn.execute(text(step))
+            await conn.commit()
+        await _set_version(conn, version)
+        await conn.commit()
@@ -2,13 +2,21 @@
 MyChat - Federated Privacy-First Chat System
 Main FastAPI application
 """
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 
 from app.core.config import settings
+from app.core.metrics import METRICS_ENABLED, render_metrics, scrape_allowed
+from app.core.scheduler import scheduler
 from app.db.database import init_db, close_db
-from app.api.endpoints import auth, users, messages, contacts, groups, keys, node
+from app.services.fanout import fanout
+from app.services.delivery import delivery_worker
+from app.services.federation import close_http_client
+from app.services.group_commit import message_batcher
+from app.services.sessions import session_registry
+from app.services import attachment_gc, attachment_uploads, node_prober
+from app.api.endpoints import auth, users, messages, contacts, groups, keys, node, websocket, sync, attachments, federation
 
 
 @asynccontextmanager
@@ -18,8 +26,24 @@ async def lifespan(app: FastAPI):
     """
     # Startup
     await init_db()
+    await fanout.start()
+    if settings.MESSAGE_GROUP_COMMIT:
+        await message_batcher.start()
+    await session_registry.start()
+    if settings.FEDERATION_ENABLED:
+        await delivery_worker.start()
+        node_prober.start()
+    attachment_uploads.start()
+    attachment_gc.start()
+    scheduler.start()
     yield
     # Shutdown
+    scheduler.shutdown(wait=False)
+    await session_registry.stop()
+    await delivery_worker.stop()
+    await close_http_client()
+    await message_batcher.stop()
+    await fanout.stop()
     await close_db()
 
 
@@ -45,9 +69,13 @@ app.include_router(auth.router, prefix=f"{settings.API_V1_PREFIX}/auth", tags=["
 app.include_router(users.router, prefix=f"{settings.API_V1_PREFIX}/users", tags=["Users"])
 app.include_router(messages.router, prefix=f"{settings.API_V1_PREFIX}/messages", tags=["Messages"])
 app.include_router(contacts.router, prefix=f"{settings.API_V1_PREFIX}/contacts", tags=["Contacts"])
+app.include_router(attachments.router, prefix=f"{settings.API_V1_PREFIX}/attachments", tags=["Attachments"])
 app.include_router(groups.router, prefix=f"{settings.API_V1_PREFIX}/groups", tags=["Groups"])
 app.include_router(keys.router, prefix=f"{settings.API_V1_PREFIX}/keys", tags=["Keys"])
+app.include_router(federation.router, prefix=f"{settings.API_V1_PREFIX}/federation", tags=["Federation"])
 app.include_router(node.router, prefix=f"{settings.API_V1_PREFIX}/node", tags=["Node Info"])
+app.include_router(sync.router, prefix=f"{settings.API_V1_PREFIX}/sync", tags=["Sync"])
+app.include_router(websocket.router, prefix=f"{settings.API_V1_PREFIX}/ws", tags=["WebSocket"])
 
 
 @app.get("/")
@@ -69,6 +97,16 @@ async def health_check():
     return {"status": "healthy"}
 
 
+if METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics(request: Request):
+        """Prometheus metrics for this worker, for METRICS_ALLOWED_NETWORKS only"""
+        if not scrape_allowed(request.client.host if request.client else None):
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+        body, content_type = render_metrics()
+        return Response(body, media_type=content_type)
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
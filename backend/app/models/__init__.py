@@ -2,7 +2,7 @@
 Database models
 """
 from app.models.user import User
-from app.models.contact import Contact
+from app.models.contact import Contact, ContactTombstone
 from app.models.message import Message
 from app.models.group import Group, GroupMember
 from app.models.session import Session
@@ -10,12 +10,16 @@ from app.models.federated_node import FederatedNode
 from app.models.legal import LegalRequest, LegalAuditLog
 from app.models.donation import DonationWallet, DonationLink, DonationAnalytics, NodeDonationSettings
 from app.models.system import SystemConfig
-from app.models.attachment import Attachment
+from app.models.attachment import Attachment, AttachmentBlob
+from app.models.attachment_upload import AttachmentUpload
 from app.models.message_queue import MessageQueue
+from app.models.conversation_summary import ConversationSummary
+from app.models.user_event import UserEvent
 
 __all__ = [
     "User",
     "Contact",
+    "ContactTombstone",
     "Message",
     "Group",
     "GroupMember",
@@ -29,5 +33,9 @@ __all__ = [
     "NodeDonationSettings",
     "SystemConfig",
     "Attachment",
+    "AttachmentBlob",
+    "AttachmentUpload",
     "MessageQueue",
+    "ConversationSummary",
+    "UserEvent",
 ]
@@ -1,13 +1,40 @@
 """
 Attachment model
 """
-from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Index, Text, LargeBinary
+from sqlalchemy import Column, String, Integer, BigInteger, DateTime, ForeignKey, Index, Text, LargeBinary
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.sql import func
 import uuid
 from app.db.database import Base
 
 
+class AttachmentBlob(Base):
+    """
+    Encrypted attachment bytes, stored once per distinct content
+
+    Keyed by the SHA-256 of the ciphertext. Small blobs are kept in `data`,
+    larger ones on disk at attachment_store.blob_path(digest). `ref_count`
+    is maintained by a trigger on attachments (see migration 6) and
+    `unreferenced_at` records when it last dropped to zero, for the GC.
+    """
+    __tablename__ = "attachment_blobs"
+
+    digest = Column(String(64), primary_key=True)
+    size = Column(BigInteger, nullable=False)
+    data = Column(LargeBinary, nullable=True)
+
+    ref_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    unreferenced_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index('idx_unreferenced_blobs', 'unreferenced_at', postgresql_where=(ref_count == 0)),
+    )
+
+    def __repr__(self):
+        return f"<AttachmentBlob {self.digest[:12]} refs={self.ref_count}>"
+
+
 class Attachment(Base):
     """File attachment model"""
     __tablename__ = "attachments"
@@ -15,7 +42,9 @@ class Attachment(Base):
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     message_id = Column(UUID(as_uuid=True), ForeignKey("messages.id", ondelete="CASCADE"), nullable=False)
 
-    # Encrypted file data
+    # Encrypted file data: the shared blob, or for attachments stored before
+    # content addressing, inline bytes or a file of their own
+    blob_digest = Column(String(64), ForeignKey("attachment_blobs.digest"), nullable=True)
     encrypted_data = Column(LargeBinary, nullable=True)  # For small files
     file_path = Column(Text, nullable=True)  # For larger files stored on disk
 
@@ -32,6 +61,8 @@ class Attachment(Base):
 
     __table_args__ = (
         Index('idx_message_attachments', 'message_id'),
+        Index('idx_attachment_blob', 'blob_digest'),
+        Index('idx_attachment_expiry', 'expires_at', postgresql_where=(expires_at.isnot(None))),
     )
 
     def __repr__(self):
@@ -0,0 +1,45 @@
+"""
+Attachment upload model (resumable uploads in progress)
+"""
+from sqlalchemy import Column, String, BigInteger, DateTime, ForeignKey, Index, Text
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.sql import func
+import uuid
+from app.db.database import Base
+
+
+class AttachmentUpload(Base):
+    """
+    An attachment being uploaded in chunks
+
+    The bytes received so far live in `file_path` under ATTACHMENTS_DIR;
+    `received` only counts bytes that were synced to disk. Completing the
+    upload turns it into an Attachment and deletes this row; uploads left
+    unfinished past `expires_at` are removed by the sweeper.
+    """
+    __tablename__ = "attachment_uploads"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    message_id = Column(UUID(as_uuid=True), ForeignKey("messages.id", ondelete="CASCADE"), nullable=False)
+    uploader_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+
+    # Attachment metadata, copied over on completion
+    filename = Column(String(255), nullable=False)
+    mime_type = Column(String(100), nullable=True)
+    encryption_method = Column(String(50), default="AES-256-GCM")
+
+    # Progress
+    file_path = Column(Text, nullable=False)
+    total_size = Column(BigInteger, nullable=False)
+    received = Column(BigInteger, nullable=False, default=0)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (
+        Index('idx_attachment_upload_expiry', 'expires_at'),
+    )
+
+    def __repr__(self):
+        return f"<AttachmentUpload {self.filename} {self.received}/{self.total_size}>"
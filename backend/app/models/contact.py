@@ -1,7 +1,7 @@
 """
 Contact model
 """
-from sqlalchemy import Column, String, DateTime, ForeignKey, Index
+from sqlalchemy import Column, String, BigInteger, DateTime, ForeignKey, Index
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.sql import func
 import uuid
@@ -19,10 +19,32 @@ class Contact(Base):
     added_at = Column(DateTime(timezone=True), server_default=func.now())
     last_message_at = Column(DateTime(timezone=True), nullable=True)
 
+    # The owner's contacts_version when this row last changed
+    version = Column(BigInteger, nullable=False, default=0, server_default="0")
+
     __table_args__ = (
         Index('idx_user_contact', 'user_id', 'contact_id', unique=True),
         Index('idx_user_contacts', 'user_id', 'last_message_at'),
+        Index('idx_contact_versions', 'user_id', 'version'),
     )
 
     def __repr__(self):
         return f"<Contact {self.user_id} -> {self.contact_id}>"
+
+
+class ContactTombstone(Base):
+    """A removed contact, kept so delta syncs can report the removal"""
+    __tablename__ = "contact_tombstones"
+
+    # id of the removed contacts row
+    contact_id = Column(UUID(as_uuid=True), primary_key=True)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    version = Column(BigInteger, nullable=False)
+    removed_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index('idx_contact_tombstone_versions', 'user_id', 'version'),
+    )
+
+    def __repr__(self):
+        return f"<ContactTombstone {self.contact_id}>"
@@ -0,0 +1,43 @@
+"""
+Conversation summary model (per-user inbox)
+"""
+from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Index
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.sql import func
+import uuid
+from app.db.database import Base
+
+
+class ConversationSummary(Base):
+    """
+    One inbox entry per user and conversation
+
+    Maintained incrementally by the send and read paths so the inbox is a
+    single indexed read.
+    """
+    __tablename__ = "conversation_summaries"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    conversation_id = Column(UUID(as_uuid=True), nullable=False)
+
+    # The other participant (1-on-1 conversations)
+    peer_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
+    peer_handle = Column(String(306), nullable=True)
+
+    # Latest message
+    last_message_id = Column(UUID(as_uuid=True), ForeignKey("messages.id", ondelete="SET NULL"), nullable=True)
+    last_message_at = Column(DateTime(timezone=True), nullable=True)
+    last_sender_handle = Column(String(306), nullable=True)
+    last_content_type = Column(String(50), nullable=True)
+
+    unread_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        Index('idx_user_conversation', 'user_id', 'conversation_id', unique=True),
+        Index('idx_user_inbox', 'user_id', 'last_message_at', 'id'),
+    )
+
+    def __repr__(self):
+        return f"<ConversationSummary {self.user_id} / {self.conversation_id}>"
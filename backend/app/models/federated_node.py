@@ -26,7 +26,11 @@ class FederatedNode(Base):
 
     # Stats
     user_count = Column(Integer, default=0)
-    avg_latency_ms = Column(Integer, nullable=True)
+    avg_latency_ms = Column(Integer, nullable=True)  # moving average of probes
+
+    # Health probing (app.services.node_prober)
+    consecutive_failures = Column(Integer, nullable=False, default=0, server_default="0")
+    next_probe_at = Column(DateTime(timezone=True), server_default=func.now())
 
     # Settings
     auto_discovered = Column(Boolean, default=True)
@@ -38,6 +42,7 @@ class FederatedNode(Base):
     __table_args__ = (
         Index('idx_status', 'status'),
         Index('idx_node_last_seen', 'last_seen'),
+        Index('idx_node_next_probe', 'next_probe_at'),
     )
 
     def __repr__(self):
@@ -1,13 +1,25 @@
 """
 Message model
 """
-from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Index, Text, CheckConstraint
+from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Index, Text, CheckConstraint, LargeBinary
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.sql import func
+import hashlib
 import uuid
 from app.db.database import Base
 
 
+def conversation_key(user_a: uuid.UUID, user_b: uuid.UUID) -> uuid.UUID:
+    """
+    Canonical conversation id for a 1-on-1 conversation
+
+    Symmetric in its arguments. Matches the SQL used to backfill existing
+    rows: md5(least(a, b)::text || ':' || greatest(a, b)::text)::uuid
+    """
+    low, high = sorted((user_a, user_b))
+    return uuid.UUID(hashlib.md5(f"{low}:{high}".encode()).hexdigest())
+
+
 class Message(Base):
     """Message model"""
     __tablename__ = "messages"
@@ -17,8 +29,14 @@ class Message(Base):
     recipient_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=True)
     group_id = Column(UUID(as_uuid=True), ForeignKey("groups.id", ondelete="CASCADE"), nullable=True)
 
-    # Encrypted content
-    encrypted_content = Column(Text, nullable=False)
+    # conversation_key(sender, recipient) for 1-on-1 messages, group_id for groups
+    conversation_id = Column(UUID(as_uuid=True), nullable=True)
+
+    # Encrypted content: ciphertext, wrapped keys, IV and algorithm packed
+    # by app.core.envelope. Legacy rows, and submissions that are not valid
+    # base64, keep the client's string in encrypted_content instead.
+    envelope = Column(LargeBinary, nullable=True)
+    encrypted_content = Column(Text, nullable=True)
     content_type = Column(String(50), default="text")  # text, image, file
 
     # Metadata (UNENCRYPTED)
@@ -34,8 +52,10 @@ class Message(Base):
     # Status
     status = Column(String(20), default="pending")  # pending, delivered, read, failed
 
-    # Federation
+    # Federation: messages received from another node keep the id they
+    # have there, which is what redelivered copies are recognized by
     origin_node = Column(String(255), nullable=True)
+    origin_message_id = Column(UUID(as_uuid=True), nullable=True)
 
     __table_args__ = (
         CheckConstraint(
@@ -46,6 +66,11 @@ class Message(Base):
         Index('idx_sender_messages', 'sender_id', 'created_at'),
         Index('idx_group_messages', 'group_id', 'created_at'),
         Index('idx_message_created_at', 'created_at'),
+        Index('idx_conversation_messages', 'conversation_id', 'created_at', 'id'),
+        Index(
+            'idx_origin_message', 'origin_node', 'origin_message_id',
+            unique=True, postgresql_where=(origin_message_id.isnot(None))
+        ),
     )
 
     def __repr__(self):
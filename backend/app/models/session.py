@@ -14,17 +14,19 @@ class Session(Base):
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
-    token = Column(String(255), unique=True, nullable=False)
+    token = Column(String(255), unique=True, nullable=False)  # SHA-256 of the issued JWT
     ip_address = Column(INET, nullable=True)
     user_agent = Column(String, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     expires_at = Column(DateTime(timezone=True), nullable=False)
     last_activity = Column(DateTime(timezone=True), server_default=func.now())
+    revoked_at = Column(DateTime(timezone=True), nullable=True)
 
     __table_args__ = (
         Index('idx_token', 'token'),
         Index('idx_user_sessions', 'user_id', 'last_activity'),
         Index('idx_expires', 'expires_at'),
+        Index('idx_revoked_sessions', 'revoked_at', postgresql_where=revoked_at.isnot(None)),
     )
 
     def __repr__(self):
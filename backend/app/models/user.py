@@ -1,7 +1,7 @@
 """
 User model
 """
-from sqlalchemy import Column, String, Boolean, DateTime, Index, Text
+from sqlalchemy import Column, String, Boolean, BigInteger, DateTime, Index, Text
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.sql import func
 from sqlalchemy.ext.hybrid import hybrid_property
@@ -27,6 +27,12 @@ class User(Base):
     avatar_url = Column(Text, nullable=True)
     status_message = Column(String(280), nullable=True)
 
+    # Last sequence number allocated in this user's event stream
+    event_seq = Column(BigInteger, nullable=False, default=0, server_default="0")
+
+    # Bumped on every change to this user's contact list (app.services.contacts)
+    contacts_version = Column(BigInteger, nullable=False, default=0, server_default="0")
+
     @hybrid_property
     def full_handle(self) -> str:
         """Generate full handle (username@domain)"""
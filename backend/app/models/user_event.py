@@ -0,0 +1,30 @@
+"""
+User event model (per-user change stream for /sync)
+"""
+from sqlalchemy import Column, String, BigInteger, DateTime, ForeignKey
+from sqlalchemy.dialects.postgresql import UUID, JSONB
+from sqlalchemy.sql import func
+from app.db.database import Base
+
+
+class UserEvent(Base):
+    """
+    One entry in a user's event stream
+
+    `seq` is allocated from users.event_seq, so it increases monotonically
+    per user in commit order and (user_id, seq) doubles as the sync index.
+    """
+    __tablename__ = "user_events"
+
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    seq = Column(BigInteger, primary_key=True)
+    event_type = Column(String(30), nullable=False)  # message, receipt, contact
+
+    # Message events reference the row instead of copying the ciphertext
+    message_id = Column(UUID(as_uuid=True), ForeignKey("messages.id", ondelete="SET NULL"), nullable=True)
+    payload = Column(JSONB, nullable=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    def __repr__(self):
+        return f"<UserEvent {self.user_id}#{self.seq} {self.event_type}>"
@@ -13,7 +13,30 @@ from app.schemas.message import (
     MessageCreate,
     MessageResponse,
     MessageListResponse,
-    MarkReadRequest
+    MessageBatchCreate,
+    MessageBatchItemResult,
+    MessageBatchResponse,
+    MarkReadRequest,
+    ReadUpToRequest,
+    ReadReceiptResponse,
+    InboxEntry,
+    InboxResponse
+)
+from app.schemas.attachment import (
+    AttachmentResponse,
+    AttachmentListResponse,
+    AttachmentUploadCreate,
+    AttachmentUploadComplete,
+    AttachmentUploadResponse
+)
+from app.schemas.federation import (
+    FederatedMessage,
+    FederationAck,
+    FederationAckResponse
+)
+from app.schemas.sync import (
+    SyncEvent,
+    SyncResponse
 )
 
 __all__ = [
@@ -26,5 +49,22 @@ __all__ = [
     "MessageCreate",
     "MessageResponse",
     "MessageListResponse",
+    "MessageBatchCreate",
+    "MessageBatchItemResult",
+    "MessageBatchResponse",
     "MarkReadRequest",
+    "ReadUpToRequest",
+    "ReadReceiptResponse",
+    "InboxEntry",
+    "InboxResponse",
+    "AttachmentResponse",
+    "AttachmentListResponse",
+    "AttachmentUploadCreate",
+    "AttachmentUploadComplete",
+    "AttachmentUploadResponse",
+    "FederatedMessage",
+    "FederationAck",
+    "FederationAckResponse",
+    "SyncEvent",
+    "SyncResponse",
 ]
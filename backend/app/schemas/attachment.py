@@ -0,0 +1,74 @@
+"""
+Attachment schemas
+"""
+import re
+
+from pydantic import BaseModel, validator
+from typing import Optional
+from datetime import datetime
+from uuid import UUID
+
+
+class AttachmentResponse(BaseModel):
+    """Attachment metadata (the encrypted bytes are fetched separately)"""
+    id: UUID
+    message_id: UUID
+    filename: str
+    mime_type: Optional[str] = None
+    file_size: int
+    encryption_method: Optional[str] = None
+    created_at: datetime
+    expires_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+
+class AttachmentListResponse(BaseModel):
+    """Attachments of one message"""
+    attachments: list[AttachmentResponse]
+
+
+class AttachmentUploadCreate(BaseModel):
+    """Start a resumable upload; `size` is the exact ciphertext length"""
+    message_id: UUID
+    filename: str
+    mime_type: Optional[str] = None
+    encryption_method: str = "AES-256-GCM"
+    size: int
+
+    @validator('filename')
+    def validate_filename(cls, v):
+        if not v or len(v) > 255:
+            raise ValueError('Filename must be 1-255 characters')
+        return v
+
+    @validator('size')
+    def validate_size(cls, v):
+        if v <= 0:
+            raise ValueError('Size must be positive')
+        return v
+
+
+class AttachmentUploadComplete(BaseModel):
+    """Finish an upload; the server checks the bytes against this digest"""
+    sha256: str
+
+    @validator('sha256')
+    def validate_digest(cls, v):
+        if not re.fullmatch(r"[0-9a-fA-F]{64}", v):
+            raise ValueError('sha256 must be 64 hex digits')
+        return v.lower()
+
+
+class AttachmentUploadResponse(BaseModel):
+    """Progress of a resumable upload"""
+    id: UUID
+    message_id: UUID
+    filename: str
+    total_size: int
+    received: int
+    expires_at: datetime
+
+    class Config:
+        from_attributes = True
@@ -0,0 +1,30 @@
+"""
+Federation schemas
+"""
+from pydantic import BaseModel, Field
+from typing import Optional
+from datetime import datetime
+from uuid import UUID
+
+
+class FederatedMessage(BaseModel):
+    """One message in a batch from another node, as built by message_payload()"""
+    id: UUID
+    sender_handle: str = Field(..., max_length=306)
+    recipient_handle: str = Field(..., max_length=306)
+    content_type: str = Field("text", max_length=50)
+    created_at: Optional[datetime] = None
+    envelope: Optional[str] = None
+    encrypted_content: Optional[str] = None
+
+
+class FederationAck(BaseModel):
+    """Outcome of one message: accepted, duplicate, rejected or retry"""
+    id: str
+    status: str
+    error: Optional[str] = None
+
+
+class FederationAckResponse(BaseModel):
+    """Acknowledgements for a batch, in request order"""
+    results: list[FederationAck]
@@ -44,6 +44,7 @@ class MessageResponse(BaseModel):
     encrypted_content: str
     encrypted_key: Optional[str] = None
     iv: str
+    algorithm: Optional[str] = None
     content_type: str
     created_at: datetime
     delivered_at: Optional[datetime] = None
@@ -58,9 +59,68 @@ class MessageListResponse(BaseModel):
     """Message list response"""
     messages: list[MessageResponse]
     has_more: bool
-    next_cursor: Optional[datetime] = None
+    next_cursor: Optional[str] = None  # opaque; pass back as `cursor` (or `before`)
+
+
+class MessageBatchCreate(BaseModel):
+    """Batch of messages to send in one request"""
+    messages: list[MessageCreate]
+
+
+class MessageBatchItemResult(BaseModel):
+    """Outcome of one item in a message batch"""
+    index: int
+    status_code: int
+    message: Optional[MessageResponse] = None
+    error: Optional[str] = None
+
+
+class MessageBatchResponse(BaseModel):
+    """Per-item results of a message batch, in request order"""
+    results: list[MessageBatchItemResult]
 
 
 class MarkReadRequest(BaseModel):
     """Mark message as read"""
     message_id: UUID
+
+
+class ReadUpToRequest(BaseModel):
+    """Mark everything at or before a message or timestamp as read"""
+    up_to_message_id: Optional[UUID] = None
+    up_to: Optional[datetime] = None
+
+    @validator('up_to', always=True)
+    def validate_watermark(cls, v, values):
+        if not v and not values.get('up_to_message_id'):
+            raise ValueError('Either up_to_message_id or up_to must be provided')
+        if v and values.get('up_to_message_id'):
+            raise ValueError('Cannot specify both up_to_message_id and up_to')
+        return v
+
+
+class ReadReceiptResponse(BaseModel):
+    """Result of a read-up-to request"""
+    updated: int
+    read_at: datetime
+
+
+class InboxEntry(BaseModel):
+    """One conversation in the user's inbox"""
+    conversation_id: UUID
+    peer_handle: Optional[str] = None
+    last_message_id: Optional[UUID] = None
+    last_message_at: Optional[datetime] = None
+    last_sender_handle: Optional[str] = None
+    last_content_type: Optional[str] = None
+    unread_count: int
+
+    class Config:
+        from_attributes = True
+
+
+class InboxResponse(BaseModel):
+    """Inbox page, most recent conversation first"""
+    conversations: list[InboxEntry]
+    has_more: bool
+    next_cursor: Optional[str] = None
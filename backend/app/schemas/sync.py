@@ -0,0 +1,28 @@
+"""
+Sync schemas
+"""
+from pydantic import BaseModel
+from typing import Any, Optional
+from datetime import datetime
+
+from app.schemas.message import MessageResponse
+
+
+class SyncEvent(BaseModel):
+    """
+    One event in a user's stream
+
+    The same shape is pushed over the WebSocket and returned by /sync.
+    """
+    seq: int
+    type: str
+    created_at: Optional[datetime] = None
+    payload: Optional[dict[str, Any]] = None
+    message: Optional[MessageResponse] = None
+
+
+class SyncResponse(BaseModel):
+    """Events after the requested sequence number, oldest first"""
+    events: list[SyncEvent]
+    last_seq: int
+    has_more: bool
@@ -7,6 +7,16 @@ from datetime import datetime
 from uuid import UUID
 
 
+def is_valid_username(username: str) -> bool:
+    """
+    Whether a username meets the registration rules: 3 to 50 letters,
+    digits and underscores
+
+    Also applied to users on other nodes before they are stored.
+    """
+    return 3 <= len(username) <= 50 and all(c.isalnum() or c == "_" for c in username)
+
+
 class UserBase(BaseModel):
     """Base user schema"""
     username: str
@@ -27,7 +37,7 @@ class UserCreate(BaseModel):
     def validate_username(cls, v):
         if len(v) < 3 or len(v) > 50:
             raise ValueError('Username must be between 3 and 50 characters')
-        if not v.isalnum() and '_' not in v:
+        if not is_valid_username(v):
             raise ValueError('Username can only contain alphanumeric characters and underscores')
         return v.lower()
 
@@ -0,0 +1,3 @@
+"""
+Application services (real-time delivery, background workers, caches)
+"""
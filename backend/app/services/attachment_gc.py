@@ -0,0 +1,125 @@
+"""
+Garbage collection of attachment storage
+
+Runs every ATTACHMENT_GC_INTERVAL_MINUTES in two passes, each in batches of
+ATTACHMENT_GC_BATCH_SIZE rows per short transaction so no table is locked
+for long:
+
+1. attachments past their expires_at are deleted; the reference-counting
+   trigger releases their blobs.
+2. blobs nobody has referenced for UNREFERENCED_GRACE are deleted along
+   with their files.
+
+Rows are claimed with SKIP LOCKED, so the workers of a node can all run the
+collector without waiting on each other. A blob file is unlinked while its
+row is still locked by the deleting transaction; attachment_store.store()
+takes that same lock before reusing a blob, so it never picks up a file
+that is about to disappear.
+"""
+import logging
+from datetime import timedelta
+
+from sqlalchemy import and_, delete, func, select
+
+from app.core.config import settings
+from app.core.scheduler import scheduler
+from app.db.database import async_session_maker
+from app.models.attachment import Attachment, AttachmentBlob
+from app.services import attachment_store
+
+logger = logging.getLogger(__name__)
+
+# Unreferenced blobs are kept this long, so content forwarded again shortly
+# after its last reference went away is not written twice
+UNREFERENCED_GRACE = timedelta(minutes=10)
+
+
+async def delete_expired_attachments() -> int:
+    """
+    Delete attachments past their expiry; returns how many were removed
+    """
+    batch_size = settings.ATTACHMENT_GC_BATCH_SIZE
+    removed = 0
+    while True:
+        expired = (
+            select(Attachment.id)
+            .where(Attachment.expires_at.isnot(None), Attachment.expires_at < func.now())
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        async with async_session_maker() as db:
+            result = await db.execute(
+                delete(Attachment)
+                .where(Attachment.id.in_(expired.scalar_subquery()))
+                .returning(Attachment.file_path, Attachment.blob_digest)
+                .execution_options(synchronize_session=False)
+            )
+            rows = result.all()
+            await db.commit()
+
+        # Attachments stored before content addressing own their files
+        for file_path, blob_digest in rows:
+            if file_path and blob_digest is None:
+                await attachment_store.delete_file(file_path)
+
+        removed += len(rows)
+        if len(rows) < batch_size:
+            return removed
+
+
+async def collect_unreferenced_blobs() -> int:
+    """
+    Delete blobs without references past the grace period; returns how many
+    """
+    batch_size = settings.ATTACHMENT_GC_BATCH_SIZE
+    removed = 0
+    while True:
+        unreferenced = (
+            select(AttachmentBlob.digest)
+            .where(
+                AttachmentBlob.ref_count == 0,
+                AttachmentBlob.unreferenced_at < func.now() - UNREFERENCED_GRACE
+            )
+            .order_by(AttachmentBlob.unreferenced_at)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        async with async_session_maker() as db:
+            result = await db.execute(
+                delete(AttachmentBlob)
+                .where(and_(
+                    AttachmentBlob.digest.in_(unreferenced.scalar_subquery()),
+                    AttachmentBlob.ref_count == 0
+                ))
+                .returning(AttachmentBlob.digest, AttachmentBlob.data.is_(None))
+                .execution_options(synchronize_session=False)
+            )
+            rows = result.all()
+            for digest, on_disk in rows:
+                if on_disk:
+                    await attachment_store.delete_file(attachment_store.blob_path(digest))
+            await db.commit()
+
+        removed += len(rows)
+        if len(rows) < batch_size:
+            return removed
+
+
+async def collect() -> None:
+    """
+    One full collection: expired attachments, then unreferenced blobs
+    """
+    attachments = await delete_expired_attachments()
+    blobs = await collect_unreferenced_blobs()
+    if attachments or blobs:
+        logger.info("Attachment GC removed %d expired attachments and %d blobs", attachments, blobs)
+
+
+def start() -> None:
+    """
+    Schedule the periodic collection
+    """
+    scheduler.add_job(
+        collect, "interval",
+        minutes=settings.ATTACHMENT_GC_INTERVAL_MINUTES, id="attachments.gc"
+    )
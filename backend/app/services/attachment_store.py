@@ -0,0 +1,334 @@
+"""
+Storage of encrypted attachment bytes
+
+Attachment bytes are content-addressed: each distinct ciphertext is stored
+once, as an attachment_blobs row keyed by its SHA-256, and every Attachment
+points at it through blob_digest. Blobs up to ATTACHMENT_INLINE_MAX_BYTES
+live in the row itself; larger ones in a file under ATTACHMENTS_DIR/blobs,
+sharded by the first bytes of the digest. Uploads are never held in memory
+beyond the inline threshold.
+
+An upload is first staged (in memory or in a staging file, hashed as it
+arrives), then store() records the blob in the caller's transaction. The
+blob row stays locked until that transaction ends, which is what keeps the
+garbage collector (attachment_gc) from deleting a file being re-referenced.
+store() links the staged file into place rather than moving it, so a
+transaction that fails to commit leaves the staged file where its rows say
+it is; discard_staged() removes it once the commit succeeded.
+
+Resumable uploads accumulate in ATTACHMENTS_DIR/uploads until completed.
+Staging files a worker left behind when it died mid-upload are removed by
+sweep_staging().
+"""
+import hashlib
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import AsyncIterator, BinaryIO, Iterable, Iterator, NamedTuple, Optional
+from uuid import UUID
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.requests import ClientDisconnect
+
+from app.core.config import settings
+from app.models.attachment import AttachmentBlob
+
+# Bytes read from disk per chunk when serving a download
+READ_CHUNK_SIZE = 256 * 1024
+
+
+class AttachmentTooLarge(Exception):
+    """The upload exceeded the allowed size"""
+
+
+class StagedBlob(NamedTuple):
+    """
+    Received bytes ready for store(): inline, or a file under ATTACHMENTS_DIR
+    """
+    data: Optional[bytes]
+    file_path: Optional[str]
+    size: int
+    digest: str
+
+
+def blob_path(digest: str) -> str:
+    """
+    Storage location of a blob, relative to ATTACHMENTS_DIR
+
+    Two levels of 256 directories keep each one small.
+    """
+    return f"blobs/{digest[:2]}/{digest[2:4]}/{digest}"
+
+
+def upload_path(upload_id: UUID) -> str:
+    """
+    Where a resumable upload accumulates, relative to ATTACHMENTS_DIR
+    """
+    return f"uploads/{upload_id.hex}.part"
+
+
+def absolute_path(file_path: str) -> Path:
+    return Path(settings.ATTACHMENTS_DIR) / file_path
+
+
+def _open_for_writing(path: Path) -> BinaryIO:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return open(path, "wb")
+
+
+def _write_hashed(file: BinaryIO, digest, chunk: bytes) -> None:
+    digest.update(chunk)
+    file.write(chunk)
+
+
+def _sync_and_close(file: BinaryIO) -> None:
+    # Durable before the row pointing at it is committed
+    file.flush()
+    os.fsync(file.fileno())
+    file.close()
+
+
+def _discard_file(file: BinaryIO, part: Path) -> None:
+    file.close()
+    part.unlink(missing_ok=True)
+
+
+async def receive(stream: AsyncIterator[bytes], max_size: int) -> StagedBlob:
+    """
+    Consume an upload stream chunk by chunk, hashing it on the way
+
+    Raises AttachmentTooLarge as soon as more than `max_size` bytes arrive;
+    nothing is left on disk in that case or on any other error.
+    """
+    buffer = bytearray()
+    digest = hashlib.sha256()
+    size = 0
+    file: Optional[BinaryIO] = None
+    staging = f"staging/{uuid.uuid4().hex}.part"
+    part = absolute_path(staging)
+
+    try:
+        async for chunk in stream:
+            size += len(chunk)
+            if size > max_size:
+                raise AttachmentTooLarge()
+
+            if file is not None:
+                await run_in_threadpool(_write_hashed, file, digest, chunk)
+                continue
+
+            buffer += chunk
+            if len(buffer) > settings.ATTACHMENT_INLINE_MAX_BYTES:
+                # Too big to keep inline: spill to disk and stream from here on
+                file = await run_in_threadpool(_open_for_writing, part)
+                await run_in_threadpool(_write_hashed, file, digest, bytes(buffer))
+                buffer = bytearray()
+
+        if file is None:
+            digest.update(buffer)
+            return StagedBlob(bytes(buffer), None, size, digest.hexdigest())
+
+        await run_in_threadpool(_sync_and_close, file)
+        return StagedBlob(None, staging, size, digest.hexdigest())
+    except BaseException:
+        if file is not None and not file.closed:
+            await run_in_threadpool(_discard_file, file, part)
+        raise
+
+
+async def staged_upload(file_path: str, size: int, digest: str) -> StagedBlob:
+    """
+    A completed resumable upload, verified to hash to `digest`
+
+    Small uploads are read back to be stored inline; the caller deletes the
+    upload file once the attachment is committed.
+    """
+    if size <= settings.ATTACHMENT_INLINE_MAX_BYTES:
+        data = await run_in_threadpool(absolute_path(file_path).read_bytes)
+        return StagedBlob(data, None, size, digest)
+    return StagedBlob(None, file_path, size, digest)
+
+
+def _write_durably(path: Path, chunks: Iterable[bytes]) -> None:
+    part = path.with_suffix(".part")
+    with open(part, "wb") as file:
+        for chunk in chunks:
+            file.write(chunk)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(part, path)
+
+
+def _read_chunks(path: Path) -> Iterator[bytes]:
+    with open(path, "rb") as file:
+        while chunk := file.read(READ_CHUNK_SIZE):
+            yield chunk
+
+
+def _place(blob: StagedBlob, on_disk: bool) -> None:
+    final = absolute_path(blob_path(blob.digest))
+    if not on_disk or final.exists():
+        return
+
+    final.parent.mkdir(parents=True, exist_ok=True)
+    if blob.file_path is None:
+        # The existing blob lives on disk but lost its file: restore it
+        _write_durably(final, [blob.data])
+        return
+    staged = absolute_path(blob.file_path)
+    try:
+        os.link(staged, final)
+    except FileExistsError:
+        pass
+    except OSError:
+        # No hard links here (or across devices): copy instead
+        _write_durably(final, _read_chunks(staged))
+
+
+async def store(db: AsyncSession, blob: StagedBlob) -> Optional[str]:
+    """
+    Record a staged blob in the caller's transaction, deduplicating by digest
+
+    Returns the blob's file path if it is stored on disk, None if inline.
+    The staged file is linked into place and left alone; call
+    discard_staged() after the transaction commits. Point an Attachment at
+    blob.digest in the same transaction; the trigger on attachments then
+    counts the reference.
+    """
+    # ON CONFLICT DO UPDATE locks an existing row until we commit, so the
+    # collector cannot delete it (or its file) in between
+    result = await db.execute(
+        insert(AttachmentBlob)
+        .values(digest=blob.digest, size=blob.size, data=blob.data, ref_count=0)
+        .on_conflict_do_update(
+            index_elements=[AttachmentBlob.digest],
+            set_={"unreferenced_at": None}
+        )
+        .returning(AttachmentBlob.data.is_(None))
+    )
+    on_disk = result.scalar_one()
+    await run_in_threadpool(_place, blob, on_disk)
+    return blob_path(blob.digest) if on_disk else None
+
+
+async def discard_staged(blob: StagedBlob) -> None:
+    """
+    Remove a blob's staged file, once store() has been committed
+    """
+    if blob.file_path:
+        await delete_file(blob.file_path)
+
+
+def _open_at(path: Path, offset: int) -> BinaryIO:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    file = open(path, "r+b" if offset else "wb")
+    if os.fstat(file.fileno()).st_size < offset:
+        file.close()
+        raise FileNotFoundError(f"{path} is shorter than {offset} bytes")
+    # Drop bytes past the recorded offset left by an interrupted request
+    file.truncate(offset)
+    file.seek(offset)
+    return file
+
+
+def _truncate_and_close(file: BinaryIO, offset: int) -> None:
+    file.truncate(offset)
+    file.close()
+
+
+async def append(stream: AsyncIterator[bytes], file_path: str, offset: int, max_length: int) -> int:
+    """
+    Write an upload chunk at `offset` and return how many bytes were kept
+
+    Everything returned has been synced to disk. If the client disconnects
+    midway, the bytes received until then are kept so the upload resumes
+    from there. Raises AttachmentTooLarge when more than `max_length` bytes
+    arrive, and the chunk is discarded.
+    """
+    file = await run_in_threadpool(_open_at, absolute_path(file_path), offset)
+    written = 0
+    try:
+        async for chunk in stream:
+            written += len(chunk)
+            if written > max_length:
+                raise AttachmentTooLarge()
+            await run_in_threadpool(file.write, chunk)
+    except ClientDisconnect:
+        pass
+    except BaseException:
+        await run_in_threadpool(_truncate_and_close, file, offset)
+        raise
+    await run_in_threadpool(_sync_and_close, file)
+    return written
+
+
+def _sha256_of(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(READ_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def sha256_file(file_path: str) -> str:
+    """
+    Hex SHA-256 of a stored file, hashed off the event loop
+    """
+    return await run_in_threadpool(_sha256_of, absolute_path(file_path))
+
+
+async def delete_file(file_path: str) -> None:
+    """
+    Remove a stored file; missing files are ignored
+    """
+    await run_in_threadpool(absolute_path(file_path).unlink, missing_ok=True)
+
+
+def _remove_older_than(directory: Path, cutoff: float) -> int:
+    removed = 0
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_file(follow_symlinks=False) and entry.stat().st_mtime < cutoff:
+                os.unlink(entry.path)
+                removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+async def sweep_staging(max_age_seconds: float) -> int:
+    """
+    Remove staging files not written to for `max_age_seconds`
+
+    A live upload writes its staging file as bytes arrive and removes it
+    once committed, so only files of crashed or killed workers get this old.
+    Returns how many were removed.
+    """
+    return await run_in_threadpool(
+        _remove_older_than, absolute_path("staging"), time.time() - max_age_seconds
+    )
+
+
+async def read_file(file_path: str, start: int, length: int) -> AsyncIterator[bytes]:
+    """
+    Stream `length` bytes of a stored file starting at `start`
+    """
+    file = await run_in_threadpool(open, absolute_path(file_path), "rb")
+    try:
+        await run_in_threadpool(file.seek, start)
+        remaining = length
+        while remaining > 0:
+            chunk = await run_in_threadpool(file.read, min(READ_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        await run_in_threadpool(file.close)
@@ -0,0 +1,89 @@
+"""
+Expiry of unfinished resumable uploads
+
+Every PATCH pushes an upload's expires_at ATTACHMENT_UPLOAD_EXPIRY_HOURS
+ahead; uploads nobody touched for that long are deleted, together with
+their partial files, by a scheduled sweep. Rows are claimed with SKIP LOCKED
+in small batches, so several workers can sweep at once and an upload being
+completed concurrently is left alone.
+
+The same schedule, and every start, also clears staging files older than
+the upload expiry, which workers that died mid-upload leave behind.
+"""
+import logging
+from datetime import datetime, timezone
+
+from sqlalchemy import delete, func, select
+
+from app.core.config import settings
+from app.core.scheduler import scheduler
+from app.db.database import async_session_maker
+from app.models.attachment_upload import AttachmentUpload
+from app.services import attachment_store
+
+logger = logging.getLogger(__name__)
+
+# Uploads deleted per transaction
+SWEEP_BATCH_SIZE = 100
+
+
+async def sweep_expired_uploads() -> int:
+    """
+    Delete expired uploads and their files; returns how many were removed
+    """
+    removed = 0
+    while True:
+        expired = (
+            select(AttachmentUpload.id)
+            .where(AttachmentUpload.expires_at < func.now())
+            .order_by(AttachmentUpload.expires_at)
+            .limit(SWEEP_BATCH_SIZE)
+            .with_for_update(skip_locked=True)
+        )
+        async with async_session_maker() as db:
+            result = await db.execute(
+                delete(AttachmentUpload)
+                .where(AttachmentUpload.id.in_(expired.scalar_subquery()))
+                .returning(AttachmentUpload.file_path)
+                .execution_options(synchronize_session=False)
+            )
+            file_paths = result.scalars().all()
+            await db.commit()
+
+        # Files go after the rows, so a crash in between leaves only
+        # unreferenced files behind, never rows without their bytes
+        for file_path in file_paths:
+            await attachment_store.delete_file(file_path)
+
+        removed += len(file_paths)
+        if len(file_paths) < SWEEP_BATCH_SIZE:
+            break
+
+    if removed:
+        logger.info("Removed %d expired attachment uploads", removed)
+    return removed
+
+
+async def sweep_stale_staging() -> int:
+    """
+    Delete staging files older than the upload expiry; returns how many
+    """
+    removed = await attachment_store.sweep_staging(settings.ATTACHMENT_UPLOAD_EXPIRY_HOURS * 3600)
+    if removed:
+        logger.info("Removed %d abandoned attachment staging files", removed)
+    return removed
+
+
+def start() -> None:
+    """
+    Schedule the periodic sweeps; the staging one also runs right away
+    """
+    scheduler.add_job(
+        sweep_expired_uploads, "interval",
+        minutes=settings.ATTACHMENT_UPLOAD_SWEEP_MINUTES, id="attachments.sweep_uploads"
+    )
+    scheduler.add_job(
+        sweep_stale_staging, "interval",
+        minutes=settings.ATTACHMENT_UPLOAD_SWEEP_MINUTES, id="attachments.sweep_staging",
+        next_run_time=datetime.now(timezone.utc)
+    )
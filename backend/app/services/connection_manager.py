@@ -0,0 +1,81 @@
+"""
+WebSocket connection registry for real-time delivery
+"""
+import asyncio
+import logging
+from typing import Dict, Set
+from uuid import UUID
+
+from fastapi import WebSocket
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on how long a single slow socket may hold up a fan-out
+SEND_TIMEOUT_SECONDS = 5
+
+
+class ConnectionManager:
+    """
+    In-process registry of live WebSocket connections, keyed by user id
+
+    A user may have several devices connected at once; events addressed to
+    a user are pushed to every one of them.
+    """
+
+    def __init__(self):
+        self._connections: Dict[UUID, Set[WebSocket]] = {}
+
+    async def connect(self, user_id: UUID, websocket: WebSocket) -> None:
+        """
+        Register an accepted WebSocket for a user
+        """
+        self._connections.setdefault(user_id, set()).add(websocket)
+
+    async def disconnect(self, user_id: UUID, websocket: WebSocket) -> None:
+        """
+        Forget a WebSocket (safe to call more than once)
+        """
+        sockets = self._connections.get(user_id)
+        if not sockets:
+            return
+        sockets.discard(websocket)
+        if not sockets:
+            del self._connections[user_id]
+
+    def is_online(self, user_id: UUID) -> bool:
+        """
+        Whether the user has at least one live connection on this process
+        """
+        return bool(self._connections.get(user_id))
+
+    def connection_count(self) -> int:
+        """
+        Total number of live connections on this process
+        """
+        return sum(len(sockets) for sockets in self._connections.values())
+
+    async def deliver(self, user_id: UUID, data: str) -> None:
+        """
+        Write an already-serialized frame to every socket of a user
+
+        The same frame is written to each socket concurrently, so one slow
+        device does not delay the others.
+        """
+        sockets = list(self._connections.get(user_id, ()))
+        if not sockets:
+            return
+
+        results = await asyncio.gather(
+            *(asyncio.wait_for(ws.send_text(data), SEND_TIMEOUT_SECONDS) for ws in sockets),
+            return_exceptions=True
+        )
+
+        # Drop sockets that failed or timed out; their receive loop will exit too
+        for ws, result in zip(sockets, results):
+            if isinstance(result, BaseException):
+                logger.debug("Dropping WebSocket for user %s: %r", user_id, result)
+                await self.disconnect(user_id, ws)
+
+
+# Process-wide registry
+manager = ConnectionManager()
@@ -0,0 +1,123 @@
+"""
+Contact list versioning
+
+Every change to a user's contact list (a contact added or removed, or a
+contact's profile or key changing) takes the next value of the owner's
+users.contacts_version and stamps it on the contacts row, or on a
+contact_tombstones row for removals. A client that has seen version V
+only needs the rows stamped after V, and an unchanged version means an
+unchanged list.
+
+Versions are taken under the owner's row lock, held until commit, so they
+become visible in order: a reader never sees version V before every change
+up to V. Rows are locked in id order, as append_events() does, so the two
+cannot deadlock.
+
+last_message_at is activity data, not part of the list: it changes with
+every message, so it does not move the version and is not in the contact
+representation either. Clients get it from the inbox.
+"""
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+from uuid import UUID
+
+from sqlalchemy import Select, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.contact import Contact, ContactTombstone
+from app.models.user import User
+
+
+async def next_versions(db: AsyncSession, user_ids: Union[Iterable[UUID], Select]) -> Dict[UUID, int]:
+    """
+    Bump the contacts version of each user, in the caller's transaction
+
+    Returns the new version per user id.
+    """
+    if not isinstance(user_ids, Select):
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {}
+
+    locked_ids = (
+        select(User.id)
+        .where(User.id.in_(user_ids))
+        .order_by(User.id)
+        .with_for_update(key_share=True)
+        .scalar_subquery()
+    )
+    result = await db.execute(
+        update(User)
+        .where(User.id.in_(locked_ids))
+        .values(contacts_version=User.contacts_version + 1)
+        .returning(User.id, User.contacts_version)
+        .execution_options(synchronize_session=False)
+    )
+    return dict(result.all())
+
+
+async def touch_contacts_of(db: AsyncSession, user_id: UUID) -> None:
+    """
+    Mark every contacts row pointing at a user as changed
+
+    For changes to the user's own profile or key, which appear in the
+    contact lists of everyone who added them.
+    """
+    await next_versions(db, select(Contact.user_id).where(Contact.contact_id == user_id))
+    await db.execute(
+        update(Contact)
+        .where(Contact.contact_id == user_id)
+        .values(
+            version=select(User.contacts_version)
+            .where(User.id == Contact.user_id)
+            .scalar_subquery()
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def remove_contact(db: AsyncSession, contact: Contact) -> None:
+    """
+    Delete a contact, leaving a tombstone for delta syncs
+    """
+    version = (await next_versions(db, [contact.user_id]))[contact.user_id]
+    await db.delete(contact)
+    db.add(ContactTombstone(contact_id=contact.id, user_id=contact.user_id, version=version))
+
+
+async def current_version(db: AsyncSession, user_id: UUID) -> int:
+    result = await db.execute(select(User.contacts_version).where(User.id == user_id))
+    return result.scalar_one()
+
+
+async def contact_rows(
+    db: AsyncSession,
+    user_id: UUID,
+    since: Optional[int] = None
+) -> List[Tuple[Contact, User]]:
+    """
+    A user's contacts with their users, in one joined query
+
+    With `since`, only the contacts added or changed after that version.
+    """
+    statement = (
+        select(Contact, User)
+        .join(User, User.id == Contact.contact_id)
+        .where(Contact.user_id == user_id)
+        .order_by(Contact.added_at, Contact.id)
+    )
+    if since is not None:
+        statement = statement.where(Contact.version > since)
+    result = await db.execute(statement)
+    return list(result.tuples().all())
+
+
+async def removed_since(db: AsyncSession, user_id: UUID, since: int) -> List[UUID]:
+    """
+    Ids of the contacts removed after version `since`
+    """
+    result = await db.execute(
+        select(ContactTombstone.contact_id)
+        .where(ContactTombstone.user_id == user_id, ContactTombstone.version > since)
+        .order_by(ContactTombstone.version)
+    )
+    return list(result.scalars().all())
@@ -0,0 +1,383 @@
+"""
+Delivery of messages to users on other nodes
+
+Sending a message to a remote recipient adds a message_queue row in the
+same transaction. This worker drains the queue: it claims due rows with
+FOR UPDATE SKIP LOCKED and leases them (next_attempt_at is pushed past the
+HTTP timeout), so any number of worker processes can drain concurrently and
+rows claimed by a process that died are picked up again once the lease
+runs out. No transaction is held open while a peer is being contacted.
+
+Claimed rows for the same node are coalesced into batch requests of at
+most FEDERATION_DELIVERY_MAX_BATCH_MESSAGES messages and
+FEDERATION_DELIVERY_MAX_BATCH_BYTES of body. The peer acknowledges each
+message, so only the items that failed are retried. Requests are signed
+with this node's key. A batch answered with 413 is split in half and sent
+again. Failed deliveries are retried with exponential backoff and jitter
+until max_attempts; only a peer's rejection of an individual message in
+its acknowledgement fails it at once. Rows for nodes the prober marked offline are left
+alone until the node is back. Each target node gets at most
+FEDERATION_DELIVERY_CONCURRENCY_PER_NODE requests in flight.
+
+When a message becomes delivered or failed, the sender's event stream gets
+a "receipt" event with the new status, in the same transaction.
+"""
+import asyncio
+import logging
+import random
+from datetime import datetime, timedelta, timezone
+from collections import defaultdict
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from uuid import UUID
+
+import httpx
+from sqlalchemy import Row, func, select, update
+
+from app.core.config import settings
+from app.core.node_identity import signature_headers
+from app.db.database import async_session_maker
+from app.models.federated_node import FederatedNode
+from app.models.message import Message
+from app.models.message_queue import MessageQueue
+from app.services.events import append_events, new_event, publish_events
+from app.services.federation import (
+    batch_body,
+    default_federation_api_url,
+    encode_payload,
+    http_client,
+    message_payload
+)
+
+logger = logging.getLogger(__name__)
+
+# How long a claimed row stays invisible to other workers; must exceed the
+# time one delivery attempt can take
+CLAIM_LEASE = timedelta(minutes=2)
+
+
+
+class Delivery(NamedTuple):
+    """A claimed queue row with what is needed to send it"""
+    queue_id: UUID
+    message: Message
+    target_node: str
+    url: str
+    attempts: int
+    max_attempts: int
+
+
+class Outcome(NamedTuple):
+    delivery: Delivery
+    delivered: bool
+    permanent: bool = False
+    error: Optional[str] = None
+
+
+def retry_delay(attempts: int) -> float:
+    """
+    Seconds to wait before the next attempt, after `attempts` failed ones
+
+    Exponential backoff with jitter: a random point in the upper half of
+    the window, so peers coming back are not hit by synchronized retries.
+    """
+    window = min(
+        settings.FEDERATION_RETRY_MAX_SECONDS,
+        settings.FEDERATION_RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+    )
+    return window / 2 + random.uniform(0, window / 2)
+
+
+class DeliveryWorker:
+    """
+    Background task draining message_queue
+    """
+
+    def __init__(self):
+        self.batch_size = settings.FEDERATION_DELIVERY_BATCH_SIZE
+        self.poll_interval = settings.FEDERATION_DELIVERY_POLL_SECONDS
+        self._node_limits: Dict[str, asyncio.Semaphore] = {}
+        self._wake: Optional[asyncio.Event] = None
+        self._runner: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    @property
+    def running(self) -> bool:
+        return self._runner is not None
+
+    async def start(self) -> None:
+        if self._runner:
+            return
+        self._stopping = False
+        self._wake = asyncio.Event()
+        self._runner = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Finish the batch in flight and stop; unclaimed rows stay queued
+        """
+        if not self._runner:
+            return
+        self._stopping = True
+        self._wake.set()
+        await self._runner
+        self._runner = None
+
+    def wake(self) -> None:
+        """
+        Start the next pass now instead of at the next poll
+        """
+        if self._wake:
+            self._wake.set()
+
+    def notify(self, messages: Iterable[Message]) -> None:
+        """
+        Wake the worker after committing messages, if any of them were queued
+        """
+        if any(message.recipient_id and message.status == "pending" for message in messages):
+            self.wake()
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                claimed = await self.deliver_due()
+            except Exception:
+                logger.exception("Federation delivery pass failed")
+                claimed = 0
+
+            if claimed < self.batch_size and not self._stopping:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+
+    async def deliver_due(self) -> int:
+        """
+        Claim one batch of due rows, deliver them and record the outcomes
+
+        Returns the number of rows claimed.
+        """
+        deliveries = await self._claim()
+        if deliveries:
+            by_node = defaultdict(list)
+            for delivery in deliveries:
+                by_node[delivery.target_node, delivery.url].append(delivery)
+            results = await asyncio.gather(*(
+                self._deliver(node, url, batch)
+                for (node, url), node_deliveries in by_node.items()
+                for batch in self._batches(node_deliveries)
+            ))
+            await self._record([outcome for outcomes in results for outcome in outcomes])
+        return len(deliveries)
+
+    async def _claim(self) -> List[Delivery]:
+        due = (
+            select(MessageQueue.id)
+            .where(
+                MessageQueue.status == "pending",
+                MessageQueue.next_attempt_at <= func.now(),
+                MessageQueue.target_node.not_in(
+                    select(FederatedNode.domain).where(FederatedNode.status == "offline")
+                )
+            )
+            .order_by(MessageQueue.next_attempt_at)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        async with async_session_maker() as db:
+            result = await db.execute(
+                update(MessageQueue)
+                .where(MessageQueue.id.in_(due.scalar_subquery()))
+                .values(attempts=MessageQueue.attempts + 1, next_attempt_at=func.now() + CLAIM_LEASE)
+                .returning(
+                    MessageQueue.id,
+                    MessageQueue.message_id,
+                    MessageQueue.target_node,
+                    MessageQueue.attempts,
+                    MessageQueue.max_attempts
+                )
+                .execution_options(synchronize_session=False)
+            )
+            rows = result.all()
+            if not rows:
+                await db.commit()
+                return []
+
+            messages = {
+                message.id: message
+                for message in (await db.execute(
+                    select(Message).where(Message.id.in_([row.message_id for row in rows]))
+                )).scalars()
+            }
+            gone = [row.id for row in rows if row.message_id not in messages]
+            if gone:
+                # Deleted after it was queued; without this the row would be
+                # claimed again every lease period
+                await db.execute(
+                    update(MessageQueue)
+                    .where(MessageQueue.id.in_(gone))
+                    .values(status="failed", last_error="Message no longer exists")
+                    .execution_options(synchronize_session=False)
+                )
+            urls = dict((await db.execute(
+                select(FederatedNode.domain, FederatedNode.federation_api_url)
+                .where(FederatedNode.domain.in_({row.target_node for row in rows}))
+            )).all())
+            await db.commit()
+
+        return [
+            Delivery(
+                queue_id=row.id,
+                message=messages[row.message_id],
+                target_node=row.target_node,
+                url=urls.get(row.target_node) or default_federation_api_url(row.target_node),
+                attempts=row.attempts,
+                max_attempts=row.max_attempts
+            )
+            for row in rows if row.message_id in messages
+        ]
+
+    def _node_limit(self, node: str) -> asyncio.Semaphore:
+        limit = self._node_limits.get(node)
+        if limit is None:
+            limit = self._node_limits[node] = asyncio.Semaphore(settings.FEDERATION_DELIVERY_CONCURRENCY_PER_NODE)
+        return limit
+
+    def _batches(self, deliveries: List[Delivery]) -> Iterator[List[Tuple[Delivery, bytes]]]:
+        """
+        Split one node's deliveries into requests bounded by count and bytes
+
+        A message bigger than the byte bound on its own still goes, alone.
+        """
+        batch: List[Tuple[Delivery, bytes]] = []
+        size = 0
+        for delivery in deliveries:
+            encoded = encode_payload(message_payload(delivery.message))
+            if batch and (
+                len(batch) >= settings.FEDERATION_DELIVERY_MAX_BATCH_MESSAGES
+                or size + len(encoded) > settings.FEDERATION_DELIVERY_MAX_BATCH_BYTES
+            ):
+                yield batch
+                batch, size = [], 0
+            batch.append((delivery, encoded))
+            size += len(encoded) + 1
+        if batch:
+            yield batch
+
+    async def _deliver(self, node: str, url: str, batch: List[Tuple[Delivery, bytes]]) -> List[Outcome]:
+        deliveries = [delivery for delivery, _ in batch]
+        body = batch_body([encoded for _, encoded in batch])
+        headers = {"Content-Type": "application/json", **signature_headers(body)}
+        async with self._node_limit(node):
+            try:
+                response = await http_client().post(f"{url}/messages", content=body, headers=headers)
+            except httpx.HTTPError as e:
+                return [Outcome(d, False, error=f"{type(e).__name__}: {e}") for d in deliveries]
+
+        if response.status_code == 413 and len(batch) > 1:
+            # The peer takes smaller bodies than we send; halve until they fit
+            half = len(batch) // 2
+            first, second = await asyncio.gather(
+                self._deliver(node, url, batch[:half]),
+                self._deliver(node, url, batch[half:])
+            )
+            return first + second
+        if response.status_code >= 400:
+            # A whole-request rejection (stale key, clock skew, a limit) says
+            # nothing final about the messages; they are retried
+            return [Outcome(d, False, error=f"HTTP {response.status_code}") for d in deliveries]
+
+        try:
+            acks = {ack["id"]: ack for ack in response.json()["results"]}
+        except (ValueError, KeyError, TypeError):
+            return [Outcome(d, False, error="Malformed acknowledgement") for d in deliveries]
+
+        outcomes = []
+        for delivery in deliveries:
+            ack = acks.get(str(delivery.message.id))
+            if ack is None:
+                outcomes.append(Outcome(delivery, False, error="Message not acknowledged"))
+            elif ack.get("status") in ("accepted", "duplicate"):
+                outcomes.append(Outcome(delivery, True))
+            elif ack.get("status") == "retry":
+                outcomes.append(Outcome(delivery, False, error=ack.get("error") or "Deferred by peer"))
+            else:
+                outcomes.append(Outcome(delivery, False, permanent=True, error=ack.get("error") or "Rejected by peer"))
+        return outcomes
+
+    async def _record(self, outcomes: List[Outcome]) -> None:
+        now = datetime.now(timezone.utc)
+        delivered, failed, retries = [], [], []
+        for outcome in outcomes:
+            delivery = outcome.delivery
+            if outcome.delivered:
+                delivered.append(delivery)
+            elif outcome.permanent or delivery.attempts >= delivery.max_attempts:
+                failed.append(outcome)
+            else:
+                retries.append({
+                    "id": delivery.queue_id,
+                    "next_attempt_at": now + timedelta(seconds=retry_delay(delivery.attempts)),
+                    "last_error": outcome.error[:500],
+                })
+
+        # Status changes go to the sender's devices, as read receipts do
+        receipts: List[Dict[str, Any]] = []
+        async with async_session_maker() as db:
+            if delivered:
+                await db.execute(
+                    update(MessageQueue)
+                    .where(MessageQueue.id.in_([d.queue_id for d in delivered]))
+                    .values(status="sent", last_error=None)
+                    .execution_options(synchronize_session=False)
+                )
+                changed = await db.execute(
+                    update(Message)
+                    .where(Message.id.in_([d.message.id for d in delivered]), Message.status == "pending")
+                    .values(status="delivered", delivered_at=func.now())
+                    .returning(Message.id, Message.sender_id, Message.conversation_id, Message.delivered_at)
+                    .execution_options(synchronize_session=False)
+                )
+                receipts.extend(_receipts(changed.all(), "delivered"))
+            for outcome in failed:
+                logger.warning(
+                    "Giving up delivering %s to %s: %s",
+                    outcome.delivery.message.id, outcome.delivery.target_node, outcome.error
+                )
+                await db.execute(
+                    update(MessageQueue)
+                    .where(MessageQueue.id == outcome.delivery.queue_id)
+                    .values(status="failed", last_error=outcome.error[:500])
+                    .execution_options(synchronize_session=False)
+                )
+            if failed:
+                changed = await db.execute(
+                    update(Message)
+                    .where(Message.id.in_([o.delivery.message.id for o in failed]), Message.status == "pending")
+                    .values(status="failed")
+                    .returning(Message.id, Message.sender_id, Message.conversation_id, Message.delivered_at)
+                    .execution_options(synchronize_session=False)
+                )
+                receipts.extend(_receipts(changed.all(), "failed"))
+            if retries:
+                await db.execute(update(MessageQueue), retries)
+            events = await append_events(db, receipts)
+            await db.commit()
+        await publish_events(events)
+
+
+def _receipts(rows: Iterable[Row], status: str) -> List[Dict[str, Any]]:
+    return [
+        new_event(sender_id, "receipt", message_id, {
+            "status": status,
+            "message_id": message_id,
+            "conversation_id": conversation_id,
+            "delivered_at": delivered_at,
+        })
+        for message_id, sender_id, conversation_id, delivered_at in rows
+        if sender_id is not None
+    ]
+
+
+# Process-wide worker; started by the app lifespan when federation is enabled
+delivery_worker = DeliveryWorker()
@@ -0,0 +1,268 @@
+"""
+Lookup of users on other nodes
+
+Handles on another domain are resolved against the owning node's public key
+endpoint (GET /api/keys/{handle}) and stored as non-local User rows, so
+messages and contacts can reference them like any other user. Per worker:
+
+- a fetched handle is not fetched again for FEDERATION_DIRECTORY_TTL_SECONDS
+  (key rotations are picked up after that);
+- a handle the peer does not know, or a peer that could not be reached, is
+  not asked again for FEDERATION_DIRECTORY_NEGATIVE_TTL_SECONDS;
+- concurrent lookups of the same handle share one outbound request;
+- hosts resolving to private or loopback addresses are never asked.
+
+When a peer is unreachable, the row stored by an earlier lookup is used.
+"""
+import asyncio
+import logging
+import re
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import quote
+from uuid import UUID
+
+import httpx
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.db.database import async_session_maker
+from app.models.federated_node import FederatedNode
+from app.models.user import User
+from app.schemas.user import is_valid_username
+from app.services.contacts import touch_contacts_of
+from app.services.federation import default_federation_api_url, http_client, is_public_host, node_url
+from app.services.handles import handle_resolver, invalidate as invalidate_handle, normalize_handle
+from app.services.message_store import split_handle
+
+logger = logging.getLogger(__name__)
+
+# Fully qualified host names only: no IP literals or single-label hosts,
+# since any client can make us look a handle up
+HOST_PATTERN = re.compile(r"^(?=.{1,253}(:|$))([A-Za-z0-9-]{1,63}\.)+[A-Za-z]{2,63}(:[0-9]{1,5})?$")
+
+# Largest public key accepted from a peer (PEM text)
+MAX_PUBLIC_KEY_LENGTH = 16384
+
+# Values of RemoteDirectory.missing
+NOT_FOUND = True
+UNREACHABLE = False
+
+
+class RemoteDirectory:
+    """
+    Cached, deduplicated resolution of remote handles to User rows
+
+    Handles must already be normalized (see normalize_handle()), so each
+    user has one cache entry and one in-flight lookup.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, negative_ttl: float):
+        # handle -> user id, for handles fetched recently
+        self.fresh: TTLCache[UUID] = TTLCache(maxsize, ttl)
+        # handle -> NOT_FOUND or UNREACHABLE
+        self.missing: TTLCache[bool] = TTLCache(maxsize, negative_ttl)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._limit = asyncio.Semaphore(settings.FEDERATION_DIRECTORY_CONCURRENCY)
+
+    async def resolve(self, db: AsyncSession, handle: str) -> Optional[User]:
+        """
+        The User for a handle on another node, or None if it does not exist
+        """
+        user_id = self.fresh.get(handle)
+        if user_id is None:
+            outcome = self.missing.get(handle)
+            if outcome is NOT_FOUND:
+                return None
+            if outcome is None:
+                user_id = await self._fetch_once(handle)
+
+        if user_id is not None:
+            user = await _stored_user(db, handle)
+            if user is not None:
+                return user
+
+        if self.missing.get(handle) is NOT_FOUND:
+            return None
+        # The peer could not be asked: fall back to what we stored earlier
+        return await _stored_user(db, handle)
+
+    async def resolve_many(self, db: AsyncSession, handles: Iterable[str]) -> Dict[str, User]:
+        """
+        Resolve several remote handles, fetching the uncached ones concurrently
+        """
+        handles = set(handles)
+        await asyncio.gather(*(
+            self._fetch_once(handle) for handle in handles
+            if self.fresh.get(handle) is None and self.missing.get(handle) is None
+        ))
+        # Everything is cached now; the session is only used one call at a time
+        found = {}
+        for handle in handles:
+            user = await self.resolve(db, handle)
+            if user is not None:
+                found[handle] = user
+        return found
+
+    def forget(self, handle: str) -> None:
+        self.fresh.pop(handle)
+        self.missing.pop(handle)
+
+    async def _fetch_once(self, handle: str) -> Optional[UUID]:
+        future = self._inflight.get(handle)
+        if future is None:
+            future = asyncio.ensure_future(self._fetch(handle))
+            self._inflight[handle] = future
+            future.add_done_callback(lambda _: self._inflight.pop(handle, None))
+        # One caller going away must not cancel the lookup for the others
+        return await asyncio.shield(future)
+
+    async def _fetch(self, handle: str) -> Optional[UUID]:
+        username, domain = split_handle(handle)
+        # Stored as a users row, so held to the rules local accounts follow
+        if not is_valid_username(username) or len(domain) > 255 or not HOST_PATTERN.match(domain):
+            self.missing.set(handle, NOT_FOUND)
+            return None
+
+        url = f"{node_url(domain)}{settings.API_V1_PREFIX}/keys/{quote(handle, safe='@')}"
+        try:
+            async with self._limit:
+                if not await is_public_host(domain):
+                    self.missing.set(handle, NOT_FOUND)
+                    return None
+                response = await http_client().get(url, headers={"Accept": "application/json"})
+        except (httpx.HTTPError, OSError) as e:
+            logger.info("Directory lookup of %s failed: %s", handle, e)
+            self.missing.set(handle, UNREACHABLE)
+            return None
+
+        if response.status_code == 404:
+            self.missing.set(handle, NOT_FOUND)
+            return None
+        try:
+            data = response.json() if response.status_code == 200 else None
+            public_key = data["public_key"]
+            fingerprint = data["public_key_fingerprint"]
+            valid = (
+                normalize_handle(data["full_handle"]) == handle
+                and isinstance(public_key, str) and 0 < len(public_key) <= MAX_PUBLIC_KEY_LENGTH
+                and isinstance(fingerprint, str) and 0 < len(fingerprint) <= 128
+            )
+        except (ValueError, KeyError, TypeError, AttributeError):
+            valid = False
+        if not valid:
+            logger.info("Directory lookup of %s got an unusable answer (HTTP %s)", handle, response.status_code)
+            self.missing.set(handle, UNREACHABLE)
+            return None
+
+        user_id = await _store_remote_user(username, domain, public_key, fingerprint)
+        if user_id is None:
+            # The handle belongs to a local account; never overwrite it
+            self.missing.set(handle, NOT_FOUND)
+            return None
+        self.fresh.set(handle, user_id)
+        return user_id
+
+
+async def _stored_user(db: AsyncSession, handle: str) -> Optional[User]:
+    """
+    The stored user behind a handle, served from the handle cache when hot
+    """
+    resolved = await handle_resolver.resolve(db, handle)
+    if resolved is None:
+        return None
+    return resolved.user()
+
+
+async def _store_remote_user(username: str, domain: str, public_key: str, fingerprint: str) -> Optional[UUID]:
+    """
+    Insert or refresh a non-local user row; returns its id
+
+    Also registers the user's node, so the prober starts watching it.
+    """
+    statement = insert(User).values(
+        username=username,
+        domain=domain,
+        public_key=public_key,
+        public_key_fingerprint=fingerprint,
+        is_local=False
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[User.username, User.domain],
+        set_={
+            "public_key": statement.excluded.public_key,
+            "public_key_fingerprint": statement.excluded.public_key_fingerprint,
+        },
+        where=User.is_local.is_(False) & (
+            User.public_key.is_distinct_from(statement.excluded.public_key)
+            | User.public_key_fingerprint.is_distinct_from(statement.excluded.public_key_fingerprint)
+        )
+    ).returning(User.id)
+
+    async with async_session_maker() as db:
+        user_id = (await db.execute(statement)).scalar_one_or_none()
+        changed = user_id is not None
+        if changed:
+            # New, or its key changed: contact lists showing it are out of date
+            await touch_contacts_of(db, user_id)
+        else:
+            user_id = (await db.execute(
+                select(User.id).where(User.username == username, User.domain == domain, User.is_local.is_(False))
+            )).scalar_one_or_none()
+
+        if user_id is not None:
+            await db.execute(
+                insert(FederatedNode)
+                .values(domain=domain, federation_api_url=default_federation_api_url(domain))
+                .on_conflict_do_nothing(index_elements=[FederatedNode.domain])
+            )
+        await db.commit()
+    if changed:
+        await invalidate_handle(f"{username}@{domain}")
+    return user_id
+
+
+remote_directory = RemoteDirectory(
+    settings.FEDERATION_DIRECTORY_MAX_ENTRIES,
+    settings.FEDERATION_DIRECTORY_TTL_SECONDS,
+    settings.FEDERATION_DIRECTORY_NEGATIVE_TTL_SECONDS
+)
+
+
+async def find_user(db: AsyncSession, handle: str) -> Optional[User]:
+    """
+    Look a handle up locally, or on its own node if it is on another domain
+
+    The User is a detached snapshot from the handle cache; load the row
+    into the session to change it.
+    """
+    handle = normalize_handle(handle)
+    if handle is None:
+        return None
+    _, domain = split_handle(handle)
+    if domain == settings.DOMAIN or not settings.FEDERATION_ENABLED:
+        return await _stored_user(db, handle)
+    return await remote_directory.resolve(db, handle)
+
+
+async def find_remote_users(db: AsyncSession, handles: Iterable[str]) -> Dict[str, User]:
+    """
+    Resolve the handles on other domains among `handles`; unknown ones are absent
+
+    Keys are the handles as given.
+    """
+    remote: Dict[str, List[str]] = {}  # normalized -> as given
+    for handle in handles:
+        normalized = normalize_handle(handle)
+        if normalized is not None and split_handle(normalized)[1] != settings.DOMAIN:
+            remote.setdefault(normalized, []).append(handle)
+    if not remote or not settings.FEDERATION_ENABLED:
+        return {}
+    found = await remote_directory.resolve_many(db, remote)
+    return {
+        handle: user
+        for normalized, user in found.items()
+        for handle in remote[normalized]
+    }
@@ -0,0 +1,132 @@
+"""
+Per-user event streams with monotonic sequence numbers
+"""
+import logging
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import case, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.user import User
+from app.models.user_event import UserEvent
+from app.schemas.message import MessageResponse
+from app.schemas.sync import SyncEvent
+from app.services.fanout import fanout
+
+logger = logging.getLogger(__name__)
+
+
+def new_event(
+    user_id: UUID,
+    event_type: str,
+    message_id: Optional[UUID] = None,
+    payload: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    Describe an event to be appended with append_events
+    """
+    return {
+        "user_id": user_id,
+        "event_type": event_type,
+        "message_id": message_id,
+        "payload": jsonable_encoder(payload) if payload is not None else None,
+    }
+
+
+async def append_events(db: AsyncSession, events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Allocate sequence numbers and store events, in the caller's transaction
+
+    Sequence numbers come from users.event_seq. The affected user rows are
+    locked in id order, so concurrent writers never deadlock and each
+    user's events become visible in sequence order. Returns the events with
+    their `seq` filled in, ready for publish_events() after commit.
+    """
+    if not events:
+        return []
+
+    counts = Counter(event["user_id"] for event in events)
+
+    # Lock in a deterministic order before incrementing. NO KEY UPDATE does
+    # not conflict with the KEY SHARE locks foreign-key checks take on users
+    locked_ids = (
+        select(User.id)
+        .where(User.id.in_(list(counts)))
+        .order_by(User.id)
+        .with_for_update(key_share=True)
+        .scalar_subquery()
+    )
+    result = await db.execute(
+        update(User)
+        .where(User.id.in_(locked_ids))
+        .values(event_seq=User.event_seq + case(dict(counts), value=User.id))
+        .returning(User.id, User.event_seq)
+        .execution_options(synchronize_session=False)
+    )
+
+    # Hand out each user's newly reserved range in event order
+    next_seq = {user_id: top - counts[user_id] + 1 for user_id, top in result.all()}
+    stored = []
+    for event in events:
+        if event["user_id"] not in next_seq:
+            continue  # user no longer exists
+        seq = next_seq[event["user_id"]]
+        next_seq[event["user_id"]] = seq + 1
+        stored.append({**event, "seq": seq, "created_at": datetime.utcnow()})
+
+    if stored:
+        await db.execute(insert(UserEvent), [
+            {key: event[key] for key in ("user_id", "seq", "event_type", "message_id", "payload")}
+            for event in stored
+        ])
+
+    return stored
+
+
+def sync_event(
+    seq: int,
+    event_type: str,
+    created_at: Optional[datetime],
+    payload: Optional[Dict[str, Any]],
+    message: Optional[MessageResponse] = None
+) -> SyncEvent:
+    """
+    Build the wire representation shared by WebSocket pushes and /sync
+    """
+    return SyncEvent(
+        seq=seq,
+        type=event_type,
+        created_at=created_at,
+        payload=payload,
+        message=message
+    )
+
+
+async def publish_events(
+    events: List[Dict[str, Any]],
+    messages: Optional[Dict[UUID, MessageResponse]] = None
+) -> None:
+    """
+    Push committed events to their users' devices on any worker
+
+    Never raises: the events are already stored, and devices that miss a
+    push catch up through /sync. Failing here would make clients retry
+    a write that has succeeded.
+    """
+    messages = messages or {}
+    for event in events:
+        frame = sync_event(
+            event["seq"],
+            event["event_type"],
+            event["created_at"],
+            event["payload"],
+            messages.get(event["message_id"])
+        )
+        try:
+            await fanout.publish_to_user(event["user_id"], frame.model_dump(mode="json"))
+        except Exception:
+            logger.exception("Failed to push event %s of user %s", event["seq"], event["user_id"])
@@ -0,0 +1,298 @@
+"""
+Cross-process fan-out of real-time events
+
+Events addressed to a user are published on a per-user channel. Each worker
+subscribes only to the channels of users that have a WebSocket connected to
+it, so a message accepted by any worker reaches every device regardless of
+which worker (or node process) holds the socket.
+
+Two backends are provided:
+
+* ``redis`` - Redis pub/sub, for running several uvicorn workers or processes
+* ``local`` - in-process stand-in, for single-worker deployments and tests
+"""
+import asyncio
+import json
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Set
+from uuid import UUID
+
+from fastapi import WebSocket
+from redis import asyncio as aioredis
+
+from app.core.config import settings
+from app.services.connection_manager import ConnectionManager, manager
+
+logger = logging.getLogger(__name__)
+
+USER_CHANNEL_PREFIX = "mychat:user:"
+CONTROL_CHANNEL = "mychat:control"
+
+MessageHandler = Callable[[str, str], Awaitable[None]]
+ControlHandler = Callable[[Dict[str, Any]], None]
+
+
+class FanoutBackend:
+    """Pub/sub transport interface"""
+
+    async def start(self, on_message: MessageHandler) -> None:
+        raise NotImplementedError
+
+    async def stop(self) -> None:
+        raise NotImplementedError
+
+    async def publish(self, channel: str, data: str) -> None:
+        raise NotImplementedError
+
+    async def subscribe(self, channel: str) -> None:
+        raise NotImplementedError
+
+    async def unsubscribe(self, channel: str) -> None:
+        raise NotImplementedError
+
+
+class LocalFanoutBackend(FanoutBackend):
+    """
+    In-process backend: publishes are delivered directly to this process
+
+    Only correct with a single worker; used by default and in tests so no
+    Redis server is needed.
+    """
+
+    def __init__(self):
+        self._on_message: Optional[MessageHandler] = None
+        self._channels: Set[str] = set()
+
+    async def start(self, on_message: MessageHandler) -> None:
+        self._on_message = on_message
+
+    async def stop(self) -> None:
+        self._on_message = None
+        self._channels.clear()
+
+    async def publish(self, channel: str, data: str) -> None:
+        if self._on_message and channel in self._channels:
+            await self._on_message(channel, data)
+
+    async def subscribe(self, channel: str) -> None:
+        self._channels.add(channel)
+
+    async def unsubscribe(self, channel: str) -> None:
+        self._channels.discard(channel)
+
+
+class RedisFanoutBackend(FanoutBackend):
+    """
+    Redis pub/sub backend shared by every worker pointing at the same Redis
+    """
+
+    RECONNECT_DELAY_SECONDS = 1
+
+    def __init__(self, url: str):
+        self._url = url
+        self._redis = None
+        self._pubsub = None
+        self._listener: Optional[asyncio.Task] = None
+        self._on_message: Optional[MessageHandler] = None
+
+    async def start(self, on_message: MessageHandler) -> None:
+        self._on_message = on_message
+        self._redis = aioredis.from_url(self._url, decode_responses=True)
+        self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self._pubsub:
+            await self._pubsub.aclose()
+            self._pubsub = None
+        if self._redis:
+            await self._redis.aclose()
+            self._redis = None
+
+    async def publish(self, channel: str, data: str) -> None:
+        await self._redis.publish(channel, data)
+
+    async def subscribe(self, channel: str) -> None:
+        await self._pubsub.subscribe(channel)
+
+    async def unsubscribe(self, channel: str) -> None:
+        if self._pubsub.subscribed:
+            await self._pubsub.unsubscribe(channel)
+
+    async def _listen(self) -> None:
+        """
+        Read messages and hand them to the dispatcher
+
+        redis-py reconnects and re-subscribes every tracked channel on its
+        own, so on errors the loop only backs off and keeps reading.
+        """
+        while True:
+            try:
+                if not self._pubsub.subscribed:
+                    await asyncio.sleep(self.RECONNECT_DELAY_SECONDS)
+                    continue
+                message = await self._pubsub.get_message(timeout=1.0)
+                if message and message.get("type") == "message":
+                    await self._on_message(message["channel"], message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Redis fan-out listener error")
+                await asyncio.sleep(self.RECONNECT_DELAY_SECONDS)
+
+
+def configured_workers() -> int:
+    """
+    Worker processes the server was started with, as far as the environment
+    tells (start.sh exports MYCHAT_WORKERS; uvicorn reads WEB_CONCURRENCY)
+    """
+    for name in ("MYCHAT_WORKERS", "WEB_CONCURRENCY"):
+        value = os.environ.get(name, "").strip()
+        if value.isdigit():
+            return int(value)
+    return 1
+
+
+def create_backend() -> FanoutBackend:
+    """
+    Build the backend selected by settings.FANOUT_BACKEND
+    """
+    if settings.FANOUT_BACKEND == "redis":
+        return RedisFanoutBackend(settings.REDIS_URL)
+    if settings.FANOUT_BACKEND == "local":
+        # Other workers would silently miss pushes, invalidations and revocations
+        if configured_workers() > 1:
+            raise ValueError("FANOUT_BACKEND=local supports a single worker; use redis")
+        return LocalFanoutBackend()
+    raise ValueError(f"Unknown FANOUT_BACKEND: {settings.FANOUT_BACKEND}")
+
+
+class Fanout:
+    """
+    Routes user events between the backplane and local WebSocket connections
+    """
+
+    def __init__(self, connections: ConnectionManager):
+        self.connections = connections
+        self.backend: Optional[FanoutBackend] = None
+        self._subscribed: Set[UUID] = set()
+        # Long-poll waiters, woken by any event for the user
+        self._waiters: Dict[UUID, Set[asyncio.Event]] = {}
+        # Node-wide control messages, by "type"
+        self._control_handlers: Dict[str, ControlHandler] = {}
+
+    async def start(self, backend: Optional[FanoutBackend] = None) -> None:
+        """
+        Start the backend and subscribe to the node-wide control channel
+        """
+        self.backend = backend or create_backend()
+        await self.backend.start(self._dispatch)
+        await self.backend.subscribe(CONTROL_CHANNEL)
+
+    async def stop(self) -> None:
+        if self.backend:
+            await self.backend.stop()
+            self.backend = None
+        self._subscribed.clear()
+
+    async def connect(self, user_id: UUID, websocket: WebSocket) -> None:
+        """
+        Register a local WebSocket and subscribe to the user's channel
+        """
+        await self.connections.connect(user_id, websocket)
+        await self._retain(user_id)
+
+    async def disconnect(self, user_id: UUID, websocket: WebSocket) -> None:
+        """
+        Drop a local WebSocket; unsubscribe once the user has none left here
+        """
+        await self.connections.disconnect(user_id, websocket)
+        await self._release(user_id)
+
+    @asynccontextmanager
+    async def waiter(self, user_id: UUID) -> AsyncIterator[asyncio.Event]:
+        """
+        Subscribe for the duration of a long poll
+
+        Yields an event that is set when anything is published to the user.
+        Enter it before checking for existing data so nothing published in
+        between is missed.
+        """
+        event = asyncio.Event()
+        self._waiters.setdefault(user_id, set()).add(event)
+        try:
+            await self._retain(user_id)
+            yield event
+        finally:
+            waiters = self._waiters.get(user_id)
+            if waiters is not None:
+                waiters.discard(event)
+                if not waiters:
+                    del self._waiters[user_id]
+            await self._release(user_id)
+
+    async def publish_to_user(self, user_id: UUID, event: Dict[str, Any]) -> None:
+        """
+        Publish an event to every device of a user on any worker
+        """
+        await self.backend.publish(
+            self._user_channel(user_id),
+            json.dumps(event, default=str)
+        )
+
+    def on_control(self, event_type: str, handler: ControlHandler) -> None:
+        """
+        Register the handler for a control message type
+        """
+        self._control_handlers[event_type] = handler
+
+    async def publish_control(self, event: Dict[str, Any]) -> None:
+        """
+        Publish a control message (with a "type" key) to every worker,
+        including this one
+        """
+        if self.backend:
+            await self.backend.publish(CONTROL_CHANNEL, json.dumps(event, default=str))
+
+    async def _retain(self, user_id: UUID) -> None:
+        if user_id not in self._subscribed:
+            self._subscribed.add(user_id)
+            await self.backend.subscribe(self._user_channel(user_id))
+
+    async def _release(self, user_id: UUID) -> None:
+        if user_id not in self._subscribed:
+            return
+        if self.connections.is_online(user_id) or self._waiters.get(user_id):
+            return
+        self._subscribed.discard(user_id)
+        if self.backend:
+            await self.backend.unsubscribe(self._user_channel(user_id))
+
+    async def _dispatch(self, channel: str, data: str) -> None:
+        if channel.startswith(USER_CHANNEL_PREFIX):
+            user_id = UUID(channel[len(USER_CHANNEL_PREFIX):])
+            for event in self._waiters.get(user_id, ()):
+                event.set()
+            await self.connections.deliver(user_id, data)
+        elif channel == CONTROL_CHANNEL:
+            event = json.loads(data)
+            handler = self._control_handlers.get(event.get("type"))
+            if handler:
+                handler(event)
+
+    @staticmethod
+    def _user_channel(user_id: UUID) -> str:
+        return f"{USER_CHANNEL_PREFIX}{user_id}"
+
+
+# Process-wide fan-out
+fanout = Fanout(manager)
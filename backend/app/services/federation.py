@@ -0,0 +1,113 @@
+"""
+Outbound federation plumbing shared by the delivery worker and lookups
+
+One pooled HTTP client per worker process keeps connections (and their TLS
+sessions) to peer nodes open between requests. Messages travel between
+nodes as JSON items carrying the same envelope bytes we store, several per
+request: POST {federation_api}/messages with {"origin": domain, "messages":
+[...]}, signed by the sending node (app.core.node_identity) and answered
+with one ack per message: accepted, duplicate, rejected (permanently) or
+retry (try again later).
+"""
+import asyncio
+import ipaddress
+import json
+import socket
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from app.core.config import settings
+from app.core.envelope import b64encode
+from app.models.message import Message
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def http_client() -> httpx.AsyncClient:
+    """
+    The process-wide client for requests to other nodes
+    """
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=settings.FEDERATION_HTTP_TIMEOUT_SECONDS,
+            limits=httpx.Limits(
+                max_connections=settings.FEDERATION_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.FEDERATION_HTTP_MAX_CONNECTIONS
+            ),
+            headers={"User-Agent": f"MyChat/1.0 (+https://{settings.DOMAIN})"}
+        )
+    return _client
+
+
+async def close_http_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def node_url(domain: str) -> str:
+    """
+    Base URL of a node
+    """
+    return f"https://{domain}"
+
+
+async def is_public_host(domain: str) -> bool:
+    """
+    Whether every address a peer's domain resolves to is publicly routable
+
+    Raises OSError if the name does not resolve. Always true with
+    FEDERATION_ALLOW_PRIVATE_PEERS.
+    """
+    if settings.FEDERATION_ALLOW_PRIVATE_PEERS:
+        return True
+    host = domain.rsplit(":", 1)[0]
+    infos = await asyncio.get_running_loop().getaddrinfo(host, None, type=socket.SOCK_STREAM)
+    addresses = {ipaddress.ip_address(info[4][0].split("%", 1)[0]) for info in infos}
+    return bool(addresses) and all(address.is_global for address in addresses)
+
+
+def well_known_url(domain: str) -> str:
+    """
+    Where a node publishes its metadata and signing key
+    """
+    return f"{node_url(domain)}{settings.API_V1_PREFIX}/node/.well-known/mychat-node"
+
+
+def default_federation_api_url(domain: str) -> str:
+    """
+    Where a node's federation API lives unless its well-known document says otherwise
+    """
+    return f"{node_url(domain)}/api/federation"
+
+
+def message_payload(message: Message) -> Dict[str, Any]:
+    """
+    Wire form of a stored message for the recipient's node
+    """
+    return {
+        "id": str(message.id),
+        "sender_handle": message.sender_handle,
+        "recipient_handle": message.recipient_handle,
+        "content_type": message.content_type,
+        "created_at": message.created_at.isoformat() if message.created_at else None,
+        "envelope": b64encode(message.envelope) if message.envelope is not None else None,
+        "encrypted_content": message.encrypted_content if message.envelope is None else None,
+    }
+
+
+def encode_payload(payload: Dict[str, Any]) -> bytes:
+    return json.dumps(payload, separators=(",", ":")).encode()
+
+
+def batch_body(encoded_messages: List[bytes]) -> bytes:
+    """
+    Request body for POST /messages from items encoded with encode_payload()
+    """
+    return (
+        b'{"origin":' + json.dumps(settings.DOMAIN).encode()
+        + b',"messages":[' + b",".join(encoded_messages) + b"]}"
+    )
@@ -0,0 +1,135 @@
+"""
+Group commit for the single-message send path
+
+When MESSAGE_GROUP_COMMIT is enabled, send_message hands its row to the
+batcher instead of committing on its own. The batcher collects rows for up
+to MESSAGE_GROUP_COMMIT_INTERVAL_MS (or until MESSAGE_GROUP_COMMIT_MAX_BATCH
+are waiting) and stores them with one multi-row insert and one commit, so a
+burst of sends costs one WAL flush instead of one per request. Each caller
+still waits until its own row is durably committed.
+"""
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.db.database import async_session_maker
+from app.models.message import Message
+from app.services.message_store import persist_messages
+
+logger = logging.getLogger(__name__)
+
+# (message, its stored events) handed back to each caller
+Result = Tuple[Message, List[Dict[str, Any]]]
+Pending = Tuple[Dict[str, Any], asyncio.Future]
+
+
+class MessageBatcher:
+    """
+    Collects message rows from concurrent requests and commits them together
+    """
+
+    def __init__(self):
+        self.max_batch = settings.MESSAGE_GROUP_COMMIT_MAX_BATCH
+        self.interval = settings.MESSAGE_GROUP_COMMIT_INTERVAL_MS / 1000
+        self._pending: List[Pending] = []
+        self._ready = asyncio.Event()
+        self._full = asyncio.Event()
+        self._runner: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    @property
+    def running(self) -> bool:
+        return self._runner is not None
+
+    async def start(self) -> None:
+        """
+        Start the background flusher
+        """
+        if self._runner is None:
+            self._stopping = False
+            self._runner = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stop the flusher after committing whatever is still waiting
+        """
+        if self._runner is None:
+            return
+        self._stopping = True
+        self._ready.set()
+        self._full.set()
+        await self._runner
+        self._runner = None
+
+    async def submit(self, row: Dict[str, Any]) -> Result:
+        """
+        Queue a row built by build_message_row and wait for its commit
+
+        Raises whatever storing the row raised; a failing row never fails
+        the other rows of its batch.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((row, future))
+        self._ready.set()
+        if len(self._pending) >= self.max_batch:
+            self._full.set()
+        return await future
+
+    async def _run(self) -> None:
+        while not (self._stopping and not self._pending):
+            await self._ready.wait()
+
+            # Give the burst a moment to accumulate, unless a batch is already full
+            if len(self._pending) < self.max_batch and not self._stopping:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            if len(self._pending) < self.max_batch:
+                self._full.clear()
+            if not self._pending:
+                self._ready.clear()
+
+            if not batch:
+                continue
+            try:
+                await self._flush(batch)
+            except Exception:
+                logger.exception("Group commit flush failed")
+
+    async def _flush(self, batch: List[Pending]) -> None:
+        try:
+            results = await self._persist([row for row, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                _, future = batch[0]
+                if not future.done():
+                    future.set_exception(e)
+                return
+            # Find the offending row(s) by committing the rest one by one
+            for item in batch:
+                await self._flush([item])
+            return
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():  # the request may have gone away
+                future.set_result(result)
+
+    @staticmethod
+    async def _persist(rows: List[Dict[str, Any]]) -> List[Result]:
+        async with async_session_maker() as db:
+            messages, events = await persist_messages(db, rows)
+            await db.commit()
+
+        by_message = defaultdict(list)
+        for event in events:
+            by_message[event["message_id"]].append(event)
+        return [(message, by_message[message.id]) for message in messages]
+
+
+# Process-wide batcher; started by the app lifespan when enabled
+message_batcher = MessageBatcher()
@@ -0,0 +1,139 @@
+"""
+Resolution of handles to users
+
+Every endpoint that takes a handle goes through here (directly, or through
+resolve_recipients() and find_user()). Handles are normalized first:
+surrounding whitespace is dropped and both parts are lowercased, as
+usernames are at registration and domains are case-insensitive.
+
+Per worker, a bounded LRU maps handles to a snapshot of the user's row, so
+repeat lookups of hot handles (sending, profile, key and contact lookups)
+need no query. Entries live for at most HANDLE_CACHE_TTL_SECONDS; a change
+to a column shown for a handle (key, avatar, last seen) must call
+invalidate(), which reaches the other workers through the fan-out control
+channel. Unknown handles are not cached, so new accounts resolve at once.
+"""
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+from uuid import UUID
+
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.models.user import User
+from app.services.fanout import fanout
+
+FORGET_HANDLE = "forget_handle"
+
+
+class ResolvedHandle(NamedTuple):
+    user_id: UUID
+    columns: Dict[str, Any]
+
+    def user(self) -> User:
+        """
+        A fresh detached User built from the snapshot
+
+        For reading what is shown about a handle; to change the user, load
+        the row into the session instead.
+        """
+        user = User(**self.columns)
+        make_transient_to_detached(user)
+        return user
+
+
+def normalize_handle(handle: str) -> Optional[str]:
+    """
+    The canonical form of a handle, or None if it is not username@domain
+    """
+    username, separator, domain = handle.strip().partition("@")
+    if not separator or not username or not domain:
+        return None
+    return f"{username.lower()}@{domain.lower()}"
+
+
+def is_local_handle(handle: Optional[str]) -> bool:
+    """
+    Whether a (normalized) handle names an account on this node
+    """
+    return handle is not None and handle.rpartition("@")[2] == settings.DOMAIN
+
+
+class HandleResolver:
+    """
+    Cached handle -> user snapshot lookups
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.entries: TTLCache[ResolvedHandle] = TTLCache(maxsize, ttl)
+        # Bumped by every invalidation, so a lookup that raced with one
+        # does not store what it read
+        self.generation = 0
+
+    async def resolve(self, db: AsyncSession, handle: str) -> Optional[ResolvedHandle]:
+        """
+        The stored user behind a handle, or None if there is none
+        """
+        return (await self.resolve_many(db, [handle])).get(handle)
+
+    async def resolve_many(self, db: AsyncSession, handles: Iterable[str]) -> Dict[str, ResolvedHandle]:
+        """
+        Resolve several handles, with one query for those not cached
+
+        Keys are the handles as given; unknown and malformed ones are absent.
+        """
+        found: Dict[str, ResolvedHandle] = {}
+        missing: Dict[str, List[str]] = {}  # normalized -> as given
+        for handle in handles:
+            normalized = normalize_handle(handle)
+            if normalized is None:
+                continue
+            entry = self.entries.get(normalized)
+            if entry is not None:
+                found[handle] = entry
+            else:
+                missing.setdefault(normalized, []).append(handle)
+        if not missing:
+            return found
+
+        generation = self.generation
+        result = await db.execute(
+            select(*User.__table__.columns).where(
+                tuple_(User.username, User.domain).in_([
+                    tuple(normalized.split("@", 1)) for normalized in missing
+                ])
+            )
+        )
+        for row in result.mappings():
+            normalized = f"{row['username']}@{row['domain']}"
+            entry = ResolvedHandle(row["id"], dict(row))
+            if generation == self.generation:
+                self.entries.set(normalized, entry)
+            for handle in missing.get(normalized, ()):
+                found[handle] = entry
+        return found
+
+    def forget(self, handle: str) -> None:
+        self.generation += 1
+        normalized = normalize_handle(handle)
+        if normalized is not None:
+            self.entries.pop(normalized)
+
+    def clear(self) -> None:
+        self.generation += 1
+        self.entries.clear()
+
+
+handle_resolver = HandleResolver(settings.HANDLE_CACHE_MAX_ENTRIES, settings.HANDLE_CACHE_TTL_SECONDS)
+
+fanout.on_control(FORGET_HANDLE, lambda event: handle_resolver.forget(event["handle"]))
+
+
+async def invalidate(handle: str) -> None:
+    """
+    Drop a handle's cached entry on every worker
+    """
+    handle_resolver.forget(handle)
+    await fanout.publish_control({"type": FORGET_HANDLE, "handle": handle})
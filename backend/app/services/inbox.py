@@ -0,0 +1,109 @@
+"""
+Incremental maintenance of per-user conversation summaries (the inbox)
+"""
+from typing import Dict, List, Tuple
+from uuid import UUID
+
+from sqlalchemy import update, func, case, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.contact import Contact
+from app.models.conversation_summary import ConversationSummary
+from app.models.message import Message
+from app.services.handles import is_local_handle
+
+
+async def record_messages(db: AsyncSession, messages: List[Message]) -> None:
+    """
+    Fold newly inserted 1-on-1 messages into the participants' summaries
+
+    Runs in the caller's transaction: one multi-row upsert into
+    conversation_summaries and one UPDATE of Contact.last_message_at,
+    however many messages there are. Only participants with an account on
+    this node have an inbox; the remote side of a federated message is
+    skipped.
+    """
+    entries: Dict[Tuple[UUID, UUID], dict] = {}
+    pairs = set()
+
+    for message in messages:
+        if not message.recipient_id or not message.sender_id:
+            continue
+
+        for user_id, peer_id, peer_handle, unread in (
+            (message.sender_id, message.recipient_id, message.recipient_handle, 0),
+            (message.recipient_id, message.sender_id, message.sender_handle, 1),
+        ):
+            owner_handle = message.sender_handle if unread == 0 else message.recipient_handle
+            if not is_local_handle(owner_handle):
+                continue
+
+            pairs.add((user_id, peer_id))
+            key = (user_id, message.conversation_id)
+            entry = entries.get(key)
+            if entry is None:
+                entry = entries[key] = {
+                    "user_id": user_id,
+                    "conversation_id": message.conversation_id,
+                    "peer_id": peer_id,
+                    "peer_handle": peer_handle,
+                    "unread_count": 0,
+                }
+            entry.update(
+                last_message_id=message.id,
+                last_message_at=message.created_at,
+                last_sender_handle=message.sender_handle,
+                last_content_type=message.content_type,
+            )
+            entry["unread_count"] += unread
+
+    if not entries:
+        return
+
+    # Upsert in key order so concurrent sends in both directions lock rows
+    # in the same order and cannot deadlock
+    stmt = insert(ConversationSummary).values([entries[key] for key in sorted(entries)])
+    newer = stmt.excluded.last_message_at >= func.coalesce(
+        ConversationSummary.last_message_at, stmt.excluded.last_message_at
+    )
+    # Concurrent sends may commit out of order; only move "last message" forward
+    latest = {
+        column: case((newer, getattr(stmt.excluded, column)), else_=getattr(ConversationSummary, column))
+        for column in ("last_message_id", "last_message_at", "last_sender_handle", "last_content_type")
+    }
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ConversationSummary.user_id, ConversationSummary.conversation_id],
+        set_={
+            **latest,
+            "peer_handle": stmt.excluded.peer_handle,
+            "unread_count": ConversationSummary.unread_count + stmt.excluded.unread_count,
+            "updated_at": func.now(),
+        }
+    )
+    await db.execute(stmt)
+
+    await db.execute(
+        update(Contact)
+        .where(tuple_(Contact.user_id, Contact.contact_id).in_(list(pairs)))
+        .values(last_message_at=func.now())
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def mark_read(db: AsyncSession, user_id: UUID, conversation_id: UUID, count: int) -> None:
+    """
+    Subtract messages that were just marked read from the unread counter
+    """
+    if count <= 0:
+        return
+
+    await db.execute(
+        update(ConversationSummary)
+        .where(
+            ConversationSummary.user_id == user_id,
+            ConversationSummary.conversation_id == conversation_id
+        )
+        .values(unread_count=func.greatest(ConversationSummary.unread_count - count, 0))
+        .execution_options(synchronize_session=False)
+    )
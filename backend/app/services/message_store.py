@@ -0,0 +1,244 @@
+"""
+Message persistence shared by the send paths and federation ingest
+"""
+import struct
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.envelope import b64decode, b64encode, encode_message, unpack_envelope
+from app.models.message import Message, conversation_key
+from app.models.message_queue import MessageQueue
+from app.models.user import User
+from app.schemas.federation import FederatedMessage
+from app.schemas.message import MessageCreate, MessageResponse
+from app.services.events import append_events, new_event
+from app.services.handles import handle_resolver, is_local_handle
+from app.services.inbox import record_messages
+
+# Last created_at handed out by this worker
+_last_created_at = datetime.min.replace(tzinfo=timezone.utc)
+
+
+def split_handle(handle: str) -> Tuple[str, str]:
+    """
+    Split username@domain into its parts
+    """
+    username, domain = handle.split('@', 1)
+    return username, domain
+
+
+async def resolve_recipients(db: AsyncSession, handles: Iterable[str]) -> Dict[str, UUID]:
+    """
+    Look up the user ids for a set of handles, through the handle cache
+
+    Returns a mapping of handle -> user id; unknown handles are absent.
+    """
+    resolved = await handle_resolver.resolve_many(db, handles)
+    return {handle: entry.user_id for handle, entry in resolved.items()}
+
+
+def build_message_row(
+    sender: User,
+    message_data: MessageCreate,
+    recipient_id: Optional[UUID] = None
+) -> Dict[str, Any]:
+    """
+    Build the column values for a new message
+
+    Messages to local recipients are delivered as soon as they are stored,
+    so their status is set here rather than with a second commit.
+    """
+    if recipient_id:
+        conversation_id = conversation_key(sender.id, recipient_id)
+    else:
+        conversation_id = message_data.group_id
+
+    envelope = encode_message(
+        message_data.encrypted_content,
+        message_data.encrypted_key,
+        message_data.iv,
+        message_data.algorithm
+    )
+
+    row = {
+        "sender_id": sender.id,
+        "recipient_id": recipient_id,
+        "group_id": message_data.group_id,
+        "conversation_id": conversation_id,
+        "envelope": envelope,
+        "encrypted_content": message_data.encrypted_content if envelope is None else None,
+        "content_type": message_data.content_type,
+        "sender_handle": sender.full_handle,
+        "recipient_handle": message_data.recipient_handle,
+        "message_size": len(message_data.encrypted_content),
+        "origin_node": settings.DOMAIN,
+        "status": "pending",
+        "delivered_at": None,
+    }
+
+    if recipient_id and message_data.recipient_handle:
+        _, domain = split_handle(message_data.recipient_handle)
+        if domain == settings.DOMAIN:
+            row["status"] = "delivered"
+            row["delivered_at"] = datetime.utcnow()
+
+    return row
+
+
+def build_remote_message_row(
+    sender: User,
+    recipient_id: UUID,
+    item: FederatedMessage,
+    origin: str
+) -> Dict[str, Any]:
+    """
+    Build the column values for a message received from another node
+
+    The message is delivered once it is stored here. Raises ValueError if
+    the item carries no usable content.
+    """
+    if item.envelope is not None:
+        try:
+            envelope = b64decode(item.envelope)
+            ciphertext = unpack_envelope(envelope).ciphertext
+        except (ValueError, IndexError, struct.error) as e:
+            raise ValueError("Malformed envelope") from e
+        encrypted_content = None
+        # What the size would be in the API's base64 form, as for local sends
+        message_size = 4 * -(-len(ciphertext) // 3)
+    elif item.encrypted_content is not None:
+        envelope, encrypted_content = None, item.encrypted_content
+        message_size = len(encrypted_content)
+    else:
+        raise ValueError("Message has no content")
+
+    return {
+        "sender_id": sender.id,
+        "recipient_id": recipient_id,
+        "group_id": None,
+        "conversation_id": conversation_key(sender.id, recipient_id),
+        "envelope": envelope,
+        "encrypted_content": encrypted_content,
+        "content_type": item.content_type,
+        "sender_handle": item.sender_handle,
+        "recipient_handle": item.recipient_handle,
+        "message_size": message_size,
+        "origin_node": origin,
+        "origin_message_id": item.id,
+        "status": "delivered",
+        "delivered_at": datetime.utcnow(),
+    }
+
+
+def _created_at_stamps(count: int) -> List[datetime]:
+    """
+    `count` strictly increasing timestamps, later than any handed out before
+    """
+    global _last_created_at
+    start = max(datetime.now(timezone.utc), _last_created_at + timedelta(microseconds=1))
+    stamps = [start + timedelta(microseconds=n) for n in range(count)]
+    _last_created_at = stamps[-1]
+    return stamps
+
+
+async def insert_messages(db: AsyncSession, rows: List[Dict[str, Any]]) -> List[Message]:
+    """
+    Insert messages with one multi-row INSERT ... RETURNING
+
+    Returned messages are in the same order as `rows`. Each row gets its
+    own created_at, increasing in row order: the server default, now(), is
+    the transaction start and would give a whole batch one timestamp, leaving
+    conversation pages to order the batch by random id.
+    """
+    if not rows:
+        return []
+
+    rows = [
+        {**row, "created_at": created_at}
+        for row, created_at in zip(rows, _created_at_stamps(len(rows)))
+    ]
+    result = await db.execute(
+        insert(Message).returning(Message, sort_by_parameter_order=True),
+        rows
+    )
+    return list(result.scalars().all())
+
+
+async def queue_remote_deliveries(db: AsyncSession, messages: List[Message]) -> None:
+    """
+    Queue messages addressed to users on other nodes for the delivery worker
+    """
+    rows = []
+    for message in messages:
+        if not message.recipient_id or not message.recipient_handle:
+            continue
+        _, domain = split_handle(message.recipient_handle)
+        if domain != settings.DOMAIN:
+            rows.append({"message_id": message.id, "target_node": domain})
+    if rows:
+        await db.execute(insert(MessageQueue), rows)
+
+
+async def persist_messages(
+    db: AsyncSession,
+    rows: List[Dict[str, Any]]
+) -> Tuple[List[Message], List[Dict[str, Any]]]:
+    """
+    Insert messages and update everything derived from them, in the caller's
+    transaction (conversation summaries, contact activity, event streams,
+    the federation delivery queue)
+
+    Returns the messages in row order and the stored events, which the
+    caller publishes with publish_events() once the transaction commits.
+    """
+    messages = await insert_messages(db, rows)
+    await record_messages(db, messages)
+    await queue_remote_deliveries(db, messages)
+
+    # Only users of this node have event streams
+    events = []
+    for message in messages:
+        if message.recipient_id and is_local_handle(message.recipient_handle):
+            events.append(new_event(message.recipient_id, "message", message.id))
+        if message.sender_id and is_local_handle(message.sender_handle):
+            # The sender's other devices
+            events.append(new_event(message.sender_id, "message", message.id))
+    events = await append_events(db, events)
+
+    return messages, events
+
+
+def message_response(message: Message) -> MessageResponse:
+    """
+    Build the API representation of a stored message
+    """
+    if message.envelope is not None:
+        envelope = unpack_envelope(message.envelope)
+        encrypted_content = b64encode(envelope.ciphertext)
+        encrypted_key = b64encode(envelope.keys[0]) if envelope.keys else None
+        iv = b64encode(envelope.iv)
+        algorithm = envelope.algorithm
+    else:
+        encrypted_content, encrypted_key, iv, algorithm = message.encrypted_content, None, "", None
+
+    # Every field comes from a stored row, so skip validation
+    return MessageResponse.model_construct(
+        id=message.id,
+        sender_handle=message.sender_handle,
+        recipient_handle=message.recipient_handle,
+        group_id=message.group_id,
+        encrypted_content=encrypted_content,
+        encrypted_key=encrypted_key,
+        iv=iv,
+        algorithm=algorithm,
+        content_type=message.content_type,
+        created_at=message.created_at,
+        delivered_at=message.delivered_at,
+        read_at=message.read_at,
+        status=message.status
+    )
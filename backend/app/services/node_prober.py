@@ -0,0 +1,205 @@
+"""
+Health probing of peer nodes
+
+Every known peer (a federated_nodes row, created when one of its users is
+first looked up) has its well-known document fetched every
+FEDERATION_PROBE_INTERVAL_SECONDS. A successful probe refreshes the node's
+metadata (including the key its requests are signed with), sets last_seen
+and folds the round trip into avg_latency_ms as an exponentially weighted
+moving average.
+
+Probes also drive a circuit breaker: after FEDERATION_NODE_FAILURE_THRESHOLD
+consecutive failures a node is marked offline and the delivery worker stops
+sending to it. Offline nodes keep being probed, with growing intervals, and
+the first successful probe puts them back in service.
+
+Due nodes are claimed with SKIP LOCKED and leased through next_probe_at, so
+with several workers each node is still probed by one of them at a time.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, NamedTuple, Optional
+from urllib.parse import urlsplit
+from uuid import UUID
+
+import httpx
+from sqlalchemy import func, select, update
+
+from app.core.config import settings
+from app.core.scheduler import scheduler
+from app.db.database import async_session_maker
+from app.models.federated_node import FederatedNode
+from app.services.delivery import delivery_worker
+from app.services.federation import http_client, well_known_url
+from app.services.peer_keys import published_key
+
+logger = logging.getLogger(__name__)
+
+# Weight of the newest sample in avg_latency_ms
+EWMA_ALPHA = 0.3
+
+# How often the job looks for due nodes
+PROBE_TICK_SECONDS = 15
+
+# Nodes claimed per transaction, and how long a claim holds
+PROBE_BATCH_SIZE = 100
+PROBE_LEASE = timedelta(minutes=2)
+
+# Offline nodes are probed at most this many intervals apart
+MAX_BACKOFF_FACTOR = 32
+
+
+class ProbedNode(NamedTuple):
+    id: UUID
+    domain: str
+    status: str
+    consecutive_failures: int
+    avg_latency_ms: Optional[int]
+
+
+class ProbeResult(NamedTuple):
+    node: ProbedNode
+    latency_ms: Optional[float] = None
+    document: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+
+
+async def _probe(node: ProbedNode, limit: asyncio.Semaphore) -> ProbeResult:
+    async with limit:
+        started = time.perf_counter()
+        try:
+            response = await http_client().get(
+                well_known_url(node.domain),
+                timeout=settings.FEDERATION_PROBE_TIMEOUT_SECONDS
+            )
+        except httpx.HTTPError as e:
+            return ProbeResult(node, error=f"{type(e).__name__}: {e}")
+        latency_ms = (time.perf_counter() - started) * 1000
+
+    if response.status_code != 200:
+        return ProbeResult(node, error=f"HTTP {response.status_code}")
+    try:
+        document = response.json()
+        if document["domain"] != node.domain:
+            return ProbeResult(node, error=f"Well-known document is for {document['domain']}")
+    except (ValueError, KeyError, TypeError):
+        return ProbeResult(node, error="Malformed well-known document")
+    return ProbeResult(node, latency_ms, document)
+
+
+def _healthy_values(result: ProbeResult, now: datetime) -> Dict[str, Any]:
+    node, document = result.node, result.document
+    if node.avg_latency_ms is None:
+        latency = result.latency_ms
+    else:
+        latency = EWMA_ALPHA * result.latency_ms + (1 - EWMA_ALPHA) * node.avg_latency_ms
+
+    values = {
+        "id": node.id,
+        "status": "active",
+        "consecutive_failures": 0,
+        "last_seen": now,
+        "avg_latency_ms": round(latency),
+        "server_version": str(document.get("version") or "")[:50] or None,
+        "next_probe_at": now + timedelta(seconds=settings.FEDERATION_PROBE_INTERVAL_SECONDS),
+    }
+
+    user_count = (document.get("statistics") or {}).get("user_count")
+    if isinstance(user_count, int):
+        values["user_count"] = user_count
+
+    # Only follow an API location on the node's own host
+    api_url = document.get("federation_api")
+    if isinstance(api_url, str):
+        parts = urlsplit(api_url)
+        if parts.scheme == "https" and parts.netloc == node.domain:
+            values["federation_api_url"] = api_url.rstrip("/")
+
+    # The key its batches to us are verified with
+    public_key = published_key(document)
+    if public_key is not None:
+        values["public_key"] = public_key
+    return values
+
+
+def _failed_values(result: ProbeResult, now: datetime) -> Dict[str, Any]:
+    node = result.node
+    failures = node.consecutive_failures + 1
+    values = {"id": node.id, "consecutive_failures": failures}
+
+    interval = settings.FEDERATION_PROBE_INTERVAL_SECONDS
+    if failures >= settings.FEDERATION_NODE_FAILURE_THRESHOLD:
+        values["status"] = "offline"
+        interval *= min(2 ** (failures - settings.FEDERATION_NODE_FAILURE_THRESHOLD), MAX_BACKOFF_FACTOR)
+        if node.status != "offline":
+            logger.warning("Node %s marked offline after %d failed probes: %s", node.domain, failures, result.error)
+    values["next_probe_at"] = now + timedelta(seconds=interval)
+    return values
+
+
+async def _claim() -> List[ProbedNode]:
+    due = (
+        select(FederatedNode.id)
+        .where(FederatedNode.status != "blocked", FederatedNode.next_probe_at <= func.now())
+        .order_by(FederatedNode.next_probe_at)
+        .limit(PROBE_BATCH_SIZE)
+        .with_for_update(skip_locked=True)
+    )
+    async with async_session_maker() as db:
+        result = await db.execute(
+            update(FederatedNode)
+            .where(FederatedNode.id.in_(due.scalar_subquery()))
+            .values(next_probe_at=func.now() + PROBE_LEASE)
+            .returning(
+                FederatedNode.id,
+                FederatedNode.domain,
+                FederatedNode.status,
+                FederatedNode.consecutive_failures,
+                FederatedNode.avg_latency_ms
+            )
+            .execution_options(synchronize_session=False)
+        )
+        nodes = [ProbedNode(*row) for row in result.all()]
+        await db.commit()
+    return nodes
+
+
+async def probe_due_nodes() -> int:
+    """
+    Probe every node whose next probe is due; returns how many were probed
+    """
+    limit = asyncio.Semaphore(settings.FEDERATION_PROBE_CONCURRENCY)
+    probed = 0
+    while True:
+        nodes = await _claim()
+        if not nodes:
+            return probed
+
+        results = await asyncio.gather(*(_probe(node, limit) for node in nodes))
+        now = datetime.now(timezone.utc)
+        values = [
+            _healthy_values(result, now) if result.error is None else _failed_values(result, now)
+            for result in results
+        ]
+        async with async_session_maker() as db:
+            await db.execute(update(FederatedNode), values)
+            await db.commit()
+
+        recovered = [r.node.domain for r in results if r.error is None and r.node.status == "offline"]
+        if recovered:
+            logger.info("Nodes back online: %s", ", ".join(recovered))
+            # Their queued messages are due again
+            delivery_worker.wake()
+
+        probed += len(nodes)
+        if len(nodes) < PROBE_BATCH_SIZE:
+            return probed
+
+
+def start() -> None:
+    """
+    Schedule the probing job
+    """
+    scheduler.add_job(probe_due_nodes, "interval", seconds=PROBE_TICK_SECONDS, id="federation.probe_nodes")
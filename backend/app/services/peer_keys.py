@@ -0,0 +1,234 @@
+"""
+Verification of batches signed by other nodes
+
+Peers sign what they send with their node key (app.core.node_identity).
+The public keys are stored in federated_nodes.public_key, which the prober
+keeps current from each node's well-known document; a node that writes to
+us before we ever probed it is asked for its document right away, and gets
+a federated_nodes row only once its signature verifies, so an origin header
+alone never makes us store (or probe) a host. Per worker, parsed keys are
+cached for FEDERATION_PEER_KEY_TTL_SECONDS, so verifying a batch normally
+costs no query at all.
+
+Signature checks hash the whole body, up to FEDERATION_INGEST_MAX_BYTES, so
+they run in the threadpool. A signature that does not verify against the
+cached key triggers one refetch of the peer's document (at most every
+REFETCH_INTERVAL), which picks up a rotated key without letting forged
+requests turn into a stream of outbound fetches. Across all peers, a worker
+makes at most FEDERATION_PEER_KEY_FETCHES_PER_MINUTE fetches, and never to
+a host resolving to a private or loopback address.
+
+When the document cannot be fetched at all (network error or 5xx), verify()
+raises PeerKeyUnavailable instead of answering False, so the request can be
+refused as temporary rather than as a bad signature.
+"""
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple, Union
+
+import httpx
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PublicKey
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.node_identity import load_public_key
+from app.db.database import async_session_maker
+from app.models.federated_node import FederatedNode
+from app.services.federation import default_federation_api_url, http_client, is_public_host, well_known_url
+
+logger = logging.getLogger(__name__)
+
+# Largest node key accepted from a well-known document (PEM text)
+MAX_NODE_KEY_LENGTH = 1024
+
+# Minimum seconds between refetches of one peer's document
+REFETCH_INTERVAL = 60
+
+# Peers remembered per worker
+MAX_PEERS = 10000
+
+# What _load() answers for a blocked node
+BLOCKED = object()
+
+
+def published_key(document: Dict[str, Any]) -> Optional[str]:
+    """
+    The usable node key from a well-known document, if it has one
+    """
+    pem = document.get("public_key")
+    if not isinstance(pem, str) or len(pem) > MAX_NODE_KEY_LENGTH:
+        return None
+    try:
+        load_public_key(pem)
+    except ValueError:
+        return None
+    return pem
+
+
+class PeerKeyUnavailable(Exception):
+    """The peer's node key could not be fetched right now"""
+
+
+def _verify(key: Ed25519PublicKey, signature: bytes, data: bytes) -> bool:
+    try:
+        key.verify(signature, data)
+        return True
+    except InvalidSignature:
+        return False
+
+
+class PeerKeys:
+    """
+    Per-worker cache of peer node keys
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.keys: TTLCache[Ed25519PublicKey] = TTLCache(maxsize, ttl)
+        # domain -> whether the last fetch reached the peer
+        self._refetched: TTLCache[bool] = TTLCache(maxsize, REFETCH_INTERVAL)
+        # Start times of the fetches within the last minute
+        self._fetches: Deque[float] = deque()
+
+    async def verify(self, domain: str, signature: bytes, data: bytes) -> bool:
+        """
+        Whether `signature` over `data` was made by the node at `domain`
+
+        Blocked nodes have no usable key, so nothing they send verifies.
+        Raises PeerKeyUnavailable if the peer's key is needed but could not
+        be fetched.
+        """
+        key = self.keys.get(domain)
+        if key is None:
+            stored = await self._load(domain)
+            if stored is BLOCKED:
+                return False
+            key = stored
+        if key is not None and await run_in_threadpool(_verify, key, signature, data):
+            return True
+
+        # Unknown to us, or maybe the peer rotated its key since we stored it
+        if self._refetched.get(domain):
+            return False
+        fetched = await self._fetch(domain)
+        if fetched is None:
+            return False
+        fresh, pem = fetched
+        if not await run_in_threadpool(_verify, fresh, signature, data):
+            return False
+        # Only a node that proved it holds the key gets stored (and probed)
+        if not await self._store(domain, pem):
+            return False
+        self.keys.set(domain, fresh)
+        return True
+
+    def forget(self, domain: str) -> None:
+        self.keys.pop(domain)
+
+    async def _load(self, domain: str) -> Union[Ed25519PublicKey, None, object]:
+        """
+        The stored key of a peer, None if there is none, or BLOCKED
+        """
+        async with async_session_maker() as db:
+            row = (await db.execute(
+                select(FederatedNode.public_key, FederatedNode.status)
+                .where(FederatedNode.domain == domain)
+            )).one_or_none()
+        if row is not None and row.status == "blocked":
+            return BLOCKED
+        if row is None or row.public_key is None:
+            return None
+        try:
+            key = load_public_key(row.public_key)
+        except ValueError:
+            return None
+        self.keys.set(domain, key)
+        return key
+
+    def _admit_fetch(self) -> bool:
+        now = time.monotonic()
+        while self._fetches and now - self._fetches[0] >= 60:
+            self._fetches.popleft()
+        if len(self._fetches) >= settings.FEDERATION_PEER_KEY_FETCHES_PER_MINUTE:
+            return False
+        self._fetches.append(now)
+        return True
+
+    async def _fetch(self, domain: str) -> Optional[Tuple[Ed25519PublicKey, str]]:
+        """
+        Fetch the peer's published key, parsed and as PEM; None if it has none
+
+        Nothing is stored: the caller stores the key once a signature made
+        with it verifies. Raises PeerKeyUnavailable if the peer could not be
+        reached, now or on the last attempt within REFETCH_INTERVAL, or if
+        this worker is out of fetches for the minute.
+        """
+        if self._refetched.get(domain) is False:
+            raise PeerKeyUnavailable(domain)
+        if not self._admit_fetch():
+            logger.warning("Node key fetch budget exhausted; not fetching the key of %s", domain)
+            raise PeerKeyUnavailable(domain)
+        try:
+            public = await is_public_host(domain)
+        except OSError as e:
+            logger.info("Could not resolve %s: %s", domain, e)
+            self._refetched.set(domain, False)
+            raise PeerKeyUnavailable(domain) from e
+        if not public:
+            logger.info("Not fetching the node key of %s: it resolves to a private address", domain)
+            self._refetched.set(domain, True)
+            return None
+        try:
+            response = await http_client().get(
+                well_known_url(domain),
+                timeout=settings.FEDERATION_PROBE_TIMEOUT_SECONDS
+            )
+        except httpx.HTTPError as e:
+            logger.info("Could not fetch the node key of %s: %s", domain, e)
+            self._refetched.set(domain, False)
+            raise PeerKeyUnavailable(domain) from e
+        if response.status_code >= 500:
+            logger.info("Could not fetch the node key of %s: HTTP %s", domain, response.status_code)
+            self._refetched.set(domain, False)
+            raise PeerKeyUnavailable(domain)
+
+        self._refetched.set(domain, True)
+        try:
+            document = response.json() if response.status_code == 200 else {}
+            pem = published_key(document) if document.get("domain") == domain else None
+        except (ValueError, AttributeError) as e:
+            logger.info("%s published an unreadable document: %s", domain, e)
+            return None
+        if pem is None:
+            logger.info("%s publishes no usable node key", domain)
+            return None
+        return load_public_key(pem), pem
+
+    async def _store(self, domain: str, pem: str) -> bool:
+        """
+        Record a verified peer and its key; False if the node is blocked
+        """
+        async with async_session_maker() as db:
+            statement = insert(FederatedNode).values(
+                domain=domain,
+                federation_api_url=default_federation_api_url(domain),
+                public_key=pem
+            )
+            result = await db.execute(
+                statement.on_conflict_do_update(
+                    index_elements=[FederatedNode.domain],
+                    set_={"public_key": statement.excluded.public_key},
+                    where=FederatedNode.status != "blocked"
+                ).returning(FederatedNode.id)
+            )
+            stored = result.scalar_one_or_none() is not None
+            await db.commit()
+        return stored
+
+
+# Process-wide cache
+peer_keys = PeerKeys(MAX_PEERS, settings.FEDERATION_PEER_KEY_TTL_SECONDS)
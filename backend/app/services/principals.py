@@ -0,0 +1,88 @@
+"""
+In-process cache of authenticated principals
+
+Lets get_current_user skip both the JWT decode and the users lookup for
+tokens and users seen recently. Entries live for AUTH_CACHE_TTL_SECONDS at
+most; anything that changes a user row must call invalidate_user(), which
+also reaches the other workers through the fan-out control channel.
+"""
+import time
+from typing import Any, Dict, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy.orm import make_transient_to_detached
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.models.user import User
+from app.services.fanout import fanout
+
+INVALIDATE_USER = "invalidate_user"
+
+
+class PrincipalCache:
+    """
+    token -> (user id, session id), and user id -> snapshot of the user's columns
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.tokens: TTLCache[Tuple[UUID, Optional[UUID]]] = TTLCache(maxsize, ttl)
+        self.users: TTLCache[Dict[str, Any]] = TTLCache(maxsize, ttl)
+        # Bumped by every invalidation, so a lookup that raced with one
+        # does not store what it read
+        self.generation = 0
+
+    def principal_for(self, token: str) -> Optional[Tuple[UUID, Optional[UUID]]]:
+        return self.tokens.get(token)
+
+    def remember_token(
+        self,
+        token: str,
+        principal: Tuple[UUID, Optional[UUID]],
+        expires_at: Optional[float]
+    ) -> None:
+        ttl = expires_at - time.time() if expires_at else None
+        self.tokens.set(token, principal, ttl)
+
+    def user(self, user_id: UUID) -> Optional[User]:
+        """
+        A fresh detached User built from the snapshot, if cached
+
+        Each call returns a new instance, so callers may modify it freely;
+        to persist changes, load the row into the session instead.
+        """
+        snapshot = self.users.get(user_id)
+        if snapshot is None:
+            return None
+        user = User(**snapshot)
+        make_transient_to_detached(user)
+        return user
+
+    def remember_user(self, user: User, generation: int) -> None:
+        if generation != self.generation:
+            return
+        self.users.set(user.id, {
+            column.key: getattr(user, column.key) for column in User.__table__.columns
+        })
+
+    def forget_user(self, user_id: UUID) -> None:
+        self.generation += 1
+        self.users.pop(user_id)
+
+    def clear(self) -> None:
+        self.generation += 1
+        self.tokens.clear()
+        self.users.clear()
+
+
+principal_cache = PrincipalCache(settings.AUTH_CACHE_MAX_ENTRIES, settings.AUTH_CACHE_TTL_SECONDS)
+
+fanout.on_control(INVALIDATE_USER, lambda event: principal_cache.forget_user(UUID(event["user_id"])))
+
+
+async def invalidate_user(user_id: UUID) -> None:
+    """
+    Drop a user's cached snapshot on every worker
+    """
+    principal_cache.forget_user(user_id)
+    await fanout.publish_control({"type": INVALIDATE_USER, "user_id": str(user_id)})
@@ -0,0 +1,231 @@
+"""
+Server-side login sessions and their revocation
+
+Every access token carries the id of its row in `sessions` (claim `sid`).
+Revoking a session stamps `revoked_at`; each worker keeps the ids of revoked,
+unexpired sessions in memory so authentication checks them without a query.
+That set is loaded at startup, refreshed incrementally on a schedule and
+updated immediately through the fan-out control channel.
+
+`last_activity` is not written per request: activity is collected in memory
+and flushed for all sessions at once every SESSION_ACTIVITY_FLUSH_SECONDS.
+"""
+import hashlib
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy import bindparam, delete, func, select, text, update
+from sqlalchemy.dialects.postgresql import ARRAY, TIMESTAMP, UUID as PG_UUID
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.scheduler import scheduler
+from app.core.security import create_access_token
+from app.db.database import async_session_maker
+from app.models.session import Session
+from app.models.user import User
+from app.services.fanout import fanout
+
+logger = logging.getLogger(__name__)
+
+SESSIONS_REVOKED = "sessions_revoked"
+
+# Re-read revocations this far behind the last one seen, so a revoking
+# transaction that committed late is not missed
+REFRESH_OVERLAP = timedelta(minutes=1)
+
+# Expired sessions are kept this long before being deleted
+EXPIRED_RETENTION = timedelta(days=1)
+
+FLUSH_ACTIVITY = text("""
+    UPDATE sessions
+    SET last_activity = activity.seen_at
+    FROM unnest(:ids, :seen) AS activity(id, seen_at)
+    WHERE sessions.id = activity.id
+      AND (sessions.last_activity IS NULL OR sessions.last_activity < activity.seen_at)
+""").bindparams(
+    bindparam("ids", type_=ARRAY(PG_UUID(as_uuid=True))),
+    bindparam("seen", type_=ARRAY(TIMESTAMP(timezone=True)))
+)
+
+
+def token_digest(token: str) -> str:
+    """
+    What the sessions table stores instead of the bearer token itself
+    """
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class SessionRegistry:
+    """
+    Per-worker view of revoked sessions plus buffered activity
+    """
+
+    def __init__(self):
+        # session id -> expiry; only revoked sessions that have not expired
+        self._revoked: Dict[UUID, datetime] = {}
+        self._watermark: Optional[datetime] = None
+        # session id -> last request seen by this worker since the last flush
+        self._activity: Dict[UUID, datetime] = {}
+
+    def is_revoked(self, session_id: UUID) -> bool:
+        return session_id in self._revoked
+
+    def touch(self, session_id: UUID) -> None:
+        """
+        Note that a session was used; written by the next activity flush
+        """
+        self._activity[session_id] = _utcnow()
+
+    def create(
+        self,
+        db: AsyncSession,
+        user: User,
+        ip_address: Optional[str] = None,
+        user_agent: Optional[str] = None
+    ) -> str:
+        """
+        Open a session for a user and return its access token
+
+        Adds the row to the caller's transaction; the token is only valid
+        once that commits.
+        """
+        session_id = uuid.uuid4()
+        lifetime = timedelta(hours=settings.SESSION_TIMEOUT_HOURS)
+        token = create_access_token(
+            data={"user_id": str(user.id), "sid": str(session_id)},
+            expires_delta=lifetime
+        )
+        db.add(Session(
+            id=session_id,
+            user_id=user.id,
+            token=token_digest(token),
+            ip_address=ip_address,
+            user_agent=user_agent[:1024] if user_agent else None,
+            expires_at=_utcnow() + lifetime
+        ))
+        return token
+
+    async def revoke(self, db: AsyncSession, session_ids: Iterable[UUID]) -> List[Tuple[UUID, datetime]]:
+        """
+        Revoke sessions, in the caller's transaction
+
+        Returns the newly revoked (id, expires_at) pairs; pass them to
+        announce_revoked() once the transaction commits.
+        """
+        result = await db.execute(
+            update(Session)
+            .where(Session.id.in_(list(session_ids)), Session.revoked_at.is_(None))
+            .values(revoked_at=func.now())
+            .returning(Session.id, Session.expires_at)
+            .execution_options(synchronize_session=False)
+        )
+        return [tuple(row) for row in result.all()]
+
+    async def announce_revoked(self, revoked: List[Tuple[UUID, datetime]]) -> None:
+        """
+        Apply committed revocations here at once and tell the other workers
+        """
+        self._remember(revoked)
+        if revoked:
+            await fanout.publish_control({
+                "type": SESSIONS_REVOKED,
+                "sessions": [[str(session_id), expires_at.isoformat()] for session_id, expires_at in revoked],
+            })
+
+    def _remember(self, revoked: Iterable[Tuple[UUID, datetime]]) -> None:
+        now = _utcnow()
+        for session_id, expires_at in revoked:
+            if expires_at > now:
+                self._revoked[session_id] = expires_at
+
+    def _on_control(self, event: dict) -> None:
+        self._remember(
+            (UUID(session_id), datetime.fromisoformat(expires_at))
+            for session_id, expires_at in event["sessions"]
+        )
+
+    async def refresh(self) -> None:
+        """
+        Load revocations made since the last refresh (all of them the first time)
+        """
+        query = select(Session.id, Session.expires_at, Session.revoked_at).where(
+            Session.revoked_at.isnot(None),
+            Session.expires_at > func.now()
+        )
+        if self._watermark:
+            query = query.where(Session.revoked_at >= self._watermark - REFRESH_OVERLAP)
+
+        async with async_session_maker() as db:
+            rows = (await db.execute(query)).all()
+
+        self._remember((session_id, expires_at) for session_id, expires_at, _ in rows)
+        if rows:
+            latest = max(revoked_at for _, _, revoked_at in rows)
+            self._watermark = max(self._watermark or latest, latest)
+        elif self._watermark is None:
+            self._watermark = _utcnow()
+
+        # Revoked tokens that have expired are rejected anyway
+        now = _utcnow()
+        self._revoked = {
+            session_id: expires_at for session_id, expires_at in self._revoked.items() if expires_at > now
+        }
+
+    async def flush_activity(self) -> None:
+        """
+        Write buffered last_activity timestamps with a single UPDATE
+        """
+        if not self._activity:
+            return
+        activity, self._activity = self._activity, {}
+        ids: List[UUID] = list(activity)
+        async with async_session_maker() as db:
+            await db.execute(FLUSH_ACTIVITY, {"ids": ids, "seen": [activity[i] for i in ids]})
+            await db.commit()
+
+    async def prune_expired(self) -> None:
+        """
+        Delete sessions that expired more than EXPIRED_RETENTION ago
+        """
+        async with async_session_maker() as db:
+            await db.execute(
+                delete(Session).where(Session.expires_at < _utcnow() - EXPIRED_RETENTION)
+            )
+            await db.commit()
+
+    async def start(self) -> None:
+        """
+        Load revocations and schedule the periodic jobs
+        """
+        fanout.on_control(SESSIONS_REVOKED, self._on_control)
+        await self.refresh()
+        scheduler.add_job(
+            self.refresh, "interval",
+            seconds=settings.SESSION_REVOCATION_REFRESH_SECONDS, id="sessions.refresh"
+        )
+        scheduler.add_job(
+            self.flush_activity, "interval",
+            seconds=settings.SESSION_ACTIVITY_FLUSH_SECONDS, id="sessions.flush_activity"
+        )
+        scheduler.add_job(self.prune_expired, "interval", hours=1, id="sessions.prune_expired")
+
+    async def stop(self) -> None:
+        """
+        Flush activity still buffered on shutdown
+        """
+        try:
+            await self.flush_activity()
+        except Exception:
+            logger.exception("Final session activity flush failed")
+
+
+# Process-wide registry
+session_registry = SessionRegistry()
@@ -0,0 +1,3 @@
+"""
+Benchmarks, run as modules from the backend directory
+"""
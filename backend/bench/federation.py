@@ -0,0 +1,430 @@
+"""
+Federation load test with several nodes in one process
+
+Boots --nodes copies of app.main:app, each with its own DOMAIN
+(node<N>.bench.test), database and node key, and wires their outbound
+federation clients to each other's ASGI apps in memory: nothing leaves the
+process except database connections. Users on every node then send to users
+on the other nodes at --rate messages per second (open loop), and the run
+reports:
+
+- delivered messages per second (acknowledged by the recipient's node);
+- end-to-end latency percentiles, from the send request to the ack;
+- pending rows in message_queue over time, summed over all nodes.
+
+With --check it then verifies the run and exits non-zero on a failure:
+every send succeeded and was acknowledged, every message is stored exactly
+once on the recipient's node, and paging each recipient's conversations
+returns every message once, newest first. A short --check run is the smoke
+test for federation:
+
+    python -m bench.federation --users 3 --rate 20 --duration 3 --check
+
+Each node needs a PostgreSQL database; they are created as
+<DB_NAME>_bench_<N> with the usual DB_* settings (the DB_USER must be
+allowed to create databases) and dropped afterwards. Every other setting
+(FEDERATION_DELIVERY_*, MESSAGE_GROUP_COMMIT, ...) is read from the
+environment and .env as for the server, and applies to all nodes.
+
+    cd backend
+    python -m bench.federation --nodes 3 --users 10 --rate 200 --duration 30
+"""
+import argparse
+import asyncio
+import base64
+import importlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from contextlib import AsyncExitStack
+from datetime import datetime
+from types import ModuleType
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+# Modules every node copy shares: Prometheus collectors can only be
+# registered once per process
+SHARED_MODULES = {"app.core.metrics"}
+
+
+def _app_modules() -> Dict[str, ModuleType]:
+    return {
+        name: module for name, module in sys.modules.items()
+        if name == "app" or name.startswith("app.")
+    }
+
+
+class Node:
+    """One copy of the application, loaded with its own settings"""
+
+    def __init__(self, index: int, db_name: str, workdir: str):
+        self.domain = f"node{index}.bench.test"
+        self.db_name = db_name
+
+        os.environ.update({
+            "DOMAIN": self.domain,
+            "DB_NAME": db_name,
+            "NODE_KEY_PATH": os.path.join(workdir, self.domain, "node_key.pem"),
+            "ATTACHMENTS_DIR": os.path.join(workdir, self.domain, "attachments"),
+            "FANOUT_BACKEND": "local",
+            "FEDERATION_ENABLED": "true",
+            "FEDERATION_ALLOW_PRIVATE_PEERS": "true",  # names only the in-memory network knows
+            "REGISTRATION_OPEN": "true",
+        })
+        # Forget the previous copy so every app module is executed again
+        for name in _app_modules():
+            if name not in SHARED_MODULES:
+                del sys.modules[name]
+        self.app = importlib.import_module("app.main").app
+        self.modules = _app_modules()
+
+    def module(self, name: str) -> ModuleType:
+        return self.modules[name]
+
+    async def queue_depth(self) -> int:
+        async with self.module("app.db.database").async_session_maker() as db:
+            result = await db.execute(text("SELECT count(*) FROM message_queue WHERE status = 'pending'"))
+            return result.scalar_one()
+
+
+class Network(httpx.AsyncBaseTransport):
+    """
+    In-memory transport routing requests to the node named by the URL host
+
+    Also watches federation batches go by, to time deliveries.
+    """
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.routes: Dict[str, httpx.ASGITransport] = {}
+        self.acked: Dict[str, float] = {}
+
+    def attach(self, node: Node) -> None:
+        # Server errors become 500 responses, as over a real network
+        self.routes[node.domain] = httpx.ASGITransport(app=node.app, raise_app_exceptions=False)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        route = self.routes.get(request.url.host)
+        if route is None:
+            raise httpx.ConnectError(f"No node at {request.url.host}", request=request)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        response = await route.handle_async_request(request)
+
+        if request.url.path.endswith("/federation/messages") and response.status_code == 200:
+            await response.aread()
+            now = time.perf_counter()
+            for ack in json.loads(response.content)["results"]:
+                if ack["status"] in ("accepted", "duplicate"):
+                    self.acked.setdefault(ack["id"], now)
+        return response
+
+
+class Stats:
+    def __init__(self):
+        self.sent: Dict[str, float] = {}
+        # message id -> (sender handle, recipient handle)
+        self.routes: Dict[str, Tuple[str, str]] = {}
+        self.errors = 0
+        self.depth: List[Tuple[float, int]] = []
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+async def _admin(database_url: str, statements: List[str]) -> None:
+    engine = create_async_engine(database_url, isolation_level="AUTOCOMMIT")
+    try:
+        async with engine.connect() as conn:
+            for statement in statements:
+                await conn.execute(text(statement))
+    finally:
+        await engine.dispose()
+
+
+async def _register(client: httpx.AsyncClient, node: Node, count: int) -> List[Tuple[str, str]]:
+    """
+    Create `count` users on a node; returns (handle, access token) pairs
+    """
+    users = []
+    for n in range(count):
+        response = await client.post(
+            f"https://{node.domain}/api/auth/register",
+            json={
+                "username": f"user{n}",
+                "password": "bench-password",
+                "public_key": f"bench-key-{n}",
+                "public_key_fingerprint": f"bench-{n}",
+            }
+        )
+        response.raise_for_status()
+        body = response.json()
+        users.append((body["full_handle"], body["access_token"]))
+    return users
+
+
+async def _warm_up(client: httpx.AsyncClient, users: Dict[str, List[Tuple[str, str]]]) -> None:
+    """
+    Resolve every remote handle on every node before measuring
+
+    Cold directory caches make the first sends look peers up while holding
+    a database connection; under full load that would dominate the numbers.
+    """
+    limit = asyncio.Semaphore(8)
+
+    async def lookup(domain: str, handle: str) -> None:
+        # Remote lookups are only open to signed-in users
+        _, token = users[domain][0]
+        async with limit:
+            response = await client.get(
+                f"https://{domain}/api/keys/{handle}",
+                headers={"Authorization": f"Bearer {token}"}
+            )
+            response.raise_for_status()
+
+    await asyncio.gather(*(
+        lookup(domain, handle)
+        for domain in users
+        for other, accounts in users.items() if other != domain
+        for handle, _ in accounts
+    ))
+
+
+async def _send(
+    client: httpx.AsyncClient,
+    domain: str,
+    sender: Tuple[str, str],
+    recipient: str,
+    size: int,
+    stats: Stats
+) -> None:
+    handle, token = sender
+    started = time.perf_counter()
+    try:
+        response = await client.post(
+            f"https://{domain}/api/messages",
+            json={
+                "recipient_handle": recipient,
+                "encrypted_content": base64.b64encode(os.urandom(size)).decode(),
+                "iv": base64.b64encode(os.urandom(12)).decode(),
+            },
+            headers={"Authorization": f"Bearer {token}"}
+        )
+    except httpx.HTTPError:
+        stats.errors += 1
+        return
+    if response.status_code != 201:
+        stats.errors += 1
+        return
+    message_id = response.json()["id"]
+    stats.sent[message_id] = started
+    stats.routes[message_id] = (handle, recipient)
+
+
+async def _sample_depth(nodes: List[Node], stats: Stats, interval: float, started: float) -> None:
+    while True:
+        depths = await asyncio.gather(*(node.queue_depth() for node in nodes))
+        stats.depth.append((time.perf_counter() - started, sum(depths)))
+        await asyncio.sleep(interval)
+
+
+async def run(args: argparse.Namespace) -> None:
+    from app.core.config import Settings
+
+    base = Settings()
+    db_names = [f"{base.DB_NAME}_bench_{n}" for n in range(args.nodes)]
+    admin_url = base.DATABASE_URL.rsplit("/", 1)[0] + "/postgres"
+    await _admin(admin_url, [f'DROP DATABASE IF EXISTS "{name}"' for name in db_names]
+                 + [f'CREATE DATABASE "{name}"' for name in db_names])
+
+    network = Network(args.latency_ms / 1000)
+    stats = Stats()
+    workdir = tempfile.TemporaryDirectory(prefix="mychat-bench-")
+    try:
+        nodes = [Node(n, name, workdir.name) for n, name in enumerate(db_names)]
+        for node in nodes:
+            network.attach(node)
+            node.module("app.services.federation")._client = httpx.AsyncClient(transport=network)
+
+        async with AsyncExitStack() as stack:
+            for node in nodes:
+                await stack.enter_async_context(node.app.router.lifespan_context(node.app))
+            client = await stack.enter_async_context(httpx.AsyncClient(transport=network, timeout=60))
+
+            users = {node.domain: await _register(client, node, args.users) for node in nodes}
+            await _warm_up(client, users)
+            print(f"{args.nodes} nodes, {args.users} users each; "
+                  f"offering {args.rate} msg/s for {args.duration}s", flush=True)
+
+            started = time.perf_counter()
+            sampler = asyncio.create_task(_sample_depth(nodes, stats, args.sample_interval, started))
+            sends = set()
+            for n in range(int(args.rate * args.duration)):
+                # Open loop: send on schedule whether or not earlier sends finished
+                delay = started + n / args.rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                sender_node, recipient_node = random.sample(nodes, 2)
+                sender = random.choice(users[sender_node.domain])
+                recipient, _ = random.choice(users[recipient_node.domain])
+                task = asyncio.create_task(_send(client, sender_node.domain, sender, recipient, args.size, stats))
+                sends.add(task)
+                task.add_done_callback(sends.discard)
+            if sends:
+                await asyncio.wait(sends)
+
+            # Drain: wait for everything sent to be acknowledged
+            deadline = time.perf_counter() + args.drain_timeout
+            while not stats.sent.keys() <= network.acked.keys() and time.perf_counter() < deadline:
+                await asyncio.sleep(0.1)
+            elapsed = time.perf_counter() - started
+            sampler.cancel()
+            depths = await asyncio.gather(*(node.queue_depth() for node in nodes))
+            stats.depth.append((elapsed, sum(depths)))
+            if args.check:
+                failures = await _check(client, nodes, users, stats, network)
+    finally:
+        workdir.cleanup()
+        if not args.keep_databases:
+            await _admin(admin_url, [f'DROP DATABASE IF EXISTS "{name}"' for name in db_names])
+
+    _report(stats, network, elapsed)
+    if args.check:
+        for failure in failures:
+            print(f"FAIL {failure}")
+        print("check failed" if failures else "check passed")
+        if failures:
+            sys.exit(1)
+
+
+async def _stored_copies(node: Node, message_ids: List[str]) -> Dict[str, int]:
+    """
+    How many rows hold each message on a recipient's node (by origin id)
+    """
+    async with node.module("app.db.database").async_session_maker() as db:
+        result = await db.execute(
+            text(
+                "SELECT origin_message_id::text, count(*) FROM messages "
+                "WHERE origin_message_id::text = ANY(:ids) GROUP BY 1"
+            ),
+            {"ids": message_ids}
+        )
+        return dict(result.all())
+
+
+async def _conversation(client: httpx.AsyncClient, domain: str, token: str, handle: str) -> List[dict]:
+    """
+    Every message of a conversation through the API, page by page
+    """
+    messages: List[dict] = []
+    cursor = None
+    while True:
+        params = {"limit": 100, **({"cursor": cursor} if cursor else {})}
+        response = await client.get(
+            f"https://{domain}/api/messages/conversation/{handle}",
+            params=params,
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        response.raise_for_status()
+        page = response.json()
+        messages += page["messages"]
+        cursor = page["next_cursor"]
+        if not page["has_more"]:
+            return messages
+
+
+async def _check(
+    client: httpx.AsyncClient,
+    nodes: List[Node],
+    users: Dict[str, List[Tuple[str, str]]],
+    stats: Stats,
+    network: Network
+) -> List[str]:
+    """
+    Verify the run's deliveries; returns a description of each failure
+    """
+    failures = []
+    if stats.errors:
+        failures.append(f"{stats.errors} sends failed")
+    unacked = stats.sent.keys() - network.acked.keys()
+    if unacked:
+        failures.append(f"{len(unacked)} messages never acknowledged")
+
+    tokens = {handle: token for accounts in users.values() for handle, token in accounts}
+    for node in nodes:
+        received = [
+            message_id for message_id, (_, recipient) in stats.routes.items()
+            if recipient.endswith(f"@{node.domain}")
+        ]
+        copies = await _stored_copies(node, received)
+        missing = [message_id for message_id in received if copies.get(message_id, 0) == 0]
+        repeated = [message_id for message_id in received if copies.get(message_id, 0) > 1]
+        if missing:
+            failures.append(f"{node.domain}: {len(missing)} messages not stored")
+        if repeated:
+            failures.append(f"{node.domain}: {len(repeated)} messages stored more than once")
+
+    # Both directions of a conversation, as seen by one of its participants
+    conversations: Dict[Tuple[str, str], int] = {}
+    for pair in stats.routes.values():
+        key = tuple(sorted(pair))
+        conversations[key] = conversations.get(key, 0) + 1
+    for (viewer, peer), expected in conversations.items():
+        domain = viewer.split("@", 1)[1]
+        listed = await _conversation(client, domain, tokens[viewer], peer)
+        ids = [message["id"] for message in listed]
+        stamps = [datetime.fromisoformat(message["created_at"]) for message in listed]
+        if len(ids) != len(set(ids)):
+            failures.append(f"{viewer} / {peer}: conversation pages repeat messages")
+        if len(ids) != expected:
+            failures.append(f"{viewer} / {peer}: {len(ids)} messages listed, {expected} sent")
+        if stamps != sorted(stamps, reverse=True):
+            failures.append(f"{viewer} / {peer}: conversation not newest first")
+    return failures
+
+
+def _report(stats: Stats, network: Network, elapsed: float) -> None:
+    latencies = sorted(
+        (network.acked[message_id] - sent) * 1000
+        for message_id, sent in stats.sent.items() if message_id in network.acked
+    )
+    delivered = len(latencies)
+    print(f"sent {len(stats.sent)} ({stats.errors} send errors), delivered {delivered} "
+          f"in {elapsed:.1f}s: {delivered / elapsed:.1f} delivered/s")
+    if latencies:
+        print("end-to-end latency ms: " + ", ".join(
+            f"{name} {_percentile(latencies, fraction):.1f}"
+            for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99))
+        ) + f", max {latencies[-1]:.1f}")
+    print("pending in message_queue:")
+    for at, depth in stats.depth:
+        print(f"  {at:7.1f}s {depth:8d}")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--nodes", type=int, default=2, help="nodes to boot (at least 2)")
+    parser.add_argument("--users", type=int, default=10, help="users per node")
+    parser.add_argument("--rate", type=float, default=50, help="messages per second, across all nodes")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of sending")
+    parser.add_argument("--size", type=int, default=256, help="ciphertext bytes per message")
+    parser.add_argument("--latency-ms", type=float, default=0, help="added to every request between nodes")
+    parser.add_argument("--sample-interval", type=float, default=1, help="seconds between queue depth samples")
+    parser.add_argument("--drain-timeout", type=float, default=60, help="seconds to wait for deliveries after sending")
+    parser.add_argument("--keep-databases", action="store_true", help="leave the node databases in place")
+    parser.add_argument("--check", action="store_true", help="verify deliveries and exit non-zero on failure")
+    args = parser.parse_args(argv)
+    if args.nodes < 2:
+        parser.error("--nodes must be at least 2")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -63,7 +63,7 @@ fi
 
 # Create directories
 echo "Creating directories..."
-mkdir -p /opt/mychat/{config,data/backups,data/uploads}
+mkdir -p /opt/mychat/{config,data/backups,data/uploads,data/attachments}
 chown -R mychat:mychat /opt/mychat
 
 # Setup PostgreSQL
@@ -104,6 +104,9 @@ ADMIN_EMAIL=$ADMIN_EMAIL
 SESSION_TIMEOUT_HOURS=168
 MAX_MESSAGE_SIZE=10485760
 MAX_FILE_SIZE=52428800
+ATTACHMENTS_DIR=/opt/mychat/data/attachments
+ATTACHMENTS_ACCEL_REDIRECT_PREFIX=/protected-attachments/
+NODE_KEY_PATH=/opt/mychat/config/node_key.pem
 FEDERATION_ENABLED=true
 REGISTRATION_OPEN=true
 CORS_ORIGINS=https://$DOMAIN
@@ -137,6 +140,11 @@ server {
         try_files $uri $uri/ /index.html;
     }
 
+    # Prometheus metrics are for local scrapers only
+    location = /metrics {
+        deny all;
+    }
+
     # API proxy
     location /api {
         proxy_pass http://localhost:8000;
@@ -146,13 +154,38 @@ server {
         proxy_set_header X-Forwarded-Proto $scheme;
     }
 
-    # WebSocket proxy
-    location /ws {
+    # Attachment uploads: stream the body through instead of buffering it
+    location /api/attachments {
+        client_max_body_size 50m;
+        proxy_request_buffering off;
+        proxy_pass http://localhost:8000;
+        proxy_set_header Host $host;
+        proxy_set_header X-Real-IP $remote_addr;
+        proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
+        proxy_set_header X-Forwarded-Proto $scheme;
+    }
+
+    # Attachment files, served with sendfile after the API authorizes the
+    # download (X-Accel-Redirect); nginx handles Range requests here
+    location /protected-attachments/ {
+        internal;
+        alias /opt/mychat/data/attachments/;
+        sendfile on;
+    }
+
+    # WebSocket proxy (the endpoint lives under /api, so this must be its
+    # own location for the upgrade headers); idle sockets stay open
+    location /api/ws {
         proxy_pass http://localhost:8000;
         proxy_http_version 1.1;
         proxy_set_header Upgrade $upgrade;
         proxy_set_header Connection "upgrade";
         proxy_set_header Host $host;
+        proxy_set_header X-Real-IP $remote_addr;
+        proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
+        proxy_set_header X-Forwarded-Proto $scheme;
+        proxy_read_timeout 3600s;
+        proxy_send_timeout 3600s;
     }
 }
 NGINXCONF
@@ -1,4 +1,12 @@
 #!/bin/bash
 cd /home/fphillips/MyChat/backend
 source venv/bin/activate
-exec uvicorn app.main:app --host 0.0.0.0 --port 8000
+export MYCHAT_WORKERS="${MYCHAT_WORKERS:-1}"
+# More than one worker requires FANOUT_BACKEND=redis; the app refuses to
+# start otherwise, check here too so the error is plain
+backend="${FANOUT_BACKEND:-$(sed -n 's/^FANOUT_BACKEND=//p' .env 2>/dev/null | tail -n 1)}"
+if [ "$MYCHAT_WORKERS" -gt 1 ] && [ "${backend:-local}" != "redis" ]; then
+    echo "MYCHAT_WORKERS=$MYCHAT_WORKERS requires FANOUT_BACKEND=redis" >&2
+    exit 1
+fi
+exec uvicorn app.main:app --host 0.0.0.0 --port 8000 --workers "$MYCHAT_WORKERS"